@@ -32,11 +32,12 @@ be lit to display that digit, using the classic 7-segment encoding.
 
 `bcycle` maps hour-of-day (0-23) to a brightness divisor ("bness"), giving
 the display a day/night dimming cycle - dimmer late at night, brighter
-during the day.
+during the day. The divisor is applied by the display's output lookup
+table (see `brightness_lut()`), so `smem` holds the raw values.
 
 Program flow
 ------------
-`smem` holds the current target brightness (0-255) for every one of the
+`smem` holds the current raw brightness (0-255) for every one of the
 1593 LEDs. `smem_prev` holds the values last actually pushed to the
 display hardware, paired with an `initialized` boolean mask so every LED
 gets sent at least once on the very first pass, without needing a sentinel
@@ -139,7 +140,7 @@ def preprocess_dig_data(dig_data):
 
     Returns a list of 5 dicts (one per digit position), each mapping a
     segment number to an (idx_array, val_array) pair of matching length,
-    ready for direct use as `smem[idx_array] = val_array // bness`.
+    ready for direct use as `smem[idx_array] = val_array`.
     """
     if not isinstance(dig_data, dict):
         raise TypeError("dig_data must be a dict keyed by position")
@@ -177,20 +178,32 @@ def digit_clear_indices(position_data):
     return np.concatenate(idx_arrays)
 
 
-def apply_segments(smem, position_data, segments, bness, accumulate=False):
+def brightness_lut(bness):
+    """Output lookup table dividing every value by the brightness divisor."""
+    return (np.arange(256) // bness).astype("uint8")
+
+
+def set_brightness(dis, bness):
+    """Dim the display by bness. The display resends the LEDs it has
+    already set through the new lookup table itself, so they don't need
+    pushing again; the change shows with the next push."""
+    dis.set_output_lut(brightness_lut(bness))
+
+
+def apply_segments(smem, position_data, segments, accumulate=False):
     """
     Light (or accumulate into) the LEDs for the given segment numbers of
-    one digit position, scaled by the current brightness divisor.
+    one digit position.
     """
     for n in segments:
         idx, vals = position_data.get(n, (_EMPTY_IDX, _EMPTY_VALS))
         if idx.size == 0:
             continue
-        scaled = (vals // bness).astype(smem.dtype)
+        vals = vals.astype(smem.dtype)
         if accumulate:
-            smem[idx] += scaled
+            smem[idx] += vals
         else:
-            smem[idx] = scaled
+            smem[idx] = vals
 
 
 def clear_digit(smem, clear_idx):
@@ -214,17 +227,18 @@ def push_changes(dis, smem, smem_prev, initialized):
         dis.show_now()
 
 
-def flash_dots(dis, points_idx, points_vals, bness, m):
-    """Flash the colon dots once per second until the minute changes."""
+def flash_dots(dis, dots, points_vals, m):
+    """Flash the colon dots (a compiled LED group) once per second until
+    the minute changes."""
     t = datetime.now().time()
     s = t.second
-    dot_rgb = np.zeros((points_idx.size, 3), dtype="uint8")
+    dot_rgb = np.zeros((len(dots), 3), dtype="uint8")
 
     while t.minute == m:
         while datetime.now().time().second == s:
             pass
-        dot_rgb[:, 0] = (s % 2) * (points_vals // bness)
-        dis.set_leds(points_idx, dot_rgb)
+        dot_rgb[:, 0] = (s % 2) * points_vals
+        dots.set_leds(dot_rgb)
         dis.show_now()
         t = datetime.now().time()
         s = t.second
@@ -249,20 +263,22 @@ def main():
     smem_prev = np.zeros(N_LEDS, dtype="uint8")
     initialized = np.zeros(N_LEDS, dtype=bool)
 
-    with Display1593() as dis:
+    # Ride out a board's USB link dropping (reopening its port and
+    # restoring its leds) rather than exiting to be restarted by systemd
+    with Display1593(reconnect_timeout=1.0) as dis:
         t = datetime.now().time()
         hr, m = t.hour, t.minute
         d4, d3 = hour_digits(hr)
         d2, d1 = minute_digits(m)
 
-        bness = BCYCLE[hr % 24]
+        set_brightness(dis, BCYCLE[hr % 24])
 
         # Initial paint of points, hours, and tens-of-minutes.
         # (smem starts at 0, so accumulate vs. overwrite is equivalent here.)
-        apply_segments(smem, processed[0], range(2), bness, accumulate=True)
-        apply_segments(smem, processed[1], D_CHARS[d4], bness, accumulate=True)
-        apply_segments(smem, processed[2], D_CHARS[d3], bness, accumulate=True)
-        apply_segments(smem, processed[3], D_CHARS[d2], bness, accumulate=True)
+        apply_segments(smem, processed[0], range(2), accumulate=True)
+        apply_segments(smem, processed[1], D_CHARS[d4], accumulate=True)
+        apply_segments(smem, processed[2], D_CHARS[d3], accumulate=True)
+        apply_segments(smem, processed[3], D_CHARS[d2], accumulate=True)
 
         # Colon dot LEDs/values, precomputed once for the flashing loop.
         points_idx = np.concatenate(
@@ -271,18 +287,17 @@ def main():
         points_vals = np.concatenate(
             [processed[0][n][1] for n in range(2) if processed[0][n][1].size]
         )
+        dots = dis.compile_group(points_idx)
 
         while True:
-            apply_segments(
-                smem, processed[4], D_CHARS[d1], bness, accumulate=True
-            )
+            apply_segments(smem, processed[4], D_CHARS[d1], accumulate=True)
             push_changes(dis, smem, smem_prev, initialized)
 
             t = datetime.now().time()
             hr, m = t.hour, t.minute
             logger.info("%2d:%2d", hr, m)
 
-            flash_dots(dis, points_idx, points_vals, bness, m)
+            flash_dots(dis, dots, points_vals, m)
 
             m = (m + 1) % 60
             if m == 0:
@@ -294,21 +309,21 @@ def main():
                 d2 = m // 10
                 clear_digit(smem, clear_idx[3])
                 apply_segments(
-                    smem, processed[3], D_CHARS[d2], bness, accumulate=True
+                    smem, processed[3], D_CHARS[d2], accumulate=True
                 )
 
             if m == 0:
-                bness = BCYCLE[hr % 24]
+                set_brightness(dis, BCYCLE[hr % 24])
                 d4, d3 = hour_digits(hr)
 
                 clear_digit(smem, clear_idx[2])
                 apply_segments(
-                    smem, processed[2], D_CHARS[d3], bness, accumulate=True
+                    smem, processed[2], D_CHARS[d3], accumulate=True
                 )
 
                 clear_digit(smem, clear_idx[1])
                 apply_segments(
-                    smem, processed[1], D_CHARS[d4], bness, accumulate=True
+                    smem, processed[1], D_CHARS[d4], accumulate=True
                 )
 
             clear_digit(smem, clear_idx[4])
@@ -0,0 +1,88 @@
+"""Benchmark the display driver against emulated Teensy boards.
+
+Runs the same kinds of frame updates as frame_display_speed_test.py,
+but against display1593.emulator's pseudo-terminal boards instead of
+the real display, so it can be run on any Linux machine - e.g. to
+check a driver change for performance regressions.
+
+    python emulator_speed_test.py --baud-rate 57600 --command-time 0.001
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from display1593 import Display1593
+from display1593.display1593 import BAUD_RATE
+from display1593.emulator import start_emulators
+
+N_FRAMES = 100
+
+
+def full_frames(n_frames):
+    """Every led changes every frame (as in frame_display_speed_test)."""
+    return [np.full((1593, 3), i % 32, dtype="uint8") for i in range(n_frames)]
+
+
+def sparse_frames(n_frames, n_changed=50, seed=0):
+    """A few random leds change each frame."""
+    rng = np.random.default_rng(seed)
+    frame = np.zeros((1593, 3), dtype="uint8")
+    frames = []
+    for _ in range(n_frames):
+        frame = frame.copy()
+        leds = rng.choice(1593, size=n_changed, replace=False)
+        frame[leds] = rng.integers(0, 32, size=(n_changed, 3))
+        frames.append(frame)
+    return frames
+
+
+def run(dis, method, frames):
+    """Send each frame with the given method and latch it; return the
+    number of frames per second achieved."""
+    dis.clear_all()
+    dis.sync()
+    start = time.perf_counter()
+    for frame in frames:
+        method(frame)
+        dis.show_now()
+    dis.sync()
+    return len(frames) / (time.perf_counter() - start)
+
+
+def main(baud_rate, command_time, n_frames):
+    with start_emulators(
+        baud_rate=baud_rate, command_time=command_time
+    ) as emulators:
+        ports = [emulator.port for emulator in emulators]
+        with Display1593(
+            ports=ports, lock_path="/tmp/display1593-emulator.lock"
+        ) as dis:
+            tests = [
+                ("set_all_leds, full frames", dis.set_all_leds, full_frames),
+                ("set_frame, full frames", dis.set_frame, full_frames),
+                ("set_frame, sparse frames", dis.set_frame, sparse_frames),
+            ]
+            for label, method, make_frames in tests:
+                fps = run(dis, method, make_frames(n_frames))
+                print(f"{label:28s} {fps:8.1f} fps")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--baud-rate",
+        type=float,
+        default=BAUD_RATE,
+        help=f"emulated link speed in bits/s (default: {BAUD_RATE})",
+    )
+    parser.add_argument(
+        "--command-time",
+        type=float,
+        default=0.0,
+        help="emulated firmware time per command in seconds (default: 0)",
+    )
+    parser.add_argument("--frames", type=int, default=N_FRAMES)
+    args = parser.parse_args()
+    main(args.baud_rate, args.command_time, args.frames)
@@ -1,15 +1,13 @@
-import time
-from collections import deque
 from itertools import cycle
 from pathlib import Path
 
 import numpy as np
 from display1593 import Display1593
+from display1593.player import FramePlayer, RateGovernor
 
 
 DATA_DIR = Path(__file__).parent / "data"
-TIME_STEP = 0.0625  # seconds
-MAX_LOGGED_TIMES = 1000
+TIME_STEP = 0.0625  # seconds, at the fastest
 
 
 def load_led_frames(data_dir):
@@ -23,40 +21,20 @@ def main(dis, img_data):
     dis.clear_all()
 
     print("Starting...")
-    img_cycle = cycle(img_data)
-
-    # Prepare to log timing
-    start_time = time.monotonic()
-    scheduled_times = deque(maxlen=MAX_LOGGED_TIMES)
-    actual_times = deque(maxlen=MAX_LOGGED_TIMES)
-    wait_times = deque(maxlen=MAX_LOGGED_TIMES)
-
-    next_time = time.monotonic()
+    player = FramePlayer(
+        dis,
+        cycle(img_data),
+        governor=RateGovernor(max_fps=1 / TIME_STEP),
+    )
     try:
-        while True:
-            z = next(img_cycle)
-            dis.set_all_leds(z)
-
-            next_time += TIME_STEP
-            scheduled_times.append(next_time)
-
-            # Synchronize display to clock
-            wait_time = max(0, next_time - time.monotonic())
-            wait_times.append(wait_time)
-            time.sleep(wait_time)
-            dis.show_now()
-
-            actual_times.append(time.monotonic())
-
+        player.play()
     except KeyboardInterrupt:
         print("Stopped.")
 
-    # Convert to elapsed time since start
-    scheduled_times = np.array(scheduled_times) - start_time
-    actual_times = np.array(actual_times) - start_time
-
-    for sch, act, wait in zip(scheduled_times, actual_times, wait_times):
+    for sch, act, wait in player.history:
         print(f"{sch:6.3f} {act:6.3f} {wait * 1000:6.2f} ms")
+    print(player.stats())
+    print(dis.timer.stats())
 
 
 if __name__ == "__main__":
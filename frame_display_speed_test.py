@@ -1,10 +1,11 @@
 # Simple test script
 
-import time
+from itertools import cycle
 
 import numpy as np
 
 from display1593 import Display1593
+from display1593.player import FramePlayer, RateGovernor
 
 dis = Display1593()
 dis.connect()
@@ -15,34 +16,22 @@ data = []
 for col in range(N_FRAMES):
     data.append(np.full((1593, 3), col, dtype="uint8"))
 
-FRAME_PERIOD = 0.050  # 50 ms (20 Hz)
-
-next_frame_time = time.perf_counter()
+# Count up, then down (skipping the first and last frames), as fast as
+# the display keeps up with
+player = FramePlayer(
+    dis,
+    cycle(data + data[-2:0:-1]),
+    send=dis.set_all_leds,
+    governor=RateGovernor(),
+)
 
 try:
-    while True:
-        # Count up
-        for d in data:
-            dis.set_all_leds(d)
-            dis.show_now()
-
-            next_frame_time += FRAME_PERIOD
-            delay = next_frame_time - time.perf_counter()
-            if delay > 0:
-                time.sleep(delay)
-
-        # Count down (skip first and last frames)
-        for d in data[-2:0:-1]:
-            dis.set_all_leds(d)
-            dis.show_now()
-
-            next_frame_time += FRAME_PERIOD
-            delay = next_frame_time - time.perf_counter()
-            if delay > 0:
-                time.sleep(delay)
-
+    player.play()
 except KeyboardInterrupt:
     pass
 
+print(player.stats())
+print(dis.timer.stats())
+
 dis.clear_all()
 dis.show_now()
@@ -169,6 +169,7 @@ class Agent:
         )
         if show:
             self.show()
+            self.population.display.show_now()
 
     def show(self):
         """Show the agent on the LED array by lighting the
@@ -187,7 +188,6 @@ class Agent:
             np.array([self.id], dtype=np.int32),
             np.array([self.population.background_col], dtype=np.uint8),
         )
-        self.population.display.show_now()
 
 
 class Population:
@@ -335,6 +335,7 @@ class Population:
                 agent.show()
                 logger.info("Agent %d moved.", agent.id)
 
+        self.display.show_now()
         return any_moved
 
     def move_next_agent(self):
@@ -365,6 +366,7 @@ class Population:
                     break
 
             agent.show()
+            self.display.show_now()
             logger.info("Agent %d moved.", agent.id)
             self.last_agent = i
             return agent
@@ -424,7 +426,9 @@ def main(n_neighbours=12):
 
     logger.info("\n\n------- Schelling Segregation Model Simulation -------\n")
 
-    dis = Display1593()
+    # Buffered, so each tick's LED changes go out together as one
+    # command per board when show_now() is called
+    dis = Display1593(buffered=True)
     dis.connect()
     try:
         cols = list(COLOURS)
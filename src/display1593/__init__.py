@@ -1,4 +1,4 @@
-__all__ = ["Display1593"]
+__all__ = ["AsyncDisplay1593", "Display1593"]
 
 
 def __getattr__(name):
@@ -9,4 +9,8 @@ def __getattr__(name):
         from .display1593 import Display1593
 
         return Display1593
+    if name == "AsyncDisplay1593":
+        from .async_display import AsyncDisplay1593
+
+        return AsyncDisplay1593
     raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
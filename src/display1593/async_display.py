@@ -0,0 +1,470 @@
+"""An asyncio version of the Display1593 driver.
+
+Display1593 hands each command to a pair of worker threads per board
+(see display1593.board_worker) and returns, but its callers still
+block whenever a board's queue is full, and scripts that pace their
+frames with time.sleep() can't compute the next frame while the
+current one is on the wire. AsyncDisplay1593 has the same commands as
+coroutines, and does all its serial I/O on the event loop instead:
+each board's file descriptor is registered with loop.add_reader() and
+(while there are bytes waiting to go out) loop.add_writer(), so
+rendering, pacing and I/O can all be interleaved in one thread.
+
+Each command coroutine returns once the command has been encoded and
+queued for every board it concerns, with a future for its
+acknowledgements:
+
+    async with AsyncDisplay1593() as dis:
+        while True:
+            ack = await dis.set_all_leds(frame)
+            await dis.show_now()
+            frame = next_frame()  # while the boards receive the last one
+            ...
+
+The future resolves to True once every board has acknowledged its
+command with the expected response, or to False if a response was
+invalid or never came (both are logged as warnings, as in
+Display1593). Like Display1593, up to ack_window commands per board are
+in flight at once (see display1593.pipeline), and a command coroutine
+only waits if more than DEFAULT_MAX_QUEUED commands are already queued
+for a board.
+
+The ports are still opened, and the boards identified, by the blocking
+handshake in Display1593.connect(), which connect() runs in the loop's
+default executor. The event loop must support add_reader() (i.e. not
+the Windows proactor loop).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from display1593.board_worker import DEFAULT_MAX_QUEUED
+from display1593.display1593 import Display1593
+from display1593.framing import READ_SIZE, ResponseParser, encode_message
+from display1593.led_group import LedGroup
+from display1593.lock import DEFAULT_TIMEOUT as DEFAULT_LOCK_TIMEOUT
+from display1593.pipeline import DEFAULT_ACK_TIMEOUT, DEFAULT_ACK_WINDOW
+
+logger = logging.getLogger(__name__)
+
+_WAIT_FOR_ACKS = object()
+
+
+class AsyncBoardConnection:
+    """Non-blocking, event-loop driven serial I/O with one board.
+
+    The asyncio counterpart of a BoardWorker and its AckPipeline:
+    commands submitted are written as soon as there is room in the
+    window, and each response read is matched to the oldest outstanding
+    command.
+
+    name: the board's name, e.g. "TEENSY1".
+    ser: an open serial.Serial connection to the board.
+    loop: the running event loop.
+    window, timeout: as for AckPipeline.
+    max_queued: number of commands waiting to be written at which
+        wait_for_room() starts waiting.
+    stats: a CommandStats to record the board's commands in, or None.
+    """
+
+    def __init__(
+        self,
+        name,
+        ser,
+        loop,
+        window=DEFAULT_ACK_WINDOW,
+        timeout=DEFAULT_ACK_TIMEOUT,
+        max_queued=DEFAULT_MAX_QUEUED,
+        stats=None,
+    ):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.name = name
+        self.ser = ser
+        self.window = window
+        self.timeout = timeout
+        self.max_queued = max_queued
+        self.stats = stats
+        self._loop = loop
+        self._fd = ser.fileno()
+        os.set_blocking(self._fd, False)
+        # (cmd, future) pairs not yet written (and wait_for_acks()
+        # markers), and written (or being written) but not yet
+        # acknowledged, oldest first
+        self._queued = deque()
+        self._pending = deque()
+        # Bytes waiting to be written, and (end offset, cmd, kind,
+        # length, encode time, time queued) for each command in them, to
+        # time the writes
+        self._out = bytearray()
+        self._out_total = 0
+        self._written_total = 0
+        self._writes = deque()
+        self._writing = False
+        self._parser = ResponseParser()
+        self._timer = None
+        self._waiters = []
+        self._error = None
+        loop.add_reader(self._fd, self._on_readable)
+
+    def wait_for_acks(self):
+        """Hold back the commands submitted after this until every
+        command submitted before it has been acknowledged (or timed
+        out)."""
+        self._raise_error()
+        self._queued.append(_WAIT_FOR_ACKS)
+        self._pump()
+
+    def submit(self, cmd):
+        """Queue cmd (a WireCommand) to be sent to the board, returning
+        a future for whether it was acknowledged correctly."""
+        self._raise_error()
+        future = self._loop.create_future()
+        self._queued.append((cmd, future))
+        self._pump()
+        return future
+
+    async def wait_for_room(self):
+        """Wait until fewer than max_queued commands are queued."""
+        await self._wait_until(lambda: len(self._queued) < self.max_queued)
+
+    async def drain(self):
+        """Wait until every command submitted so far has been sent and
+        acknowledged (or timed out)."""
+        await self._wait_until(lambda: not (self._queued or self._pending))
+
+    def close(self):
+        """Stop watching the board's file descriptor. Doesn't close the
+        serial connection."""
+        self._loop.remove_reader(self._fd)
+        self._set_writing(False)
+        self._cancel_timer()
+
+    async def _wait_until(self, predicate):
+        while not predicate():
+            self._raise_error()
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            await waiter
+        self._raise_error()
+
+    def _wake_waiters(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _raise_error(self):
+        # Unlike a BoardWorker's, the error is kept: the connection is
+        # no longer being watched after it
+        if self._error is not None:
+            raise self._error
+
+    def _pump(self):
+        # Move queued commands into the window, write what we can, and
+        # let any waiting coroutines re-check their conditions
+        while self._queued and len(self._pending) < self.window:
+            if self._queued[0] is _WAIT_FOR_ACKS:
+                if self._pending:
+                    break
+                self._queued.popleft()
+                continue
+            cmd, future = self._queued.popleft()
+            self._pending.append((cmd, future))
+            if len(self._pending) == 1:
+                self._restart_timer()
+            message = encode_message(cmd.data)
+            self._out += message
+            self._out_total += len(message)
+            self._writes.append(
+                (
+                    self._out_total,
+                    cmd,
+                    cmd.kind,
+                    cmd.length,
+                    cmd.encode_time,
+                    time.perf_counter(),
+                )
+            )
+        self._write()
+        self._wake_waiters()
+
+    def _write(self):
+        if self._error is not None:
+            return
+        if self._out:
+            try:
+                n_written = os.write(self._fd, self._out)
+            except BlockingIOError:
+                n_written = 0
+            except OSError as err:
+                self._fail(err)
+                return
+            del self._out[:n_written]
+            self._written_total += n_written
+        now = time.perf_counter()
+        while self._writes and self._writes[0][0] <= self._written_total:
+            _, cmd, kind, length, encode_time, queued_at = (
+                self._writes.popleft()
+            )
+            # Its ack time is counted from here. (If cmd has already
+            # timed out and been reused, this is overwritten again when
+            # it is next written.)
+            cmd.written_at = now
+            if self.stats is not None:
+                self.stats.record_write(
+                    self.name, kind, length, encode_time, now - queued_at
+                )
+        self._set_writing(bool(self._out))
+
+    def _set_writing(self, writing):
+        if writing and not self._writing:
+            self._loop.add_writer(self._fd, self._write)
+        elif not writing and self._writing:
+            self._loop.remove_writer(self._fd)
+        self._writing = writing
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self._fail(err)
+            return
+        if not data:
+            self._fail(ConnectionError(f"{self.name} closed the connection"))
+            return
+        for response in self._parser.feed(data):
+            self._handle_response(response)
+        self._pump()
+
+    def _handle_response(self, response):
+        # As AckPipeline.handle_response()
+        received_at = time.perf_counter()
+        if np.array_equal(response[:2], [0, 0]):
+            logger.debug("Debug msg: %s", bytes(response[2:]).decode())
+            if self.stats is not None:
+                self.stats.record_debug_message(self.name)
+            return
+        if not self._pending:
+            logger.warning("Unexpected resp %s", response)
+            if self.stats is not None:
+                self.stats.record_unexpected(self.name)
+            return
+        cmd, future = self._pending.popleft()
+        valid = np.array_equal(response, cmd.expected_response)
+        if valid:
+            logger.debug("Resp rec'd")
+        else:
+            logger.warning(
+                "Resp invalid, expected %s, got %s",
+                cmd.expected_response,
+                response,
+            )
+        if self.stats is not None:
+            self.stats.record_ack(
+                self.name, cmd.kind, received_at - cmd.written_at, valid
+            )
+        cmd.release()
+        if not future.done():
+            future.set_result(valid)
+        self._restart_timer()
+
+    def _restart_timer(self):
+        # If no response at all arrives for `timeout` seconds, give up
+        # on the oldest command
+        self._cancel_timer()
+        if self._pending:
+            self._timer = self._loop.call_later(
+                self.timeout, self._on_timeout
+            )
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_timeout(self):
+        self._timer = None
+        if not self._pending:
+            return
+        logger.warning("Timeout")
+        cmd, future = self._pending.popleft()
+        if self.stats is not None:
+            self.stats.record_timeout(self.name, cmd.kind)
+        cmd.release()
+        if not future.done():
+            future.set_result(False)
+        self._restart_timer()
+        self._pump()
+
+    def _fail(self, err):
+        logger.error("Error on %s: %s", self.name, err)
+        self._error = err
+        self.close()
+        for item in (*self._pending, *self._queued):
+            if item is _WAIT_FOR_ACKS:
+                continue
+            cmd, future = item
+            cmd.release()
+            if not future.done():
+                future.set_exception(err)
+        self._pending.clear()
+        self._queued.clear()
+        self._wake_waiters()
+
+
+async def _all_acknowledged(futures):
+    return all(await asyncio.gather(*futures))
+
+
+class AsyncLedGroup(LedGroup):
+    """A LedGroup of an AsyncDisplay1593, from its compile_group(), with
+    set_leds() and set_leds_one_colour() as coroutines like the
+    display's own (returning a future for the acknowledgements)."""
+
+    async def set_leds(self, rgb_array):
+        return await self.display._call(
+            lambda dis: LedGroup.set_leds(self, rgb_array)
+        )
+
+    async def set_leds_one_colour(self, rgb):
+        return await self.display._call(
+            lambda dis: LedGroup.set_leds_one_colour(self, rgb)
+        )
+
+
+class AsyncDisplay1593(Display1593):
+    """Display1593 with asyncio coroutines for its commands.
+
+    Takes the same arguments as Display1593. Use it as an async context
+    manager (or await connect() and disconnect()); the command
+    coroutines return a future for the commands' acknowledgements (see
+    the module docstring).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._boards = []
+        # Futures for the commands sent by the current method call
+        self._sent = None
+
+    async def connect(
+        self, max_attempts=3, lock_timeout=DEFAULT_LOCK_TIMEOUT
+    ):
+        loop = asyncio.get_running_loop()
+        # Waiting for the lock and the boards' hello messages blocks, so
+        # is done in a thread
+        await loop.run_in_executor(
+            None, self._open_connections, max_attempts, lock_timeout
+        )
+        self._boards = [
+            AsyncBoardConnection(
+                name,
+                ser,
+                loop,
+                self.ack_window,
+                self.ack_timeout,
+                stats=self._stats,
+            )
+            for name, ser in zip(self.board_names, self._connections)
+        ]
+
+    async def disconnect(self):
+        # Wait for the responses to any commands still in flight before
+        # closing the ports
+        try:
+            await self.sync()
+        finally:
+            for board in self._boards:
+                board.close()
+            self._boards = []
+            self._close_connections()
+
+    async def sync(self):
+        """Wait until every command sent so far has been acknowledged
+        by its board (or timed out)."""
+        await asyncio.gather(*(board.drain() for board in self._boards))
+
+    def _send(self, board, cmd):
+        self._sent.append(self._boards[board].submit(cmd))
+
+    async def _call(self, method, *args):
+        # Run one of Display1593's (non-blocking, with _send() above)
+        # methods, then wait for room in the boards' queues
+        self._sent = []
+        try:
+            method(self, *args)
+            sent = self._sent
+        finally:
+            self._sent = None
+        for board in self._boards:
+            await board.wait_for_room()
+        return asyncio.ensure_future(_all_acknowledged(sent))
+
+    def compile_group(self, leds):
+        return AsyncLedGroup(self, leds)
+
+    async def clear_all(self):
+        return await self._call(Display1593.clear_all)
+
+    async def set_led(self, i, rgb):
+        return await self._call(Display1593.set_led, i, rgb)
+
+    async def set_leds(self, leds, rgb_array):
+        return await self._call(Display1593.set_leds, leds, rgb_array)
+
+    async def set_leds_one_colour(self, leds, rgb):
+        return await self._call(Display1593.set_leds_one_colour, leds, rgb)
+
+    async def set_all_leds(self, rgb_array):
+        return await self._call(Display1593.set_all_leds, rgb_array)
+
+    async def set_all_leds_one_colour(self, rgb):
+        return await self._call(Display1593.set_all_leds_one_colour, rgb)
+
+    async def set_frame(self, rgb_array):
+        return await self._call(Display1593.set_frame, rgb_array)
+
+    async def stage_frame(self, rgb_array):
+        for board in self._boards:
+            board.wait_for_acks()
+        return await self.set_frame(rgb_array)
+
+    async def flush(self):
+        return await self._call(Display1593.flush)
+
+    async def set_output_lut(self, lut):
+        return await self._call(Display1593.set_output_lut, lut)
+
+    async def set_calibration(self, gains):
+        return await self._call(Display1593.set_calibration, gains)
+
+    async def show_image(self, filename, dimness=8):
+        return await self._call(Display1593.show_image, filename, dimness)
+
+    async def show_now(self):
+        return await self._call(Display1593.show_now)
+
+    async def show_at(self, t):
+        if self.buffered:
+            await self.flush()
+        await asyncio.sleep(t - time.monotonic())
+        return await self.show_now()
+
+    def __enter__(self):
+        raise TypeError("use 'async with' with AsyncDisplay1593")
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+        return False
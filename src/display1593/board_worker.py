@@ -0,0 +1,318 @@
+"""Background worker threads that own one board's serial connection.
+
+Each board gets a BoardWorker with its own command queue, a writer
+thread that takes commands off the queue and sends them (through an
+AckPipeline, so several can be in flight), and a reader thread that
+reads responses as they arrive (whatever is waiting on the port in one
+read, split into messages by a display1593.framing.ResponseParser) and
+matches them up. Display1593 just encodes a
+command and puts it on each board's queue, so the two USB links
+transmit at the same time: a full-frame update costs as long as the
+slower board takes, rather than the sum of both.
+
+Errors raised in the worker threads (e.g. a serial.SerialException if
+the board is unplugged) are stored and re-raised in the calling thread
+by the next submit() or sync() - unless the worker was given a
+`reconnect` function. Then, after an I/O error (an OSError, which
+includes serial.SerialException), the writer thread stops the reader,
+forgets the commands in flight, and calls reconnect() to reopen the
+port (retrying for up to reconnect_timeout seconds) before sending the
+commands from `replay` to restore the board's state and carrying on.
+If the board can't be reconnected in that time (or restoring its state
+fails), the worker gives up on it: the original error is raised by
+every later submit() or sync(), and the commands still queued are
+dropped.
+
+A command can also be submitted with a SyncedShow, to be written at the
+same moment as the matching commands to the other boards: each writer
+thread waits at the SyncedShow's barrier just before writing, so that
+all are released together. Display1593.show_now() uses this for the SN
+commands, so that both halves of the display latch their frame as
+close together as possible.
+"""
+
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+from display1593.framing import READ_SIZE, ResponseParser
+from display1593.pipeline import (
+    DEFAULT_ACK_TIMEOUT,
+    DEFAULT_ACK_WINDOW,
+    AckPipeline,
+)
+
+logger = logging.getLogger(__name__)
+
+# Commands that can be queued for a board before submit() blocks
+DEFAULT_MAX_QUEUED = 16
+# How often (seconds) the reader thread checks whether it should stop
+READ_POLL_INTERVAL = 0.1
+# Default time (seconds) to keep trying to reconnect after an I/O error,
+# and the pause between attempts
+DEFAULT_RECONNECT_TIMEOUT = 1.0
+RECONNECT_INTERVAL = 0.05
+
+_STOP = object()
+_WAIT_FOR_ACKS = object()
+_RECONNECT = object()
+
+
+class SyncedShow:
+    """Releases one command per board (normally SN) to be written at
+    the same time, and records how far apart the writes started (the
+    skew) in stats, a CommandStats, if given.
+
+    n_boards: number of writer threads taking part.
+    timeout: seconds a writer waits for the others before writing
+        anyway (logged as a warning; the skew is still recorded).
+    """
+
+    def __init__(self, n_boards, timeout, stats=None):
+        self.n_boards = n_boards
+        self.stats = stats
+        self._barrier = threading.Barrier(n_boards, timeout=timeout)
+        self._lock = threading.Lock()
+        self._write_times = []
+
+    def wait(self):
+        """Called by each writer thread right before it writes: wait for
+        the other writers, then note the time."""
+        try:
+            self._barrier.wait()
+        except threading.BrokenBarrierError:
+            logger.warning("Show not synchronized between the boards.")
+        now = time.perf_counter()
+        with self._lock:
+            self._write_times.append(now)
+            if len(self._write_times) < self.n_boards:
+                return
+            skew = max(self._write_times) - min(self._write_times)
+        if self.stats is not None:
+            self.stats.record_show_skew(skew)
+
+
+def _discard(item):
+    # Release the buffer of a queued command that won't be sent
+    if isinstance(item, tuple):
+        item = item[0]
+    if hasattr(item, "release"):
+        item.release()
+
+
+class BoardWorker:
+    """Writer and reader threads for the serial connection to one board.
+
+    name: the board's name, e.g. "TEENSY1" (used to name the threads).
+    ser: an open serial.Serial connection to the board.
+    window, timeout: passed on to AckPipeline.
+    max_queued: maximum number of commands waiting to be written
+        before submit() blocks.
+    stats: a CommandStats to record the board's commands in, or None.
+    reconnect: if given, a function called with the old connection
+        after an I/O error, to close it and return a new one (raising an
+        exception if it can't).
+    replay: a function returning the commands (WireCommands) to send
+        once reconnected.
+    reconnect_timeout: seconds to keep trying to reconnect.
+    verify_every, max_error_rate: passed on to AckPipeline, for sampled
+        verification of the responses.
+    """
+
+    def __init__(
+        self,
+        name,
+        ser,
+        window=DEFAULT_ACK_WINDOW,
+        timeout=DEFAULT_ACK_TIMEOUT,
+        max_queued=DEFAULT_MAX_QUEUED,
+        stats=None,
+        reconnect=None,
+        replay=None,
+        reconnect_timeout=DEFAULT_RECONNECT_TIMEOUT,
+        verify_every=None,
+        max_error_rate=None,
+    ):
+        self.name = name
+        self.ser = ser
+        self.pipeline = AckPipeline(
+            ser, window, timeout, stats, name, verify_every, max_error_rate
+        )
+        self.reconnect = reconnect
+        self.replay = replay
+        self.reconnect_timeout = reconnect_timeout
+        self.reconnections = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error = None
+        # I/O error to recover from by reconnecting, and the error that
+        # couldn't be recovered from (raised from then on)
+        self._fault = None
+        self._failed = None
+        self._stopping = threading.Event()
+        self._writer = threading.Thread(
+            target=self._write_loop, name=f"{name}-writer", daemon=True
+        )
+        self._reader = self._new_reader()
+
+    def _new_reader(self):
+        return threading.Thread(
+            target=self._read_loop, name=f"{self.name}-reader", daemon=True
+        )
+
+    def start(self):
+        self._writer.start()
+        self._reader.start()
+
+    def submit(self, cmd, synced=None):
+        """Queue cmd (a WireCommand) to be sent to the board - at the
+        same time as the other boards' commands submitted with the same
+        SyncedShow, if synced is given. Returns straight away unless
+        the queue is full."""
+        self._raise_error()
+        self._queue.put(cmd if synced is None else (cmd, synced))
+
+    def wait_for_acks(self):
+        """Hold back the commands submitted after this until every
+        command submitted before it has been acknowledged (or timed
+        out). Returns straight away."""
+        self._raise_error()
+        self._queue.put(_WAIT_FOR_ACKS)
+
+    def sync(self):
+        """Wait until every command submitted so far has been sent and
+        acknowledged (or timed out)."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        self._raise_error()
+
+    def stop(self):
+        """Send any queued commands, wait for their responses, then stop
+        both threads. Doesn't close the serial connection."""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        self._stopping.set()
+        if self._reader.is_alive():
+            self._reader.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._failed is not None:
+            raise self._failed
+        error, self._error = self._error, None
+        if error is None:
+            error = self.pipeline.take_error()
+        if error is not None:
+            raise error
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if self._fault is not None and self._failed is None:
+                    self._try_recover()
+                if self._failed is not None:
+                    _discard(item)
+                    if item is _STOP:
+                        return
+                    continue
+                if item is _STOP:
+                    self.pipeline.drain()
+                    return
+                if item is _WAIT_FOR_ACKS or isinstance(
+                    item, threading.Event
+                ):
+                    self.pipeline.drain()
+                elif isinstance(item, tuple):
+                    cmd, synced = item
+                    self.pipeline.send(cmd, before_write=synced.wait)
+                elif item is not _RECONNECT:
+                    self.pipeline.send(item)
+            except OSError as err:
+                if self.reconnect is None:
+                    logger.error("Error writing to %s: %s", self.name, err)
+                    self._error = err
+                else:
+                    # The command is replaced by the replayed state
+                    self._fault = err
+                    self._try_recover()
+            except Exception as err:
+                logger.error("Error writing to %s: %s", self.name, err)
+                self._error = err
+            finally:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _try_recover(self):
+        try:
+            self._recover()
+        except Exception as err:
+            logger.error("Could not reconnect to %s: %s", self.name, err)
+            # Give up on the board (see above)
+            self._failed = self._fault
+            self.pipeline.abandon()
+
+    def _recover(self):
+        # Called by the writer thread after an I/O error: reconnect, then
+        # restore the board's state
+        logger.warning(
+            "Lost connection to %s (%s), reconnecting.", self.name, self._fault
+        )
+        if self._reader.is_alive():
+            self._stopping.set()
+            self._reader.join()
+            self._stopping.clear()
+        # Their responses aren't coming
+        self.pipeline.abandon()
+        deadline = time.monotonic() + self.reconnect_timeout
+        while True:
+            try:
+                ser = self.reconnect(self.ser)
+                break
+            except Exception:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(RECONNECT_INTERVAL)
+        self.ser = self.pipeline.ser = ser
+        self._fault = None
+        self.reconnections += 1
+        self._reader = self._new_reader()
+        self._reader.start()
+        if self.replay is not None:
+            for cmd in self.replay():
+                self.pipeline.send(cmd)
+        logger.info("Reconnected to %s.", self.name)
+
+    def _read_loop(self):
+        fd = self.ser.fileno()
+        parser = ResponseParser()
+        while not self._stopping.is_set():
+            try:
+                ready, _, _ = select.select([fd], [], [], READ_POLL_INTERVAL)
+                if not ready:
+                    continue
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    raise ConnectionError(f"{self.name} closed the port")
+                for response in parser.feed(data):
+                    self.pipeline.handle_response(response)
+            except Exception as err:
+                if self._stopping.is_set():
+                    return
+                if isinstance(err, OSError) and self.reconnect is not None:
+                    # Have the writer thread reconnect
+                    self._fault = err
+                    self.pipeline.abandon()
+                    try:
+                        self._queue.put_nowait(_RECONNECT)
+                    except queue.Full:
+                        # The writer will see the fault anyway
+                        pass
+                    return
+                logger.error("Error reading from %s: %s", self.name, err)
+                self._error = err
+                return
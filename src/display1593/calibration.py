@@ -0,0 +1,56 @@
+"""Per-led colour calibration for the display's output stage.
+
+The leds don't all come out equally bright for the same value - the
+clock's digit data has hand-tuned values per led, and the colour tables
+in ledArray_data_1593 compensate for the difference between the red,
+green and blue channels. With a calibration table, Display1593 scales
+every colour it sends by a gain per led and channel instead, so every
+script gets the same correction:
+
+    dis.set_calibration(np.load("calibration.npy"))
+
+The gains are stored as unsigned 8.8 fixed point (uint16, GAIN_ONE =
+256 is a gain of 1), so applying them is one integer multiply, add and
+shift over the frame, into preallocated buffers: no floats and no
+allocations per frame. Results are rounded, and clipped at 255.
+
+Calibration is applied after the output lookup table (see
+display1593.lut), i.e. to the values the leds are driven with.
+"""
+
+import numpy as np
+
+# Gain of 1 in 8.8 fixed point
+GAIN_ONE = 256
+FRACTION_BITS = 8
+
+
+def fixed_point_gains(gains, n_leds):
+    """Return gains as an (n_leds, 3) uint16 array of 8.8 fixed-point
+    gains. gains can be floats (1.0 for no change, up to 255.99) of
+    shape (n_leds, 3), (n_leds, 1), (3,) or a single number, or an
+    already fixed-point uint16 array."""
+    gains = np.asarray(gains)
+    if gains.dtype != np.uint16:
+        gains = np.rint(gains * GAIN_ONE)
+        if np.any(gains < 0) or np.any(gains > np.iinfo(np.uint16).max):
+            raise ValueError("gains must be between 0 and 255.99")
+    try:
+        gains = np.broadcast_to(gains, (n_leds, 3))
+    except ValueError:
+        raise ValueError(
+            f"gains must have shape ({n_leds}, 3), or broadcast to it"
+        ) from None
+    return np.ascontiguousarray(gains, dtype=np.uint16)
+
+
+def apply_gains(rgb_array, gains, out, product):
+    """Scale the colours in rgb_array (a uint8 row per led) by gains (a
+    uint16 row for each) into out, using product (a uint32 array of the
+    same shape) for the intermediate results. out can be rgb_array."""
+    np.multiply(rgb_array, gains, out=product, dtype=np.uint32)
+    np.add(product, GAIN_ONE // 2, out=product)
+    np.right_shift(product, FRACTION_BITS, out=product)
+    np.minimum(product, 255, out=product)
+    np.copyto(out, product, casting="unsafe")
+    return out
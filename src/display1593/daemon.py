@@ -0,0 +1,372 @@
+"""A long-running process that owns the display, and a client for it.
+
+Every script that opens its own Display1593 has to wait for the display
+lock and then redo the hello handshake with both boards, which takes
+seconds. Instead, the display daemon connects once and keeps the
+connections open, accepting commands from one client at a time over a
+Unix socket:
+
+    python -m display1593.daemon
+
+DisplayClient is a drop-in replacement for Display1593 that talks to
+the daemon instead of the serial ports, so a script can switch to it
+without other changes, and connecting takes milliseconds:
+
+    with DisplayClient() as dis:
+        dis.set_all_leds(frame)
+        dis.show_now()
+
+All of Display1593's logic (buffered mode, set_frame()'s delta
+encoding, chunking) runs in the client, which sends the daemon the
+encoded board commands; the daemon only relays them to the boards'
+workers, which check the responses as usual.
+
+Protocol: every message is a 1-byte opcode and a 4-byte (big-endian)
+payload length, followed by the payload. The client sends:
+
+- HELLO: reply is a JSON object with the daemon's "number_of_leds".
+- COMMAND: payload is a board index (1 byte) and an encoded command.
+  No reply - errors are reported in the next reply.
+- WAIT_FOR_ACKS: as BoardWorker.wait_for_acks(), for every board. No
+  reply.
+- SHOW: as Display1593.show_now(), so that the boards' SN commands
+  are written together (see display1593.board_worker.SyncedShow). No
+  reply.
+- SYNC: reply once every command has been acknowledged.
+- STATS, RESET_STATS: reply is Display1593.stats() as JSON, or empty.
+
+The daemon replies with OK and the payload, or ERROR and an error
+message. While one client is connected, others wait for their HELLO
+reply, much as they would wait for the display lock. The socket is
+only accessible to the user running the daemon, and by default it is
+in that user's runtime directory ($XDG_RUNTIME_DIR, or failing that
+~/.cache/display1593) rather than /tmp, where another user could
+create it first.
+
+Since the daemon only relays commands, it doesn't know the boards'
+state, so it can't restore it after reconnecting to a board: its
+Display1593 must not have a reconnect_timeout.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+
+import numpy as np
+
+from display1593.display1593 import Display1593
+from display1593.lock import DEFAULT_TIMEOUT as DEFAULT_LOCK_TIMEOUT
+from display1593.lock import DisplayLockTimeout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR")
+    or os.path.expanduser("~/.cache/display1593"),
+    "display1593.sock",
+)
+SOCKET_MODE = 0o600
+
+# Message header: opcode, payload length
+HEADER = struct.Struct(">BI")
+OP_HELLO = 1
+OP_COMMAND = 2
+OP_WAIT_FOR_ACKS = 3
+OP_SYNC = 4
+OP_STATS = 5
+OP_RESET_STATS = 6
+OP_SHOW = 7
+OP_OK = 128
+OP_ERROR = 129
+
+
+class DisplayDaemonError(Exception):
+    """Raised by DisplayClient when the daemon reports an error."""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Serves one client connection."""
+
+    def setup(self):
+        super().setup()
+        self.display = self.server.display
+        # Payloads are read into this buffer, so that commands can be
+        # passed on without copying them (see _command())
+        self.buffer = bytearray(self.server.max_payload_bytes)
+        # An error from a request without a reply, to report later
+        self.error = None
+
+    def handle(self):
+        logger.info("Client connected.")
+        try:
+            while True:
+                header = self.rfile.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                op, length = HEADER.unpack(header)
+                if length > len(self.buffer):
+                    logger.error("Message too long (%d bytes).", length)
+                    break
+                payload = memoryview(self.buffer)[:length]
+                if self.rfile.readinto(payload) < length:
+                    break
+                self._handle_request(op, payload)
+        finally:
+            # Leave the boards idle for the next client
+            try:
+                self.display.sync()
+            except Exception as err:
+                logger.error("Error syncing display: %s", err)
+            logger.info("Client disconnected.")
+
+    def _handle_request(self, op, payload):
+        if op == OP_COMMAND:
+            self._command(payload)
+        elif op == OP_WAIT_FOR_ACKS:
+            for worker in self.display._workers:
+                worker.wait_for_acks()
+        elif op == OP_SHOW:
+            try:
+                self.display.show_now()
+            except Exception as err:
+                logger.error("Error showing: %s", err)
+                if self.error is None:
+                    self.error = err
+        elif op == OP_HELLO:
+            number_of_leds = dict(
+                zip(
+                    self.display.board_names,
+                    self.display.leds_per_board.tolist(),
+                )
+            )
+            self._reply({"number_of_leds": number_of_leds})
+        elif op == OP_SYNC:
+            self._reply(None, self.display.sync)
+        elif op == OP_STATS:
+            self._reply(None, self.display.stats)
+        elif op == OP_RESET_STATS:
+            self._reply(None, self.display.reset_stats)
+        else:
+            self.error = DisplayDaemonError(f"unknown opcode {op}")
+            self._reply(None)
+
+    def _command(self, payload):
+        board = payload[0]
+        cmd = np.frombuffer(payload[1:], dtype=np.uint8)
+        try:
+            if board >= len(self.display.board_names):
+                raise ValueError(f"invalid board {board}")
+            display = self.display
+            display._send(board, display._encoder.raw(board, cmd))
+        except Exception as err:
+            logger.error("Error sending command: %s", err)
+            if self.error is None:
+                self.error = err
+
+    def _reply(self, result, method=None):
+        # Reply with result (or what method returns) as JSON, or with
+        # the first error since the last reply
+        if method is not None:
+            try:
+                result = method()
+            except Exception as err:
+                if self.error is None:
+                    self.error = err
+        error, self.error = self.error, None
+        if error is not None:
+            op, payload = OP_ERROR, str(error).encode()
+        else:
+            op = OP_OK
+            payload = b"" if result is None else json.dumps(result).encode()
+        self.wfile.write(HEADER.pack(op, len(payload)) + payload)
+
+
+class DisplayDaemon(socketserver.UnixStreamServer):
+    """Serves a connected Display1593 to clients on a Unix socket, one
+    at a time.
+
+    display: a connected Display1593.
+    socket_path: path of the socket to listen on. A stale socket
+        there is replaced, if it belongs to the same user; anything
+        else raises FileExistsError.
+    """
+
+    def __init__(self, display, socket_path=DEFAULT_SOCKET_PATH):
+        if display.reconnect_timeout is not None:
+            raise ValueError(
+                "the daemon's display can't have a reconnect_timeout"
+            )
+        self.display = display
+        self.socket_path = socket_path
+        # Board index, plus the largest command a board can be sent
+        self.max_payload_bytes = 1 + max(display._encoder._buffer_sizes)
+        directory = os.path.dirname(socket_path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        try:
+            st = os.lstat(socket_path)
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+                raise FileExistsError(
+                    f"{socket_path} exists and isn't this user's socket"
+                )
+            os.unlink(socket_path)
+        super().__init__(socket_path, _Handler)
+
+    def server_bind(self):
+        # Create the socket with SOCKET_MODE, whatever the umask
+        old_umask = os.umask(0o777 & ~SOCKET_MODE)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class DisplayClient(Display1593):
+    """A Display1593 that sends its commands through the display daemon.
+
+    Takes the same arguments as Display1593, except that ports,
+    baud_rate, lock_path and the ack_* settings (which are the daemon's
+    business) are replaced by socket_path. number_of_leds must match
+    the daemon's.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, **kwargs):
+        super().__init__(ports=(), **kwargs)
+        self.socket_path = socket_path
+        self._socket = None
+        self._rfile = None
+
+    def connect(self, max_attempts=3, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        """Connect to the daemon, waiting up to lock_timeout seconds for
+        it to finish with any other client. (max_attempts is
+        ignored.)"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.settimeout(lock_timeout)
+            self._socket = sock
+            self._rfile = sock.makefile("rb")
+            try:
+                hello = self._request(OP_HELLO)
+            except socket.timeout:
+                raise DisplayLockTimeout(
+                    f"Display daemon ({self.socket_path}) still busy "
+                    f"with another client after {lock_timeout}s."
+                ) from None
+            sock.settimeout(None)
+        except Exception:
+            self._close_socket()
+            sock.close()
+            raise
+        number_of_leds = dict(
+            zip(self.board_names, self.leds_per_board.tolist())
+        )
+        if hello["number_of_leds"] != number_of_leds:
+            self._close_socket()
+            raise ValueError(
+                "board mismatch, expected %s, daemon has %s"
+                % (number_of_leds, hello["number_of_leds"])
+            )
+        logger.info("Connected to display daemon %s.", self.socket_path)
+        self._board_state_known[:] = False
+
+    def _send(self, board, cmd):
+        header = HEADER.pack(OP_COMMAND, 1 + cmd.length) + bytes((board,))
+        # Header and command in one system call, where possible
+        n_sent = self._socket.sendmsg([header, cmd.data])
+        if n_sent < len(header):
+            self._socket.sendall(header[n_sent:])
+            n_sent = len(header)
+        if n_sent < len(header) + cmd.length:
+            self._socket.sendall(cmd.data[n_sent - len(header) :])
+        # The command has been copied to the socket
+        cmd.release()
+
+    def _request(self, op):
+        self._socket.sendall(HEADER.pack(op, 0))
+        header = self._rfile.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionError("display daemon closed the connection")
+        reply_op, length = HEADER.unpack(header)
+        payload = self._rfile.read(length)
+        if reply_op == OP_ERROR:
+            raise DisplayDaemonError(payload.decode())
+        return json.loads(payload) if payload else None
+
+    def sync(self):
+        self._request(OP_SYNC)
+
+    def show_now(self):
+        if self.buffered:
+            self.flush()
+        self._socket.sendall(HEADER.pack(OP_SHOW, 0))
+        self._shown_state[:] = self._board_state
+
+    def stage_frame(self, rgb_array):
+        self._socket.sendall(HEADER.pack(OP_WAIT_FOR_ACKS, 0))
+        self.set_frame(rgb_array)
+
+    def stats(self):
+        """The daemon's stats() (as decoded from JSON, so the
+        bytes_histogram keys are strings)."""
+        return self._request(OP_STATS)
+
+    def reset_stats(self):
+        self._request(OP_RESET_STATS)
+
+    def disconnect(self):
+        if self._socket is None:
+            return
+        try:
+            self.sync()
+        finally:
+            self._close_socket()
+
+    def _close_socket(self):
+        if self._rfile is not None:
+            self._rfile.close()
+            self._rfile = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep the display connected and serve it to clients "
+        "(see display1593.daemon.DisplayClient) on a Unix socket."
+    )
+    parser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET_PATH,
+        help=f"socket path (default: {DEFAULT_SOCKET_PATH})",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s|%(levelname)s|%(name)s|%(message)s",
+    )
+    with Display1593() as dis:
+        with DisplayDaemon(dis, args.socket) as daemon:
+            logger.info("Listening on %s.", args.socket)
+            try:
+                daemon.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,49 @@
 import logging
 import time
-from itertools import pairwise
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import serial
-from numba import jit, types
 from PIL import Image
-from serial_comm import (
-    connect_to_arduino,
-    receive_data_from_arduino,
-    send_data_to_arduino,
-)
+from serial_comm import connect_to_arduino, receive_data_from_arduino
 
+from display1593.board_worker import (
+    DEFAULT_MAX_QUEUED,
+    BoardWorker,
+    SyncedShow,
+)
+from display1593.calibration import apply_gains, fixed_point_gains
 from display1593.data.ledArray_data_1593 import centres_x, centres_y
+from display1593.encoder import (
+    CA_BYTES,
+    CN_BYTES_PER_LED,
+    CN_HEADER_BYTES,
+    LA_BYTES_PER_LED,
+    LA_HEADER_BYTES,
+    LN_BYTES_PER_LED,
+    LN_HEADER_BYTES,
+    CommandEncoder,
+    calc_expected_response,
+)
 from display1593.image_conversion import convert_image as _convert_image
 from display1593.image_conversion import prepare_image as _prepare_image
-from display1593.lock import DEFAULT_TIMEOUT as DEFAULT_LOCK_TIMEOUT
-from display1593.lock import DisplayLock, DisplayLockTimeout
+from display1593.led_group import LedGroup
+from display1593.lock import (
+    DEFAULT_TIMEOUT as DEFAULT_LOCK_TIMEOUT,
+    DisplayLock,
+    DisplayLockTimeout,
+)
+from display1593.lut import apply_lut, apply_lut_colour, check_lut
+from display1593.pipeline import DEFAULT_ACK_TIMEOUT, DEFAULT_ACK_WINDOW
+from display1593.port_cache import (
+    DEFAULT_PORT_CACHE_PATH,
+    load_port_cache,
+    save_port_cache,
+    usb_serial_numbers,
+)
+from display1593.stats import CommandStats
+from display1593.timing import DeadlineTimer
 
 # The nearest_neighbours/nearest_neighbour_distances arrays in
 # ledArray_data_1593.py contain indexing errors for LEDs near the edges
@@ -32,14 +58,6 @@ nearest_neighbour_distances = np.loadtxt(
     _DATA_DIR / "nearest_neighbour_distances_1593.csv", delimiter=","
 )
 
-# Numba array types
-readonly_uint8_array = types.Array(types.uint8, 1, "C", readonly=True)
-writable_uint8_array = types.Array(types.uint8, 1, "C")
-int32_array = types.Array(types.int32, 1, "C")
-int32_array_1d = types.Array(types.int32, 1, "C")
-uint8_array_2d = types.Array(types.uint8, 2, "C")
-
-
 # Log records are handled by whichever entry-point script imports this
 # module - see display1593.logging_utils.configure_root_logging().
 logger = logging.getLogger(__name__)
@@ -81,140 +99,39 @@ SERIAL_PORTS = ["/dev/ttyACM0", "/dev/ttyACM1"]
 NUMBER_OF_LEDS = {"TEENSY1": 798, "TEENSY2": 795}
 
 
-@jit(
-    [types.uint8[:, :](types.int32[:]), types.uint8[:, :](types.int64[:])],
-    nopython=True,
-    cache=True,
-)
-def make_idx_array(leds):
-    idx = np.empty((leds.shape[0], 2), dtype=np.uint8)
-    for i in range(leds.shape[0]):
-        idx[i, 0] = leds[i] // 256 % 256
-        idx[i, 1] = leds[i] % 256
-    # idx = np.array([(i // 256 % 256, i % 256) for i in leds], dtype=np.uint8)
-    return idx
-
-
-@jit(
-    [types.Tuple((int32_array, int32_array))(int32_array, int32_array)],
-    nopython=True,
-    cache=True,
-)
-def _board_leds(leds, led_idx):
-    """Filter led ids into separate lists for each board."""
-    n = len(leds)
-
-    # Pre-allocate with maximum possible size
-    board_leds_0 = np.empty(n, dtype=leds.dtype)
-    board_leds_1 = np.empty(n, dtype=leds.dtype)
-
-    # Fill arrays and track actual sizes
-    idx0 = 0
-    idx1 = 0
-    for i in range(n):
-        led = leds[i]
-        if led < led_idx[1]:
-            board_leds_0[idx0] = led - led_idx[0]
-            idx0 += 1
-        elif led < led_idx[2]:
-            board_leds_1[idx1] = led - led_idx[1]
-            idx1 += 1
-        else:
-            raise ValueError("invalid led id")
-
-    # Trim to actual sizes
-    board_leds_0 = board_leds_0[:idx0]
-    board_leds_1 = board_leds_1[:idx1]
-
-    return board_leds_0, board_leds_1
-
-
-return_type = types.Tuple(
-    (int32_array_1d, int32_array_1d, uint8_array_2d, uint8_array_2d)
-)
-
-
-@jit(
-    [return_type(int32_array_1d, uint8_array_2d, int32_array_1d)],
-    nopython=True,
-    cache=True,
-)
-def _board_leds_with_rgb(leds, rgb_array, led_idx):
-    """Filter led ids into separate lists for each board."""
-    n = len(leds)
-
-    # Pre-allocate with maximum possible size
-    board_leds_0 = np.empty(n, dtype=leds.dtype)
-    board_leds_1 = np.empty(n, dtype=leds.dtype)
-    rgb_arrays_0 = np.empty((n, 3), dtype=np.uint8)
-    rgb_arrays_1 = np.empty((n, 3), dtype=np.uint8)
-
-    # Fill arrays and track actual sizes
-    idx0 = 0
-    idx1 = 0
-    for i in range(n):
-        led = leds[i]
-        if led < led_idx[1]:
-            board_leds_0[idx0] = led - led_idx[0]
-            rgb_arrays_0[idx0] = rgb_array[i]
-            idx0 += 1
-        elif led < led_idx[2]:
-            board_leds_1[idx1] = led - led_idx[1]
-            rgb_arrays_1[idx1] = rgb_array[i]
-            idx1 += 1
-        else:
-            raise ValueError("invalid led id")
-
-    # Trim to actual sizes
-    board_leds_0 = board_leds_0[:idx0]
-    board_leds_1 = board_leds_1[:idx1]
-    rgb_arrays_0 = rgb_arrays_0[:idx0]
-    rgb_arrays_1 = rgb_arrays_1[:idx1]
-
-    return board_leds_0, board_leds_1, rgb_arrays_0, rgb_arrays_1
-
-
-@jit(
-    [
-        writable_uint8_array(readonly_uint8_array),
-        writable_uint8_array(writable_uint8_array),
-    ],
-    nopython=True,
-    cache=True,
-)
-def calc_expected_response(cmd):
-    """
-    Calculate the expected response of the Arduino to the command.
-
-    Args:
-        cmd: NumPy array of uint8 values
-
-    Returns:
-        NumPy array of 6 uint8 values:
-        - Bytes 0-1: length of cmd (16-bit big-endian)
-        - Bytes 2-5: sum of cmd values (32-bit big-endian)
-    """
-    expected_response = np.empty(6, dtype=np.uint8)
-
-    # Get the length of cmd
-    cmd_length = len(cmd)
-
-    # Bytes 0-1: length as 16-bit big-endian (high byte first)
-    expected_response[0] = (cmd_length >> 8) & 0xFF  # High byte
-    expected_response[1] = cmd_length & 0xFF  # Low byte
-
-    # Calculate sum of all values in cmd
-    cmd_sum = np.uint32(0)
-    for i in range(len(cmd)):
-        cmd_sum += cmd[i]
-
-    # Bytes 2-5: sum as 32-bit big-endian (high byte first)
-    expected_response[2] = (cmd_sum >> 24) & 0xFF  # Highest byte
-    expected_response[3] = (cmd_sum >> 16) & 0xFF
-    expected_response[4] = (cmd_sum >> 8) & 0xFF
-    expected_response[5] = cmd_sum & 0xFF  # Lowest byte
-
-    return expected_response
+def _hello(ser):
+    """serial_comm.connect_to_arduino(), with a malformed hello message
+    (an AssertionError) as a failed attempt, status 2."""
+    try:
+        return connect_to_arduino(ser)
+    except AssertionError:
+        return 2, "Malformed hello message"
+
+
+def _image_lut(dimness):
+    """Lookup table for show_image(): v**2 / (256 * dimness), as the
+    uint8 the float used to be truncated to."""
+    levels = np.arange(256, dtype=np.int32)
+    return (levels**2 // (256 * dimness)).astype(np.uint8)
+
+
+def _palette(colours, leds):
+    """Return the distinct colours among colours (a uint8 row per led
+    of leds), and for each of them the leds of that colour."""
+    packed = (
+        colours[:, 0].astype(np.uint32) << 16
+        | colours[:, 1].astype(np.uint32) << 8
+        | colours[:, 2]
+    )
+    packed_palette, inverse, counts = np.unique(
+        packed, return_inverse=True, return_counts=True
+    )
+    palette = np.empty((packed_palette.shape[0], 3), dtype=np.uint8)
+    palette[:, 0] = packed_palette >> 16
+    palette[:, 1] = packed_palette >> 8 & 0xFF
+    palette[:, 2] = packed_palette & 0xFF
+    by_colour = leds[np.argsort(inverse, kind="stable")]
+    return palette, np.split(by_colour, np.cumsum(counts)[:-1])
 
 
 class Display1593:
@@ -224,9 +141,38 @@ class Display1593:
         baud_rate=BAUD_RATE,
         number_of_leds=NUMBER_OF_LEDS,
         lock_path=None,
+        ack_window=DEFAULT_ACK_WINDOW,
+        ack_timeout=DEFAULT_ACK_TIMEOUT,
+        buffered=False,
+        max_command_bytes=None,
+        port_cache_path=DEFAULT_PORT_CACHE_PATH,
+        reconnect_timeout=None,
+        output_lut=None,
+        calibration=None,
+        verify_every=None,
+        max_error_rate=None,
     ):
         self.ports = ports
         self.baud_rate = baud_rate
+        # Which board was on which port last time (None to always do the
+        # handshake) - see display1593.port_cache
+        self.port_cache_path = port_cache_path
+        # Up to ack_window commands per board may be sent before their
+        # responses come back - see display1593.pipeline
+        self.ack_window = ack_window
+        self.ack_timeout = ack_timeout
+        # Or, for the highest frame rates, only check every
+        # verify_every-th response (and SN's), not waiting for the
+        # others, and raise an error if more than max_error_rate of
+        # them are invalid
+        self.verify_every = verify_every
+        self.max_error_rate = max_error_rate
+        # If reconnect_timeout is given, after a read or write error a
+        # board's worker reopens its port and restores its leds, giving
+        # up (and raising the error) after reconnect_timeout seconds.
+        # By default the error is raised straight away, so that a
+        # script run as a service stops and is restarted.
+        self.reconnect_timeout = reconnect_timeout
         self._lock = (
             DisplayLock() if lock_path is None else DisplayLock(lock_path)
         )
@@ -242,6 +188,53 @@ class Display1593:
         )
         self.n_leds = self.led_idx[-1]
         self._connections = []
+        self._workers = []
+        # Preallocated wire buffers, enough per board for every command
+        # that can be queued or awaiting a response at once. LN and CN
+        # updates too big for the firmware's receive buffer
+        # (max_command_bytes, by default the size of the largest LA
+        # command) are split into several commands, each acknowledged
+        # separately.
+        self._encoder = CommandEncoder(
+            self.leds_per_board,
+            DEFAULT_MAX_QUEUED + ack_window + 2,
+            max_command_bytes,
+        )
+        self._stats = CommandStats()
+        # For show_at() - see display1593.timing
+        self.timer = DeadlineTimer()
+        # Host-side copy of the colours last sent to each board, used by
+        # set_frame() to send only what changed. Each board's contents
+        # are unknown until a command has set every one of its leds.
+        self._board_state = np.zeros((self.n_leds, 3), dtype=np.uint8)
+        self._board_state_known = np.zeros(
+            len(self.board_names), dtype=bool
+        )
+        # The colours as of the last show_now(), i.e. what the leds are
+        # showing, replayed (with _board_state) to a board reconnected
+        # after a serial fault
+        self._shown_state = np.zeros((self.n_leds, 3), dtype=np.uint8)
+        # Every colour sent is mapped through the output lookup table
+        # (None for none) - see display1593.lut. The mapped colours go
+        # in this buffer, channel-major so that np.take writes each
+        # channel contiguously.
+        self._output_lut = None
+        if output_lut is not None:
+            self._output_lut = check_lut(output_lut)
+        self._output_buffer = np.zeros((3, self.n_leds), dtype=np.uint8)
+        # ...and then scaled by per-led calibration gains (None for
+        # none), in 8.8 fixed point - see display1593.calibration
+        self._gains = None
+        if calibration is not None:
+            self._gains = fixed_point_gains(calibration, self.n_leds)
+        self._gain_buffer = np.zeros((self.n_leds, 3), dtype=np.uint16)
+        self._product_buffer = np.zeros((self.n_leds, 3), dtype=np.uint32)
+        # In buffered mode, the set_* methods and clear_all() only write
+        # to this framebuffer and mark the leds they touch as dirty;
+        # nothing is sent until flush() (or show_now()).
+        self.buffered = buffered
+        self.framebuffer = np.zeros((self.n_leds, 3), dtype=np.uint8)
+        self._dirty = np.zeros(self.n_leds, dtype=bool)
         self.nearest_neighbours = np.asarray(
             nearest_neighbours, dtype=np.uint16
         )
@@ -258,6 +251,171 @@ class Display1593:
         )
 
     def connect(self, max_attempts=3, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        self._open_connections(max_attempts, lock_timeout)
+        # One writer/reader worker per board, so that commands to
+        # different boards are transmitted concurrently
+        self._workers = [
+            self._new_worker(board, ser)
+            for board, ser in enumerate(self._connections)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _new_worker(self, board, ser):
+        reconnect_options = {}
+        if self.reconnect_timeout is not None:
+            reconnect_options = dict(
+                reconnect=lambda old_ser: self._reconnect(board, old_ser),
+                replay=lambda: self._replay_commands(board),
+                reconnect_timeout=self.reconnect_timeout,
+            )
+        return BoardWorker(
+            self.board_names[board],
+            ser,
+            self.ack_window,
+            self.ack_timeout,
+            stats=self._stats,
+            verify_every=self.verify_every,
+            max_error_rate=self.max_error_rate,
+            **reconnect_options,
+        )
+
+    def _reconnect(self, board, old_ser):
+        """Reopen the port of one board after a serial fault, and check
+        with the hello handshake that it's the same board. Called from
+        the board's worker thread, which retries on failure."""
+        name = self.board_names[board]
+        port = old_ser.port
+        old_ser.close()
+        ser = serial.Serial(port, baudrate=self.baud_rate)
+        try:
+            status, message = _hello(ser)
+        except Exception:
+            ser.close()
+            raise
+        if status != 0 or message != name:
+            ser.close()
+            raise serial.SerialException(
+                f"reconnecting to {name} on {port} failed: {message}"
+            )
+        logger.info("Reconnected to %s on port %s.", name, port)
+        self._connections[board] = ser
+        return ser
+
+    def _replay_commands(self, board):
+        """Commands that restore a reconnected board's leds from the
+        host-side copies: what was last shown, latched, then anything
+        sent since (which the commands still queued build on)."""
+        shown = self._output(self._shown_state, copy=True)
+        sent = self._output(self._board_state, copy=True)
+        commands = [
+            self._encoder.la(board, shown),
+            self._encoder.raw(board, COMMAND_SN),
+        ]
+        i, j = self.led_idx[board], self.led_idx[board + 1]
+        if np.any(sent[i:j] != shown[i:j]):
+            commands.append(self._encoder.la(board, sent))
+        return commands
+
+    @property
+    def output_lut(self):
+        """The output lookup table, or None."""
+        return self._output_lut
+
+    def set_output_lut(self, lut):
+        """Map every colour sent from now on through lut, a (3, 256)
+        uint8 array (or a (256,) one for all channels) that must map 0
+        to 0 - e.g. from display1593.lut.make_lut() - or None for no
+        mapping.
+
+        The colours already sent to a board are resent through the new
+        table (in buffered mode, with the next flush()); like any other
+        update, they show from the next show_now().
+        """
+        self._output_lut = None if lut is None else check_lut(lut)
+        self._resend_board_state()
+
+    @property
+    def calibration(self):
+        """The calibration gains, an (n_leds, 3) uint16 array in 8.8
+        fixed point, or None."""
+        return self._gains
+
+    def set_calibration(self, gains):
+        """Scale every colour sent from now on by a gain per led and
+        channel, given as floats (1.0 for no change) or as a uint16
+        array in 8.8 fixed point, of shape (n_leds, 3) or one that
+        broadcasts to it; or None for no calibration. Applied after the
+        output lookup table - see display1593.calibration.
+
+        The colours already sent are resent, as by set_output_lut().
+        """
+        self._gains = (
+            None if gains is None else fixed_point_gains(gains, self.n_leds)
+        )
+        self._resend_board_state()
+
+    def _resend_board_state(self):
+        # After a change to the output stage, resend the colours already
+        # sent to the boards (in buffered mode, with the next flush())
+        if self.buffered:
+            self._board_state_known[:] = False
+            return
+        if not np.any(self._board_state_known):
+            return
+        rgb_array = self._output(self._board_state)
+        for board in np.flatnonzero(self._board_state_known):
+            self._send(board, self._encoder.la(board, rgb_array))
+
+    def _output(self, rgb_array, leds=None, copy=False):
+        """rgb_array (a uint8 row per led of leds, or of the whole
+        display if leds is None) as sent to the boards: mapped through
+        the output lookup table, then scaled by the calibration gains.
+
+        The result is in the output buffer, only valid until the next
+        call - unless copy is True, for use from other threads.
+        """
+        if self._output_lut is None and self._gains is None:
+            return rgb_array.copy() if copy else rgb_array
+        n = rgb_array.shape[0]
+        if copy:
+            out = np.empty_like(rgb_array)
+            product = np.empty(rgb_array.shape, dtype=np.uint32)
+        else:
+            out = self._output_buffer[:, :n].T
+            product = self._product_buffer[:n]
+        if self._output_lut is not None:
+            rgb_array = apply_lut(self._output_lut, rgb_array, out)
+        if self._gains is not None:
+            if leds is None:
+                gains = self._gains
+            elif copy:
+                gains = self._gains[leds]
+            else:
+                gains = np.take(
+                    self._gains, leds, axis=0, out=self._gain_buffer[:n]
+                )
+            rgb_array = apply_gains(rgb_array, gains, out, product)
+        return rgb_array
+
+    def _output_colour(self, rgb, led=None):
+        """As _output(), for the colour of one led (which must be given
+        if there is a calibration)."""
+        if self._output_lut is not None:
+            rgb = apply_lut_colour(self._output_lut, rgb)
+        if self._gains is not None:
+            rgb = apply_gains(
+                np.asarray(rgb, dtype=np.uint8),
+                self._gains[led],
+                np.empty(3, dtype=np.uint8),
+                np.empty(3, dtype=np.uint32),
+            )
+        return tuple(int(v) for v in rgb)
+
+    def _open_connections(self, max_attempts, lock_timeout):
+        """Take the display lock, then open every port and find out
+        which board is on it, storing the connections in
+        self._connections in board order."""
         # Wait here (up to lock_timeout seconds) for exclusive control of
         # the display; raises DisplayLockTimeout if another process is
         # still holding it. Released in disconnect(), or below if
@@ -272,189 +430,479 @@ class Display1593:
             )
             raise
         try:
-            connections = {}
-            for port in self.ports:
-                for attempt in range(1, max_attempts + 1):
-                    ser = serial.Serial(port, baudrate=self.baud_rate)
-                    # connect_to_arduino() has no checksum on the hello
-                    # message it waits for (see check_response() for the
-                    # checksummed alternative used elsewhere), so a
-                    # corrupted byte can produce a malformed message (an
-                    # AssertionError) or a name we don't recognize. Either
-                    # way, treat it as a failed attempt and retry rather
-                    # than trusting it or crashing.
-                    try:
-                        status, message = connect_to_arduino(ser)
-                    except AssertionError:
-                        status, message = 2, "Malformed hello message"
-                    if status == 0 and message in self.board_names:
-                        logger.info("Connected to port %s.", port)
-                        worker_name = message
-                        break
-                    if status == 0:
-                        message = f"unrecognized board name {message!r}"
-                    logger.warning(
-                        "Attempt %d/%d on port %s failed: %s",
-                        attempt,
-                        max_attempts,
-                        port,
-                        message,
-                    )
-                    ser.close()
-                else:
-                    logger.error(
-                        "Giving up on port %s after %d attempts "
-                        "(last error: %s).",
-                        port,
-                        max_attempts,
-                        message,
-                    )
-                    raise Exception(
-                        f"No microcontroller found on port {port} after "
-                        f"{max_attempts} attempts (last error: {message})"
-                    )
-                logger.info("Hello from: %s", worker_name)
-                connections[worker_name] = ser
-
-            if set(connections.keys()) != set(self.board_names):
-                raise ValueError(
-                    "board name mismatch, expected %s, got %s"
-                    % (self.board_names, list(connections.keys()))
-                )
-
+            connections = self._open_cached_ports()
+            if connections is None:
+                connections = self._handshake_ports(max_attempts)
             # Store connections in same order as expected board names
-            self._connections = []
-            for name in self.board_names:
-                self._connections.append(connections[name])
+            self._connections = [
+                connections[name] for name in self.board_names
+            ]
+            self._board_state_known[:] = False
         except Exception:
             self._lock.release()
             raise
 
+    def _open_cached_ports(self):
+        """If the port cache identifies the board on every port (by USB
+        serial number - see display1593.port_cache), open the ports,
+        check with a single hello on each (all at the same time) that
+        every board answers with its cached name, and return a dict of
+        the connections by board name. Otherwise, return None."""
+        if self.port_cache_path is None:
+            return None
+        try:
+            serial_numbers = usb_serial_numbers(self.ports)
+        except Exception as err:
+            logger.debug("Could not list USB serial numbers: %s", err)
+            return None
+        cache = load_port_cache(self.port_cache_path)
+        names = [cache.get(serial_numbers[port]) for port in self.ports]
+        if sorted(names, key=str) != sorted(self.board_names):
+            return None
+        connections = {}
+        try:
+            for port, name in zip(self.ports, names):
+                ser = serial.Serial(port, baudrate=self.baud_rate)
+                ser.reset_input_buffer()
+                connections[name] = ser
+        except serial.SerialException as err:
+            logger.warning("Could not open cached ports: %s", err)
+            for ser in connections.values():
+                ser.close()
+            return None
+        with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+            replies = {
+                name: executor.submit(_hello, ser)
+                for name, ser in connections.items()
+            }
+        for name, reply in replies.items():
+            try:
+                status, message = reply.result()
+            except Exception as err:
+                status, message = 1, f"error: {err}"
+            if status != 0 or message != name:
+                logger.info(
+                    "Port cache is out of date (expected %s on port %s, "
+                    "got %r); finding the boards again.",
+                    name,
+                    connections[name].port,
+                    message,
+                )
+                for ser in connections.values():
+                    ser.close()
+                return None
+        for name, ser in connections.items():
+            logger.info("Connected to port %s (cached: %s).", ser.port, name)
+        return connections
+
+    def _handshake_ports(self, max_attempts):
+        """Open every port and find out which board is on it, all at the
+        same time, returning a dict of the connections by board name
+        (and caching which board was on which port)."""
+        with ThreadPoolExecutor(max_workers=len(self.ports)) as executor:
+            futures = [
+                executor.submit(self._handshake, port, max_attempts)
+                for port in self.ports
+            ]
+        found, errors = {}, []
+        for port, future in zip(self.ports, futures):
+            try:
+                found[port] = future.result()
+            except Exception as err:
+                errors.append(err)
+        names = [name for name, _ in found.values()]
+        if not errors and sorted(names) != sorted(self.board_names):
+            errors.append(
+                ValueError(
+                    "board name mismatch, expected %s, got %s"
+                    % (self.board_names, names)
+                )
+            )
+        if errors:
+            for _, ser in found.values():
+                ser.close()
+            raise errors[0]
+        if self.port_cache_path is not None:
+            try:
+                serial_numbers = usb_serial_numbers(self.ports)
+            except Exception as err:
+                logger.debug("Could not list USB serial numbers: %s", err)
+            else:
+                save_port_cache(
+                    self.port_cache_path,
+                    serial_numbers,
+                    {port: name for port, (name, _) in found.items()},
+                )
+        return {name: ser for name, ser in found.values()}
+
+    def _handshake(self, port, max_attempts):
+        """Open port and return the name of the board on it, and the
+        connection."""
+        for attempt in range(1, max_attempts + 1):
+            ser = serial.Serial(port, baudrate=self.baud_rate)
+            # connect_to_arduino() has no checksum on the hello
+            # message it waits for (see AckPipeline for the
+            # checksummed alternative used elsewhere), so a
+            # corrupted byte can produce a malformed message or a
+            # name we don't recognize. Either way, treat it as a
+            # failed attempt and retry rather than trusting it or
+            # crashing.
+            status, message = _hello(ser)
+            if status == 0 and message in self.board_names:
+                logger.info("Connected to port %s.", port)
+                logger.info("Hello from: %s", message)
+                return message, ser
+            if status == 0:
+                message = f"unrecognized board name {message!r}"
+            logger.warning(
+                "Attempt %d/%d on port %s failed: %s",
+                attempt,
+                max_attempts,
+                port,
+                message,
+            )
+            ser.close()
+        logger.error(
+            "Giving up on port %s after %d attempts (last error: %s).",
+            port,
+            max_attempts,
+            message,
+        )
+        raise Exception(
+            f"No microcontroller found on port {port} after "
+            f"{max_attempts} attempts (last error: {message})"
+        )
+
+    def _send(self, board, cmd):
+        """Send cmd (a WireCommand from self._encoder) to one board (an
+        index into self._connections).
+
+        Returns as soon as the command is queued: the board's worker
+        thread writes it, and checks its response when it arrives (see
+        display1593.board_worker).
+        """
+        self._workers[board].submit(cmd)
+
+    def _send_to_all(self, cmd):
+        """Send the same short command (e.g. COMMAND_SN) to every board."""
+        for board in range(len(self.board_names)):
+            self._send(board, self._encoder.raw(board, cmd))
+
+    def sync(self):
+        """Wait until every command sent so far has been acknowledged
+        by its board (or timed out)."""
+        for worker in self._workers:
+            worker.sync()
+
+    def stats(self):
+        """Snapshot of the timing and error counters for the commands
+        sent so far, per board and command type - see
+        display1593.stats.CommandStats.snapshot() for the format."""
+        return self._stats.snapshot()
+
+    def reset_stats(self):
+        self._stats.reset()
+
+    def show_skew(self):
+        """Statistics of how far apart (in seconds) each show_now()'s SN
+        commands to the boards started being written - see
+        display1593.stats."""
+        return self._stats.show_skew()
+
+    def _check_led_ids(self, leds):
+        if leds.shape[0] > 0 and (
+            leds.min() < 0 or leds.max() >= self.n_leds
+        ):
+            raise ValueError("invalid led id")
+
     def check_response(self, ser, cmd, timeout_after=1):
+        """Wait up to timeout_after seconds for the board on ser to
+        respond to cmd (a uint8 array just sent to it) and check the
+        response (see calc_expected_response()), returning whether it
+        was the one expected.
+
+        Only for ports nothing else is reading, e.g. in scripts that
+        talk to the boards directly: a connected Display1593's workers
+        read and check every response on its ports themselves (see
+        display1593.pipeline).
+        """
         expected_response = calc_expected_response(cmd)
-        waiting = True
-        timeout_time = time.time() + timeout_after
-        while waiting:
-            if ser.in_waiting > 0:
-                waiting = False
-                response = receive_data_from_arduino(ser)
-                if np.array_equal(response, expected_response):
-                    logger.debug("Resp rec'd")
-                elif np.array_equal(response[:2], [0, 0]):
-                    logger.debug("Debug msg: %s", bytes(response[2:]).decode())
-                else:
-                    logger.warning(
-                        "Resp invalid, expected %s, got %s",
-                        expected_response,
-                        response,
-                    )
-            if time.time() > timeout_time:
+        deadline = time.monotonic() + timeout_after
+        while not ser.in_waiting:
+            if time.monotonic() > deadline:
                 logger.warning("Timeout")
-                break
+                return False
+            time.sleep(0.001)
+        response = receive_data_from_arduino(ser)
+        if np.array_equal(response, expected_response):
+            logger.debug("Resp rec'd")
+            return True
+        if np.array_equal(response[:2], [0, 0]):
+            logger.debug("Debug msg: %s", bytes(response[2:]).decode())
+        else:
+            logger.warning(
+                "Resp invalid, expected %s, got %s",
+                expected_response,
+                response,
+            )
+        return False
 
     def clear_all(self):
         logger.debug("Method clear_all.")
-        cmd = COMMAND_LC
-        for ser in self._connections:
-            send_data_to_arduino(ser, cmd)
-        for ser in self._connections:
-            self.check_response(ser, cmd)
+        if self.buffered:
+            self._buffer_all((0, 0, 0))
+            return
+        self._send_to_all(COMMAND_LC)
+        self._board_state[:] = 0
+        self._board_state_known[:] = True
 
     def set_led(self, i, rgb):
         logger.debug("Method set_led.")
-        if i < self.led_idx[0]:
+        if not 0 <= i < self.n_leds:
             raise ValueError("invalid led id")
         assert len(rgb) == 3
-        if i < self.led_idx[1]:
-            led_id = i
-            ser = self._connections[0]
-        elif i < self.led_idx[2]:
-            led_id = i - self.led_idx[1]
-            ser = self._connections[1]
-        else:
-            raise ValueError("invalid led id")
+        if self.buffered:
+            self._buffer_leds(i, rgb)
+            return
+        board = self._encoder.board_of(i)
+        led_id = i - self.led_idx[board]
         # Command L1 - implemented
         cmd = np.array(
-            (76, 49, led_id // 256 % 256, led_id % 256, *rgb), dtype=np.uint8
+            (
+                76,
+                49,
+                led_id // 256 % 256,
+                led_id % 256,
+                *self._output_colour(rgb, i),
+            ),
+            dtype=np.uint8,
         )
-        send_data_to_arduino(ser, cmd)
-        self.check_response(ser, cmd)
+        self._send(board, self._encoder.raw(board, cmd))
+        self._board_state[i] = rgb
 
     def set_leds(self, leds, rgb_array):
         assert rgb_array.shape[1] == 3
-        leds = np.array(leds, dtype="int32")
+        leds = np.asarray(leds, dtype=np.int32)
+        rgb_array = np.asarray(rgb_array, dtype=np.uint8)
         logger.debug("Method set_leds with %d leds.", leds.shape[0])
-        board_leds_0, board_leds_1, rgb_arrays_0, rgb_arrays_1 = (
-            _board_leds_with_rgb(leds, rgb_array, self.led_idx)
-        )
-        board_leds = [board_leds_0, board_leds_1]
-        rgb_arrays = [rgb_arrays_0, rgb_arrays_1]
-        cmds_sent = {}
-        for leds, rgb_array, ser in zip(
-            board_leds, rgb_arrays, self._connections
-        ):
-            n = leds.shape[0]
-            if n == 0:
-                continue
-            idx = make_idx_array(leds)
+        self._check_led_ids(leds)
+        if self.buffered:
+            self._buffer_leds(leds, rgb_array)
+            return
+        self._send_leds(leds, rgb_array)
+
+    # The methods below fall back on _send_leds() and _send_all_leds()
+    # rather than set_leds() and set_all_leds(), which a subclass (e.g.
+    # AsyncDisplay1593) may override with coroutines
+
+    def _send_leds(self, leds, rgb_array):
+        output = self._output(rgb_array, leds)
+        for board, rows in self._encoder.partition(leds):
             # Command LN - implemented
-            cmd = np.concatenate(
-                [
-                    (76, 78, n // 256 % 256, n % 256),
-                    np.hstack((idx, rgb_array)).flatten(),
-                ]
-            ).astype(np.uint8)
-            send_data_to_arduino(ser, cmd)
-            cmds_sent[ser] = cmd
-        for ser, cmd in cmds_sent.items():
-            self.check_response(ser, cmd)
+            for cmd in self._encoder.ln(board, leds[rows], output[rows]):
+                self._send(board, cmd)
+        self._board_state[leds] = rgb_array
 
     def set_leds_one_colour(self, leds, rgb):
         assert len(rgb) == 3
-        leds = np.array(leds, dtype="int32")
+        leds = np.asarray(leds, dtype=np.int32)
         logger.debug(
             "Method set_leds_one_colour with %d leds." % leds.shape[0]
         )
-        board_leds_0, board_leds_1 = _board_leds(leds, self.led_idx)
-        board_leds = [board_leds_0, board_leds_1]
-        cmds_sent = {}
-        for leds, ser in zip(board_leds, self._connections):
-            n = leds.shape[0]
-            if n == 0:
-                continue
-            idx = make_idx_array(leds)
+        self._check_led_ids(leds)
+        if self.buffered:
+            self._buffer_leds(leds, rgb)
+            return
+        if self._gains is not None:
+            # Calibrated, the leds are no longer all one colour
+            rgb = np.asarray(rgb, dtype=np.uint8)
+            self._send_leds(leds, np.broadcast_to(rgb, (leds.shape[0], 3)))
+            return
+        output = self._output_colour(rgb)
+        for board, rows in self._encoder.partition(leds):
             # Command CN - implemented
-            cmd = np.concatenate(
-                [(67, 78, n // 256 % 256, n % 256, *rgb), idx.flatten()]
-            ).astype(np.uint8)
-            send_data_to_arduino(ser, cmd)
-            cmds_sent[ser] = cmd
-        for ser, cmd in cmds_sent.items():
-            self.check_response(ser, cmd)
+            for cmd in self._encoder.cn(board, leds[rows], output):
+                self._send(board, cmd)
+        self._board_state[leds] = rgb
+
+    def compile_group(self, leds):
+        """Return a LedGroup for leds (led ids), whose set_leds() and
+        set_leds_one_colour() send the same commands as this display's
+        without encoding the led ids every time - see
+        display1593.led_group."""
+        return LedGroup(self, leds)
 
     def set_all_leds(self, rgb_array):
         logger.debug("Method set_all_leds.")
         assert rgb_array.shape == (self.n_leds, 3)
-        cmds_sent = {}
-        for (i, j), ser in zip(pairwise(self.led_idx), self._connections):
+        rgb_array = np.asarray(rgb_array, dtype=np.uint8)
+        if self.buffered:
+            self._buffer_all(rgb_array)
+            return
+        self._send_all_leds(rgb_array)
+
+    def _send_all_leds(self, rgb_array):
+        output = self._output(rgb_array)
+        for board in range(len(self.board_names)):
             # Command LA - implemented
-            cmd = np.concatenate([(76, 65), rgb_array[i:j].flatten()]).astype(
-                np.uint8
-            )
-            send_data_to_arduino(ser, cmd)
-            cmds_sent[ser] = cmd
-        for ser, cmd in cmds_sent.items():
-            self.check_response(ser, cmd)
+            self._send(board, self._encoder.la(board, output))
+        self._board_state[:] = rgb_array
+        self._board_state_known[:] = True
 
     def set_all_leds_one_colour(self, rgb):
         logger.debug("Method set_all_leds_one_colour.")
         assert len(rgb) == 3
+        if self.buffered:
+            self._buffer_all(rgb)
+            return
+        if self._gains is not None:
+            # Calibrated, the leds are no longer all one colour
+            rgb = np.asarray(rgb, dtype=np.uint8)
+            self._send_all_leds(np.broadcast_to(rgb, (self.n_leds, 3)))
+            return
         # Command CA - implemented
-        cmd = np.array((67, 65, *rgb), dtype=np.uint8)
-        for ser in self._connections:
-            send_data_to_arduino(ser, cmd)
-        for ser in self._connections:
-            self.check_response(ser, cmd)
+        self._send_to_all(
+            np.array((67, 65, *self._output_colour(rgb)), dtype=np.uint8)
+        )
+        self._board_state[:] = rgb
+        self._board_state_known[:] = True
+
+    def set_frame(self, rgb_array):
+        """Update every led to the colours in rgb_array (shape
+        (n_leds, 3)), sending each board only what has changed.
+
+        Compares the frame with the colours last sent to each board and,
+        per board, sends whichever is smallest of: nothing (no change),
+        LC or CA (the board's leds are all one colour), a CN per colour
+        (the changed leds have only a few colours), LN (just the changed
+        leds) or LA (the whole board). Frames that only change part of
+        the display (fire animations, the Schelling simulation) then
+        cost far fewer bytes on the wire than set_all_leds().
+        """
+        logger.debug("Method set_frame.")
+        rgb_array = np.asarray(rgb_array, dtype=np.uint8)
+        assert rgb_array.shape == (self.n_leds, 3)
+        if self.buffered:
+            self._buffer_all(rgb_array)
+            return
+        self._send_changes(
+            rgb_array, np.any(rgb_array != self._board_state, axis=1)
+        )
+
+    def stage_frame(self, rgb_array):
+        """Double-buffered version of set_frame(): send the next frame
+        to the boards while the current one is on display.
+
+        Each board's commands for the frame are held back until it has
+        acknowledged everything sent before them - including the last
+        show_now()'s SN, so the current frame has been latched - and
+        are then streamed in the background. Returns straight away, and
+        by the time of the next show_now() (or show_at()) the frame's
+        data is normally already on the boards, leaving only the 2-byte
+        SN commands to send at the deadline.
+        """
+        for worker in self._workers:
+            worker.wait_for_acks()
+        self.set_frame(rgb_array)
+
+    def flush(self):
+        """Buffered mode: send the dirty leds in the framebuffer to the
+        boards, using the smallest command per board (see set_frame()).
+
+        Leds that were written since the last flush but ended up the
+        same colour as before are not sent again.
+        """
+        logger.debug("Method flush.")
+        changed = self._dirty & np.any(
+            self.framebuffer != self._board_state, axis=1
+        )
+        self._send_changes(self.framebuffer, changed)
+        self._dirty[:] = False
+
+    def _buffer_leds(self, leds, rgb):
+        leds = np.asarray(leds)
+        if np.any((leds < 0) | (leds >= self.n_leds)):
+            raise ValueError("invalid led id")
+        self.framebuffer[leds] = rgb
+        self._dirty[leds] = True
+
+    def _buffer_all(self, rgb):
+        self.framebuffer[:] = rgb
+        self._dirty[:] = True
+
+    def _send_changes(self, rgb_array, changed):
+        # changed is a boolean mask of the leds in rgb_array that differ
+        # from what was last sent to the boards
+        output = self._output(rgb_array)
+        # Number of leds to update on each board (all of them if its
+        # contents are unknown), for every board at once
+        n_changed = np.where(
+            self._board_state_known,
+            np.add.reduceat(changed, self.led_idx[:-1], dtype=np.intp),
+            self.leds_per_board,
+        )
+        for board in np.flatnonzero(n_changed):
+            board = int(board)
+            for cmd in self._delta_commands(
+                board, output, changed, int(n_changed[board])
+            ):
+                self._send(board, cmd)
+        self._board_state[:] = rgb_array
+        self._board_state_known[:] = True
+
+    def _delta_commands(self, board, rgb_array, changed, n_changed):
+        """Return the smallest command(s) that update one board's leds
+        to those in rgb_array, given which (and how many) of them
+        changed - none if nothing changed.
+
+        The candidates are LC or CA (if the board's leds are all one
+        colour), a CN per colour (if the changed leds have few
+        distinct colours, as in the Schelling simulation or the clock),
+        LN for just the changed leds, and LA for the whole board.
+        """
+        if n_changed == 0:
+            return ()
+        i, j = self.led_idx[board], self.led_idx[board + 1]
+        board_rgb = rgb_array[i:j]
+        # LN may take several commands (see max_command_bytes)
+        n_ln_commands = -(-n_changed // self._encoder.max_ln_leds)
+        ln_size = (
+            LN_HEADER_BYTES * n_ln_commands + LN_BYTES_PER_LED * n_changed
+        )
+        la_size = LA_HEADER_BYTES + LA_BYTES_PER_LED * (j - i)
+        if CA_BYTES < min(ln_size, la_size) and np.all(
+            board_rgb == board_rgb[0]
+        ):
+            if not board_rgb[0].any():
+                return (self._encoder.raw(board, COMMAND_LC),)
+            cmd = np.array((67, 65, *board_rgb[0]), dtype=np.uint8)
+            return (self._encoder.raw(board, cmd),)
+        if (
+            CN_HEADER_BYTES + CN_BYTES_PER_LED * n_changed
+            < min(ln_size, la_size)
+        ):
+            # Could be smaller as CN commands, with few enough colours
+            if n_changed == j - i:
+                leds = np.arange(i, j, dtype=np.int32)
+            else:
+                leds = i + np.flatnonzero(changed[i:j]).astype(np.int32)
+            palette, leds_by_colour = _palette(rgb_array[leds], leds)
+            n_cn_commands = sum(
+                -(-len(group) // self._encoder.max_cn_leds)
+                for group in leds_by_colour
+            )
+            cn_size = (
+                CN_HEADER_BYTES * n_cn_commands + CN_BYTES_PER_LED * n_changed
+            )
+            if cn_size < min(ln_size, la_size):
+                return self._cn_commands(board, palette, leds_by_colour)
+        if ln_size < la_size:
+            return self._encoder.ln_changed(board, changed, rgb_array)
+        return (self._encoder.la(board, rgb_array),)
+
+    def _cn_commands(self, board, palette, leds_by_colour):
+        for rgb, leds in zip(palette, leds_by_colour):
+            yield from self._encoder.cn(board, leds, rgb)
 
     def prepare_image(self, image, size=(256, 256)):
         """Crop image to a square and resize it for convert_image()."""
@@ -465,22 +913,73 @@ class Display1593:
         return _convert_image(image_array)
 
     def show_image(self, filename, dimness=8):
+        """Show an image file, squared and dimmed (dividing by dimness)
+        with a lookup table.
+
+        The result then goes through the output lookup table like any
+        other colours, so with set_output_lut() the two combine: an
+        image is dimmed (or gamma corrected) by both. Pass dimness=None
+        to send the image's colours through the output table alone.
+        """
         logger.debug("Method show_image.")
         image = Image.open(filename)
         z = self.convert_image(self.prepare_image(image))
-        self.set_all_leds(z**2 / (256 * dimness))
+        if dimness is None:
+            rgb_array = np.clip(z, 0, 255).astype(np.uint8)
+        else:
+            rgb_array = np.take(_image_lut(dimness), z, mode="clip")
+        # Not self.set_all_leds(), which AsyncDisplay1593 overrides with
+        # a coroutine
+        Display1593.set_all_leds(self, rgb_array)
 
     def show_now(self):
         logger.debug("Method show_now.")
-        # Command SN - implemented
-        # TODO: In future this will be synchronized by comms between boards
-        cmd = COMMAND_SN
-        for ser in self._connections:
-            send_data_to_arduino(ser, cmd)
-        for ser in self._connections:
-            self.check_response(ser, cmd)
+        if self.buffered:
+            # Not self.flush(), as in show_image()
+            Display1593.flush(self)
+        # Command SN - implemented. The boards' writer threads wait for
+        # each other and write their SN commands at the same moment, so
+        # that the two halves of the display latch together.
+        if len(self._workers) > 1:
+            synced = SyncedShow(
+                len(self._workers), self.ack_timeout, self._stats
+            )
+            for board, worker in enumerate(self._workers):
+                worker.submit(self._encoder.raw(board, COMMAND_SN), synced)
+        else:
+            self._send_to_all(COMMAND_SN)
+        self._shown_state[:] = self._board_state
+
+    def show_at(self, t):
+        """Latch the leds, as show_now(), at time t (a time.monotonic()
+        value), waiting until then with self.timer (a DeadlineTimer,
+        whose stats() say how close to t it got). In buffered mode the
+        framebuffer is flushed first, so that it is sent while
+        waiting."""
+        if self.buffered:
+            self.flush()
+        self.timer.sleep_until(t)
+        self.show_now()
 
     def disconnect(self):
+        # Let the workers send any queued commands and wait for their
+        # responses before closing the ports. Every worker is stopped
+        # even if one raises an error (the first is re-raised).
+        errors = []
+        try:
+            for worker in self._workers:
+                try:
+                    worker.stop()
+                except Exception as err:
+                    errors.append(err)
+        finally:
+            self._workers = []
+            self._close_connections()
+        if errors:
+            raise errors[0]
+
+    def _close_connections(self):
+        """Close the ports and release the display lock."""
         while len(self._connections) > 0:
             ser = self._connections.pop()
             ser.close()
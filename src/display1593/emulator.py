@@ -0,0 +1,228 @@
+"""Emulates the display's Teensy boards on pseudo-terminals, so that the
+driver can be run, tested and benchmarked without the hardware.
+
+Each TeensyEmulator opens a pty pair (os.openpty()) and serves the
+"slave" end's path (e.g. /dev/pts/3) as its serial port, which
+Display1593 opens like any other port. A background thread reads from
+the "master" end and behaves like the firmware:
+
+- Messages in both directions are framed by serial_comm (through
+  display1593.framing, so the emulator doesn't depend on what the
+  framing is).
+- A HELLO_REQUEST message is answered with the board's name (e.g.
+  "TEENSY1"), which is how connect() finds out which board is on which
+  port. This much of serial_comm.connect_to_arduino() is assumed, not
+  known: if it waits for a hello the board sends unprompted instead,
+  the emulated boards won't be found.
+- Every other message is a command (LC, L1, LN, CN, LA, CA or SN). It
+  is applied to the emulated led state and acknowledged with the
+  6-byte length + sum response (see calc_expected_response()).
+  Unrecognized commands are acknowledged too, after a debug message
+  (a response starting with two zero bytes) saying what was wrong.
+
+The emulated link speed (baud_rate) and per-command firmware processing
+time (command_time) are configurable, so throughput measurements made
+against the emulators reflect where the time would go on real boards.
+
+Example:
+
+    with start_emulators() as emulators:
+        ports = [emulator.port for emulator in emulators]
+        with Display1593(ports=ports) as dis:
+            ...
+"""
+
+import contextlib
+import logging
+import os
+import select
+import threading
+import time
+import tty
+from collections import Counter
+
+import numpy as np
+
+from display1593.data.ledArray_data_1593 import num_leds
+from display1593.framing import ResponseParser, encode_message
+
+logger = logging.getLogger(__name__)
+
+# What serial_comm.connect_to_arduino() is assumed to send (see above)
+HELLO_REQUEST = b"HI"
+
+# Serial bits per byte sent (start bit, 8 data bits, stop bit)
+BITS_PER_BYTE = 10
+# How often (seconds) the emulator thread checks whether it should stop
+POLL_INTERVAL = 0.1
+
+
+class TeensyEmulator:
+    """Emulates one Teensy board on a pseudo-terminal.
+
+    name: the board name sent in reply to the hello request.
+    n_leds: number of leds on the board.
+    baud_rate: emulated link speed in bits per second, or None for no
+        limit (as fast as the pty goes).
+    command_time: emulated firmware processing time per command, in
+        seconds.
+
+    After start(), `port` is the path to open to talk to it. `leds` is
+    the board's led buffer and `shown` the colours last latched by an
+    SN command; `commands` counts the commands received, by type.
+    """
+
+    def __init__(self, name, n_leds, baud_rate=None, command_time=0.0):
+        self.name = name
+        self.n_leds = n_leds
+        self.baud_rate = baud_rate
+        self.command_time = command_time
+        self.leds = np.zeros((n_leds, 3), dtype=np.uint8)
+        self.shown = np.zeros((n_leds, 3), dtype=np.uint8)
+        self.commands = Counter()
+        self.bytes_received = 0
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        # Raw mode, so no bytes are translated or echoed. The emulator
+        # keeps its own handle on the slave end open, so that the port
+        # can be closed and reopened by the driver without the master
+        # end seeing end-of-file.
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.name}-emulator", daemon=True
+        )
+        self._thread.start()
+        logger.debug("Emulating %s on %s.", self.name, self.port)
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+    def _run(self):
+        parser = ResponseParser()
+        # Time at which the emulated link will have finished delivering
+        # everything read so far
+        link_time = time.monotonic()
+        while not self._stopping.is_set():
+            ready, _, _ = select.select([self._master], [], [], POLL_INTERVAL)
+            if not ready:
+                continue
+            try:
+                chunk = os.read(self._master, 65536)
+            except OSError:
+                return
+            self.bytes_received += len(chunk)
+            if self.baud_rate is not None:
+                link_time = (
+                    max(link_time, time.monotonic())
+                    + len(chunk) * BITS_PER_BYTE / self.baud_rate
+                )
+                delay = link_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            for payload in parser.feed(chunk):
+                self._handle_message(payload.tobytes())
+
+    def _handle_message(self, payload):
+        if payload == HELLO_REQUEST:
+            self._write_message(self.name.encode())
+            return
+        if self.command_time > 0:
+            time.sleep(self.command_time)
+        try:
+            self._apply_command(payload)
+        except (ValueError, IndexError) as err:
+            self.commands["invalid"] += 1
+            self._write_message(b"\x00\x00" + str(err).encode())
+        total = sum(payload) & 0xFFFFFFFF
+        self._write_message(
+            len(payload).to_bytes(2, "big") + total.to_bytes(4, "big")
+        )
+
+    def _apply_command(self, payload):
+        command, data = payload[:2], np.frombuffer(payload[2:], np.uint8)
+        if command == b"LC":
+            self.leds[:] = 0
+        elif command == b"L1":
+            self._set_leds(data[0:2], data[2:5].reshape(1, 3))
+        elif command == b"LN":
+            n = int(data[0]) * 256 + int(data[1])
+            items = data[2 : 2 + 5 * n].reshape(n, 5)
+            self._set_leds(items[:, :2].flatten(), items[:, 2:])
+        elif command == b"CN":
+            n = int(data[0]) * 256 + int(data[1])
+            self._set_leds(data[5 : 5 + 2 * n], data[2:5])
+        elif command == b"LA":
+            self.leds[:] = data.reshape(self.n_leds, 3)
+        elif command == b"CA":
+            self.leds[:] = data[:3]
+        elif command == b"SN":
+            self.shown[:] = self.leds
+        else:
+            raise ValueError(f"unknown command {command!r}")
+        self.commands[command.decode()] += 1
+
+    def _set_leds(self, id_bytes, rgb):
+        ids = id_bytes.reshape(-1, 2).astype(int) @ (256, 1)
+        # Like the firmware, ignore ids past the end of the board
+        # (led_command_tests.py checks this)
+        valid = ids < self.n_leds
+        if rgb.ndim == 2:
+            rgb = rgb[valid]
+        self.leds[ids[valid]] = rgb
+
+    def _write_message(self, payload):
+        message = encode_message(np.frombuffer(payload, dtype=np.uint8))
+        while message:
+            written = os.write(self._master, message)
+            message = message[written:]
+
+
+@contextlib.contextmanager
+def start_emulators(
+    board_names=("TEENSY1", "TEENSY2"),
+    leds_per_board=num_leds,
+    swap_ports=True,
+    **kwargs,
+):
+    """Start one TeensyEmulator per board, stopping them all on exit.
+
+    Yields the list of emulators, in port order. With swap_ports (the
+    default), that order is reversed from board_names - as the real
+    boards often are on /dev/ttyACM0 and /dev/ttyACM1 - so that
+    connect() has to tell them apart by name. Other keyword arguments
+    (baud_rate, command_time) are passed to every TeensyEmulator.
+    """
+    emulators = [
+        TeensyEmulator(name, n, **kwargs)
+        for name, n in zip(board_names, leds_per_board)
+    ]
+    if swap_ports:
+        emulators.reverse()
+    with contextlib.ExitStack() as stack:
+        for emulator in emulators:
+            stack.enter_context(emulator)
+        yield emulators
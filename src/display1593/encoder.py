@@ -0,0 +1,667 @@
+"""Allocation-free encoding of the commands sent to the boards.
+
+Building a command with np.concatenate()/np.hstack() allocates several
+temporary arrays per board, every frame, and then calc_expected_response()
+makes another pass over the result to work out the response to expect.
+CommandEncoder instead owns a small pool of preallocated wire buffers
+per board (each big enough for the largest command that board can be
+sent), and the numba functions below write the header, led ids and
+colours straight into one of them - computing the expected length/sum
+response in the same pass.
+
+A buffer handed out by the encoder (a WireCommand) stays in use while
+the command is queued, written and waiting for its response, so it is
+only returned to its pool once the command has been acknowledged (see
+AckPipeline). The pools are sized to cover everything that can be
+queued and in flight at once; if one does run out, a new buffer is
+allocated rather than blocking.
+"""
+
+import logging
+import time
+from collections import deque
+
+import numpy as np
+from numba import jit, types
+
+logger = logging.getLogger(__name__)
+
+# Wire bytes per command: a fixed header plus so many bytes per led
+LA_HEADER_BYTES, LA_BYTES_PER_LED = 2, 3
+LN_HEADER_BYTES, LN_BYTES_PER_LED = 4, 5
+CN_HEADER_BYTES, CN_BYTES_PER_LED = 7, 2
+CA_BYTES = 5
+
+# Numba array types. The arrays only read from are typed readonly, which
+# accepts writable arrays too, so frames from np.frombuffer() or shared
+# memory (display1593.shared_frame) can be encoded without a copy.
+uint8_buffer = types.Array(types.uint8, 1, "C")
+uint8_input = types.Array(types.uint8, 1, "C", readonly=True)
+uint8_rgb_array = types.Array(types.uint8, 2, "A", readonly=True)
+int32_leds = types.Array(types.int32, 1, "A", readonly=True)
+bool_mask = types.Array(types.boolean, 1, "A", readonly=True)
+length_and_next = types.UniTuple(types.intp, 2)
+
+
+@jit([uint8_buffer(uint8_input)], nopython=True, cache=True)
+def calc_expected_response(cmd):
+    """
+    Calculate the expected response of the Arduino to the command.
+
+    Args:
+        cmd: NumPy array of uint8 values
+
+    Returns:
+        NumPy array of 6 uint8 values:
+        - Bytes 0-1: length of cmd (16-bit big-endian)
+        - Bytes 2-5: sum of cmd values (32-bit big-endian)
+    """
+    expected_response = np.empty(6, dtype=np.uint8)
+
+    # Get the length of cmd
+    cmd_length = len(cmd)
+
+    # Bytes 0-1: length as 16-bit big-endian (high byte first)
+    expected_response[0] = (cmd_length >> 8) & 0xFF  # High byte
+    expected_response[1] = cmd_length & 0xFF  # Low byte
+
+    # Calculate sum of all values in cmd
+    cmd_sum = np.uint32(0)
+    for i in range(len(cmd)):
+        cmd_sum += cmd[i]
+
+    # Bytes 2-5: sum as 32-bit big-endian (high byte first)
+    expected_response[2] = (cmd_sum >> 24) & 0xFF  # Highest byte
+    expected_response[3] = (cmd_sum >> 16) & 0xFF
+    expected_response[4] = (cmd_sum >> 8) & 0xFF
+    expected_response[5] = cmd_sum & 0xFF  # Lowest byte
+
+    return expected_response
+
+
+@jit(
+    [types.void(uint8_buffer, types.intp, types.intp)],
+    nopython=True,
+    cache=True,
+)
+def _write_response(resp, length, total):
+    """Expected response: length (16-bit) then sum (32-bit), both
+    big-endian - see calc_expected_response() above."""
+    resp[0] = (length >> 8) & 0xFF
+    resp[1] = length & 0xFF
+    resp[2] = (total >> 24) & 0xFF
+    resp[3] = (total >> 16) & 0xFF
+    resp[4] = (total >> 8) & 0xFF
+    resp[5] = total & 0xFF
+
+
+@jit(
+    [types.intp(uint8_buffer, uint8_buffer, uint8_input, types.intp)],
+    nopython=True,
+    cache=True,
+)
+def _encode_raw(buf, resp, cmd, n):
+    total = 0
+    for k in range(n):
+        buf[k] = cmd[k]
+        total += cmd[k]
+    _write_response(resp, n, total)
+    return n
+
+
+@jit(
+    [
+        types.intp(
+            uint8_buffer, uint8_buffer, uint8_rgb_array, types.intp, types.intp
+        )
+    ],
+    nopython=True,
+    cache=True,
+)
+def _encode_la(buf, resp, rgb_array, lo, hi):
+    """Command LA for the leds lo to hi - 1 of rgb_array."""
+    buf[0] = 76
+    buf[1] = 65
+    total = 76 + 65
+    k = 2
+    for i in range(lo, hi):
+        for c in range(3):
+            v = rgb_array[i, c]
+            buf[k] = v
+            total += v
+            k += 1
+    _write_response(resp, k, total)
+    return k
+
+
+@jit(nopython=True, cache=True)
+def _ln_led(buf, k, led, rgb_array, i):
+    buf[k] = (led >> 8) & 0xFF
+    buf[k + 1] = led & 0xFF
+    total = np.intp(buf[k]) + buf[k + 1]
+    for c in range(3):
+        v = rgb_array[i, c]
+        buf[k + 2 + c] = v
+        total += v
+    return total
+
+
+@jit(nopython=True, cache=True)
+def _finish_n_command(buf, resp, k, n, total):
+    # Fill in the 2-byte led count of an LN/CN command, once known
+    buf[2] = (n >> 8) & 0xFF
+    buf[3] = n & 0xFF
+    total += buf[0] + buf[1] + buf[2] + buf[3]
+    _write_response(resp, k, total)
+    return k
+
+
+# The LN/CN encoders below write at most max_n leds to the command,
+# starting from position `start` (in leds, or in the display's led ids
+# for _encode_ln_changed), and return the command's length and the
+# position to carry on from in the next command.
+
+
+@jit(
+    [
+        length_and_next(
+            uint8_buffer,
+            uint8_buffer,
+            int32_leds,
+            uint8_rgb_array,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+        )
+    ],
+    nopython=True,
+    cache=True,
+)
+def _encode_ln(buf, resp, leds, rgb_array, lo, hi, start, max_n):
+    """Command LN for those of leds (with colours rgb_array) that are
+    on the board holding leds lo to hi - 1."""
+    buf[0] = 76
+    buf[1] = 78
+    total = 0
+    k = LN_HEADER_BYTES
+    n = 0
+    i = start
+    while i < leds.shape[0] and n < max_n:
+        led = leds[i]
+        if lo <= led < hi:
+            total += _ln_led(buf, k, led - lo, rgb_array, i)
+            k += LN_BYTES_PER_LED
+            n += 1
+        i += 1
+    return _finish_n_command(buf, resp, k, n, total), i
+
+
+@jit(
+    [
+        length_and_next(
+            uint8_buffer,
+            uint8_buffer,
+            bool_mask,
+            uint8_rgb_array,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+        )
+    ],
+    nopython=True,
+    cache=True,
+)
+def _encode_ln_changed(buf, resp, changed, rgb_array, lo, hi, start, max_n):
+    """Command LN for the leds lo to hi - 1 of rgb_array where changed
+    is True."""
+    buf[0] = 76
+    buf[1] = 78
+    total = 0
+    k = LN_HEADER_BYTES
+    n = 0
+    led = start
+    while led < hi and n < max_n:
+        if changed[led]:
+            total += _ln_led(buf, k, led - lo, rgb_array, led)
+            k += LN_BYTES_PER_LED
+            n += 1
+        led += 1
+    return _finish_n_command(buf, resp, k, n, total), led
+
+
+@jit(
+    [
+        length_and_next(
+            uint8_buffer,
+            uint8_buffer,
+            int32_leds,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+        )
+    ],
+    nopython=True,
+    cache=True,
+)
+def _encode_cn(buf, resp, leds, r, g, b, lo, hi, start, max_n):
+    """Command CN setting those of leds that are on the board holding
+    leds lo to hi - 1 to colour (r, g, b)."""
+    buf[0] = 67
+    buf[1] = 78
+    buf[4] = r
+    buf[5] = g
+    buf[6] = b
+    total = r + g + b
+    k = CN_HEADER_BYTES
+    n = 0
+    i = start
+    while i < leds.shape[0] and n < max_n:
+        led = leds[i]
+        if lo <= led < hi:
+            led -= lo
+            buf[k] = (led >> 8) & 0xFF
+            buf[k + 1] = led & 0xFF
+            total += buf[k] + buf[k + 1]
+            k += CN_BYTES_PER_LED
+            n += 1
+        i += 1
+    return _finish_n_command(buf, resp, k, n, total), i
+
+
+# Compiled LN/CN commands (see CommandEncoder.compile_ln()) are copied
+# from a template, already holding the header and led ids, with the
+# colours patched in. template_total is the sum of the template's bytes.
+
+
+@jit(
+    [
+        types.intp(
+            uint8_buffer,
+            uint8_buffer,
+            uint8_input,
+            types.intp,
+            types.intp,
+            uint8_rgb_array,
+            int32_leds,
+        )
+    ],
+    nopython=True,
+    cache=True,
+)
+def _patch_ln(buf, resp, template, length, template_total, rgb_array, rows):
+    """Compiled command LN, with the colours of the leds taken from rows
+    rows of rgb_array."""
+    buf[:length] = template[:length]
+    total = template_total
+    k = LN_HEADER_BYTES + 2
+    for i in range(rows.shape[0]):
+        for c in range(3):
+            v = rgb_array[rows[i], c]
+            buf[k + c] = v
+            total += v
+        k += LN_BYTES_PER_LED
+    _write_response(resp, length, total)
+    return length
+
+
+@jit(
+    [
+        types.intp(
+            uint8_buffer,
+            uint8_buffer,
+            uint8_input,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+            types.intp,
+        )
+    ],
+    nopython=True,
+    cache=True,
+)
+def _patch_cn(buf, resp, template, length, template_total, r, g, b):
+    """Compiled command CN, setting its leds to colour (r, g, b)."""
+    buf[:length] = template[:length]
+    buf[4] = r
+    buf[5] = g
+    buf[6] = b
+    _write_response(resp, length, template_total + r + g + b)
+    return length
+
+
+class CompiledCommand:
+    """A template for an LN or CN command to a fixed set of leds, from
+    CommandEncoder.compile_ln() or compile_cn()."""
+
+    __slots__ = ("template", "length", "total", "rows")
+
+    def __init__(self, template, rows):
+        self.template = template.copy()
+        self.length = template.shape[0]
+        self.total = int(template.sum())
+        # For LN, which rows of the colours passed to ln_compiled() go
+        # in the command, in order
+        self.rows = rows
+
+
+class WireCommand:
+    """A preallocated buffer holding one encoded command, and the
+    response the board should send back for it."""
+
+    __slots__ = (
+        "buf",
+        "length",
+        "expected_response",
+        "encode_time",
+        "written_at",
+        "_pool",
+    )
+
+    def __init__(self, size, pool):
+        self.buf = np.zeros(size, dtype=np.uint8)
+        self.length = 0
+        self.expected_response = np.zeros(6, dtype=np.uint8)
+        # Seconds spent encoding it, and time.perf_counter() when it
+        # was written to the port - for CommandStats
+        self.encode_time = 0.0
+        self.written_at = 0.0
+        self._pool = pool
+
+    @property
+    def data(self):
+        """The encoded command (a view of the buffer)."""
+        return self.buf[: self.length]
+
+    @property
+    def kind(self):
+        """The command type, e.g. "LA"."""
+        return self.buf[:2].tobytes().decode()
+
+    def release(self):
+        """Return the buffer to its pool for reuse. Called once the
+        command has been acknowledged (or has timed out)."""
+        self._pool.append(self)
+
+
+class CommandEncoder:
+    """Encodes commands for each board into reusable wire buffers.
+
+    leds_per_board: number of leds on each board.
+    n_buffers: number of buffers per board - enough to cover every
+        command that can be queued or in flight at the same time.
+    max_command_bytes: the largest command the firmware can receive.
+        Updates to more leds than fit in one LN or CN command are split
+        into several. Defaults to the size of the largest LA command
+        (which is always sent whole).
+
+    Each method returns a WireCommand for the given board (an index
+    into leds_per_board), or for LN and CN, yields as many as are
+    needed; call release() on each once it has been acknowledged. Led
+    ids are display-wide, and only those on the given board are
+    included in the command.
+    """
+
+    def __init__(self, leds_per_board, n_buffers, max_command_bytes=None):
+        self.led_idx = np.concatenate(
+            ([0], np.cumsum(leds_per_board))
+        ).astype(np.intp)
+        la_sizes = [
+            LA_HEADER_BYTES + LA_BYTES_PER_LED * n for n in leds_per_board
+        ]
+        if max_command_bytes is None:
+            max_command_bytes = max(la_sizes)
+        if max_command_bytes < CN_HEADER_BYTES + CN_BYTES_PER_LED or (
+            max_command_bytes < LN_HEADER_BYTES + LN_BYTES_PER_LED
+        ):
+            raise ValueError("max_command_bytes is too small")
+        self.max_command_bytes = max_command_bytes
+        # Most leds per LN/CN command (the count is sent in 2 bytes)
+        self.max_ln_leds = min(
+            (max_command_bytes - LN_HEADER_BYTES) // LN_BYTES_PER_LED, 0xFFFF
+        )
+        self.max_cn_leds = min(
+            (max_command_bytes - CN_HEADER_BYTES) // CN_BYTES_PER_LED, 0xFFFF
+        )
+        self._buffer_sizes = [
+            max(
+                la_size,
+                min(
+                    max(
+                        LN_HEADER_BYTES + LN_BYTES_PER_LED * n,
+                        CN_HEADER_BYTES + CN_BYTES_PER_LED * n,
+                    ),
+                    max_command_bytes,
+                ),
+            )
+            for n, la_size in zip(leds_per_board, la_sizes)
+        ]
+        self._pools = []
+        for size in self._buffer_sizes:
+            pool = deque()
+            pool.extend(WireCommand(size, pool) for _ in range(n_buffers))
+            self._pools.append(pool)
+
+    def board_of(self, led):
+        """The board (index) that led (a display-wide led id) is on."""
+        return int(np.searchsorted(self.led_idx, led, side="right")) - 1
+
+    def partition(self, leds):
+        """Split leds (valid int32 led ids) up by board, in one
+        vectorized step whatever the number of boards: yields (board,
+        rows) for each board with any of the leds, where rows (int32)
+        are the positions in leds of those on the board, in order."""
+        boards = np.searchsorted(self.led_idx, leds, side="right") - 1
+        order = np.argsort(boards, kind="stable").astype(np.int32)
+        bounds = np.searchsorted(
+            boards[order], np.arange(self.led_idx.shape[0])
+        )
+        for board in np.flatnonzero(bounds[1:] > bounds[:-1]):
+            yield int(board), order[bounds[board] : bounds[board + 1]]
+
+    def _acquire(self, board):
+        pool = self._pools[board]
+        try:
+            return pool.pop()
+        except IndexError:
+            logger.debug("Wire buffer pool %d empty, allocating.", board)
+            return WireCommand(self._buffer_sizes[board], pool)
+
+    @staticmethod
+    def _finish(wire_cmd, length, start):
+        wire_cmd.length = length
+        wire_cmd.encode_time = time.perf_counter() - start
+        return wire_cmd
+
+    def raw(self, board, cmd):
+        """A short, already-encoded command, e.g. COMMAND_SN."""
+        if cmd.shape[0] > self._buffer_sizes[board]:
+            raise ValueError("command too long")
+        start = time.perf_counter()
+        wire_cmd = self._acquire(board)
+        length = _encode_raw(
+            wire_cmd.buf, wire_cmd.expected_response, cmd, cmd.shape[0]
+        )
+        return self._finish(wire_cmd, length, start)
+
+    def la(self, board, rgb_array):
+        """Command LA, taking the board's leds from rgb_array, an
+        (n_leds, 3) uint8 array of colours for the whole display."""
+        start = time.perf_counter()
+        wire_cmd = self._acquire(board)
+        length = _encode_la(
+            wire_cmd.buf,
+            wire_cmd.expected_response,
+            rgb_array,
+            self.led_idx[board],
+            self.led_idx[board + 1],
+        )
+        return self._finish(wire_cmd, length, start)
+
+    def ln(self, board, leds, rgb_array):
+        """Commands LN for the board's leds among leds (int32 led ids),
+        with colours rgb_array (a uint8 row per led). Yields nothing if
+        none of them is on the board."""
+        i = 0
+        while i < leds.shape[0]:
+            start = time.perf_counter()
+            wire_cmd = self._acquire(board)
+            length, i = _encode_ln(
+                wire_cmd.buf,
+                wire_cmd.expected_response,
+                leds,
+                rgb_array,
+                self.led_idx[board],
+                self.led_idx[board + 1],
+                i,
+                self.max_ln_leds,
+            )
+            yield from self._non_empty(
+                wire_cmd, length, start, LN_HEADER_BYTES
+            )
+
+    def ln_changed(self, board, changed, rgb_array):
+        """Commands LN for the board's leds where the boolean mask
+        changed is True, taking their colours from rgb_array (colours
+        for the whole display)."""
+        led, hi = self.led_idx[board], self.led_idx[board + 1]
+        while led < hi:
+            start = time.perf_counter()
+            wire_cmd = self._acquire(board)
+            length, led = _encode_ln_changed(
+                wire_cmd.buf,
+                wire_cmd.expected_response,
+                changed,
+                rgb_array,
+                self.led_idx[board],
+                hi,
+                led,
+                self.max_ln_leds,
+            )
+            yield from self._non_empty(
+                wire_cmd, length, start, LN_HEADER_BYTES
+            )
+
+    def cn(self, board, leds, rgb):
+        """Commands CN setting the board's leds among leds (int32 led
+        ids) to the colour rgb."""
+        i = 0
+        while i < leds.shape[0]:
+            start = time.perf_counter()
+            wire_cmd = self._acquire(board)
+            length, i = _encode_cn(
+                wire_cmd.buf,
+                wire_cmd.expected_response,
+                leds,
+                rgb[0],
+                rgb[1],
+                rgb[2],
+                self.led_idx[board],
+                self.led_idx[board + 1],
+                i,
+                self.max_cn_leds,
+            )
+            yield from self._non_empty(
+                wire_cmd, length, start, CN_HEADER_BYTES
+            )
+
+    def compile_ln(self, board, leds, rows=None):
+        """Templates for the commands LN setting the board's leds among
+        leds (int32 led ids) - one per command ln() would send. rows,
+        if given, are the positions of those leds in leds (as from
+        partition())."""
+        lo, hi = self.led_idx[board], self.led_idx[board + 1]
+        compiled = []
+        for rows in self._chunk_rows(board, leds, rows, self.max_ln_leds):
+            template = np.zeros(self._buffer_sizes[board], dtype=np.uint8)
+            no_colours = np.zeros((rows.shape[0], 3), dtype=np.uint8)
+            length, _ = _encode_ln(
+                template,
+                np.zeros(6, dtype=np.uint8),
+                leds[rows],
+                no_colours,
+                lo,
+                hi,
+                0,
+                self.max_ln_leds,
+            )
+            compiled.append(CompiledCommand(template[:length], rows))
+        return compiled
+
+    def compile_cn(self, board, leds, rows=None):
+        """As compile_ln(), for commands CN."""
+        lo, hi = self.led_idx[board], self.led_idx[board + 1]
+        compiled = []
+        for rows in self._chunk_rows(board, leds, rows, self.max_cn_leds):
+            template = np.zeros(self._buffer_sizes[board], dtype=np.uint8)
+            length, _ = _encode_cn(
+                template,
+                np.zeros(6, dtype=np.uint8),
+                leds[rows],
+                0,
+                0,
+                0,
+                lo,
+                hi,
+                0,
+                self.max_cn_leds,
+            )
+            compiled.append(CompiledCommand(template[:length], rows))
+        return compiled
+
+    def _chunk_rows(self, board, leds, on_board, max_n):
+        # Positions in leds of the board's leds, max_n at a time
+        if on_board is None:
+            lo, hi = self.led_idx[board], self.led_idx[board + 1]
+            on_board = np.flatnonzero((leds >= lo) & (leds < hi))
+        for i in range(0, on_board.shape[0], max_n):
+            yield on_board[i : i + max_n].astype(np.int32)
+
+    def ln_compiled(self, board, compiled, rgb_array):
+        """Commands LN from templates from compile_ln(), with colours
+        rgb_array (a uint8 row per led passed to compile_ln())."""
+        for command in compiled:
+            start = time.perf_counter()
+            wire_cmd = self._acquire(board)
+            length = _patch_ln(
+                wire_cmd.buf,
+                wire_cmd.expected_response,
+                command.template,
+                command.length,
+                command.total,
+                rgb_array,
+                command.rows,
+            )
+            yield self._finish(wire_cmd, length, start)
+
+    def cn_compiled(self, board, compiled, rgb):
+        """Commands CN from templates from compile_cn(), setting their
+        leds to the colour rgb."""
+        for command in compiled:
+            start = time.perf_counter()
+            wire_cmd = self._acquire(board)
+            length = _patch_cn(
+                wire_cmd.buf,
+                wire_cmd.expected_response,
+                command.template,
+                command.length,
+                command.total,
+                rgb[0],
+                rgb[1],
+                rgb[2],
+            )
+            yield self._finish(wire_cmd, length, start)
+
+    def _non_empty(self, wire_cmd, length, start, header_bytes):
+        # The last LN/CN command of a series can come out with no leds
+        # in it (or the only one, if no leds are on the board)
+        if length == header_bytes:
+            wire_cmd.release()
+            return ()
+        return (self._finish(wire_cmd, length, start),)
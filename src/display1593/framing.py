@@ -0,0 +1,143 @@
+"""Fewer system calls per message on the serial links to the Teensy boards.
+
+The message framing, and the hello handshake connect() uses to find out
+which board is on a port, belong to the external serial_comm module,
+which matches the boards' firmware. Neither its source nor the
+firmware's is in this repository, so this module doesn't assume what
+the framing looks like: it runs serial_comm's own functions against
+stand-in ports, and only changes how the bytes get to and from the real
+port.
+
+- write_message() sends a message with a single write(). It collects
+  what serial_comm.send_data_to_arduino() writes (possibly in several
+  pieces) and writes it to the port in one go.
+- ResponseParser splits whatever bytes have been read so far into
+  messages, keeping a partial message until the rest of it arrives. It
+  runs serial_comm.receive_data_from_arduino() against the bytes held,
+  so readers can take everything waiting on the port with one
+  non-blocking read (at most READ_SIZE bytes), however it happens to be
+  split up.
+
+The scripts that talk to the boards directly (comm_led_test.py,
+led_command_tests.py) still use serial_comm as it is.
+"""
+
+import numpy as np
+from serial_comm import receive_data_from_arduino, send_data_to_arduino
+
+# Most bytes read from a port at a time
+READ_SIZE = 4096
+# Times in a row a ResponseParser's stand-in port reports the bytes
+# waiting on it without any being read, before it decides that
+# receive_data_from_arduino() is waiting for more than it holds
+MAX_IDLE_POLLS = 2
+
+
+class _Incomplete(Exception):
+    """Raised by _HeldBytes when a message isn't all there yet."""
+
+
+class _WrittenBytes:
+    """Stand-in port that keeps everything written to it."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _HeldBytes:
+    """Stand-in port that reads from the bytes a ResponseParser holds,
+    raising _Incomplete instead of waiting for more."""
+
+    timeout = 0
+
+    def __init__(self, buffer, position):
+        self._buffer = buffer
+        self.position = position
+        self._idle_polls = 0
+
+    @property
+    def in_waiting(self):
+        self._idle_polls += 1
+        if self._idle_polls > MAX_IDLE_POLLS:
+            raise _Incomplete
+        return len(self._buffer) - self.position
+
+    def read(self, size=1):
+        self._idle_polls = 0
+        end = self.position + size
+        if end > len(self._buffer):
+            raise _Incomplete
+        data = bytes(self._buffer[self.position : end])
+        self.position = end
+        return data
+
+
+def _as_uint8(message):
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return np.frombuffer(message, dtype=np.uint8).copy()
+    return np.array(message, dtype=np.uint8)
+
+
+def encode_message(data):
+    """Return the bytes serial_comm sends for data (a sequence of byte
+    values, such as a uint8 array)."""
+    port = _WrittenBytes()
+    send_data_to_arduino(port, data)
+    return bytes(port.data)
+
+
+def write_message(ser, data):
+    """Send data (a sequence of byte values) as one message, with a
+    single write()."""
+    ser.write(encode_message(data))
+
+
+def write_command(ser, cmd):
+    """Send an encoded WireCommand (see display1593.encoder) as one
+    message, with a single write()."""
+    write_message(ser, cmd.data)
+
+
+class ResponseParser:
+    """Incremental parser for the messages arriving on one port.
+
+    Feed it the bytes read from the port, in any sized pieces; feed()
+    returns the payloads (uint8 arrays) of the messages completed so
+    far.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def __len__(self):
+        """Number of bytes held of the next, incomplete message."""
+        return len(self._buffer)
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        messages = []
+        start = 0
+        while start < len(buffer):
+            port = _HeldBytes(buffer, start)
+            try:
+                message = receive_data_from_arduino(port)
+            except _Incomplete:
+                break
+            if port.position == start:
+                break
+            messages.append(_as_uint8(message))
+            start = port.position
+        del buffer[:start]
+        return messages
+
+    def clear(self):
+        self._buffer.clear()
@@ -0,0 +1,91 @@
+"""Groups of leds that are set again and again, with their commands
+compiled once.
+
+Lots of scripts light the same sets of leds over and over: the clock's
+colon dots every second, its segments every minute. Each set_leds() or
+set_leds_one_colour() call works out which of the leds are on which
+board and encodes their ids into the commands all over again. A
+LedGroup does that once, when it is compiled, keeping a template of
+each LN and CN command it needs with the led ids (and their share of
+the checksum) already filled in; setting the group's leds only copies
+the templates and patches in the colours:
+
+    dots = dis.compile_group(dot_leds)
+    while True:
+        dots.set_leds_one_colour((255, 0, 0))
+        ...
+
+The commands are the same as set_leds() and set_leds_one_colour() would
+send (so the same leds must not be listed twice), and otherwise they
+behave the same - in buffered mode, with an output lookup table or a
+calibration.
+"""
+
+import numpy as np
+
+
+class LedGroup:
+    """A fixed set of leds, from Display1593.compile_group().
+
+    `leds` is the group's led ids (an int32 array), in the order that
+    set_leds() takes their colours in.
+    """
+
+    def __init__(self, display, leds):
+        leds = np.array(leds, dtype=np.int32)
+        display._check_led_ids(leds)
+        self.display = display
+        self.leds = leds
+        encoder = display._encoder
+        # (board, compiled commands) for each board with any of the leds
+        self._ln_commands = []
+        self._cn_commands = []
+        for board, rows in encoder.partition(leds):
+            ln = encoder.compile_ln(board, leds, rows)
+            cn = encoder.compile_cn(board, leds, rows)
+            self._ln_commands.append((board, ln))
+            self._cn_commands.append((board, cn))
+
+    def __len__(self):
+        return self.leds.shape[0]
+
+    def set_leds(self, rgb_array):
+        """Set the group's leds to the colours in rgb_array, a row per
+        led, as Display1593.set_leds()."""
+        dis = self.display
+        rgb_array = np.asarray(rgb_array, dtype=np.uint8)
+        assert rgb_array.shape == (len(self), 3)
+        if dis.buffered:
+            dis._buffer_leds(self.leds, rgb_array)
+            return
+        self._send_leds(rgb_array)
+
+    # set_leds_one_colour() falls back on _send_leds() rather than
+    # set_leds(), which AsyncLedGroup overrides with a coroutine
+
+    def _send_leds(self, rgb_array):
+        dis = self.display
+        output = dis._output(rgb_array, self.leds)
+        for board, compiled in self._ln_commands:
+            for cmd in dis._encoder.ln_compiled(board, compiled, output):
+                dis._send(board, cmd)
+        dis._board_state[self.leds] = rgb_array
+
+    def set_leds_one_colour(self, rgb):
+        """Set all the group's leds to the colour rgb, as
+        Display1593.set_leds_one_colour()."""
+        dis = self.display
+        assert len(rgb) == 3
+        if dis.buffered:
+            dis._buffer_leds(self.leds, rgb)
+            return
+        if dis.calibration is not None:
+            # Calibrated, the leds are no longer all one colour
+            rgb = np.asarray(rgb, dtype=np.uint8)
+            self._send_leds(np.broadcast_to(rgb, (len(self), 3)))
+            return
+        output = dis._output_colour(rgb)
+        for board, compiled in self._cn_commands:
+            for cmd in dis._encoder.cn_compiled(board, compiled, output):
+                dis._send(board, cmd)
+        dis._board_state[self.leds] = rgb
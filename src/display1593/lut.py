@@ -0,0 +1,65 @@
+"""Lookup tables for the display's output stage.
+
+Scripts used to do their own gamma correction and dimming in floating
+point - z**2 / (256 * dimness) for images, a brightness divisor per
+hour in the clock - making float temporaries the size of the display
+every frame. Display1593 instead maps every colour it sends through an
+output lookup table: a (3, 256) uint8 array, one row per channel,
+giving the value sent to the board for each value set by the script.
+It is applied with np.take into a preallocated buffer just before the
+commands are encoded, so it costs a few microseconds per frame and no
+allocations, and the script keeps working in undimmed colours:
+
+    dis.set_output_lut(make_lut(gamma=2, brightness=1 / 6))
+
+The host-side copies of the board state (used by set_frame() to send
+only what changed) hold the colours before the lookup, so changing the
+table resends the current colours through the new one.
+"""
+
+import numpy as np
+
+LUT_SHAPE = (3, 256)
+
+
+def make_lut(gamma=1.0, brightness=1.0):
+    """Return an output lookup table mapping each value v (0-255) to
+    255 * brightness * (v / 255) ** gamma, rounded. gamma and
+    brightness are numbers, or (r, g, b) sequences of them for
+    per-channel correction."""
+    gamma = np.broadcast_to(np.asarray(gamma, dtype=float), 3)
+    brightness = np.broadcast_to(np.asarray(brightness, dtype=float), 3)
+    levels = np.arange(256) / 255
+    lut = (
+        255
+        * brightness[:, np.newaxis]
+        * levels[np.newaxis, :] ** gamma[:, np.newaxis]
+    )
+    return np.rint(np.clip(lut, 0, 255)).astype(np.uint8)
+
+
+def check_lut(lut):
+    """Return lut as a (3, 256) uint8 array, raising ValueError if it
+    isn't one, or if it doesn't map 0 to 0 (clear_all() always turns
+    the leds off)."""
+    lut = np.asarray(lut)
+    if lut.shape == (256,):
+        lut = np.tile(lut, (3, 1))
+    if lut.shape != LUT_SHAPE or lut.dtype != np.uint8:
+        raise ValueError("lut must be a (3, 256) or (256,) uint8 array")
+    if np.any(lut[:, 0] != 0):
+        raise ValueError("lut must map 0 to 0")
+    return np.ascontiguousarray(lut)
+
+
+def apply_lut(lut, rgb_array, out):
+    """Map the colours in rgb_array (a uint8 row per led) through lut
+    into out, an array of the same shape, without allocating."""
+    for c in range(3):
+        np.take(lut[c], rgb_array[:, c], out=out[:, c], mode="clip")
+    return out
+
+
+def apply_lut_colour(lut, rgb):
+    """Map one (r, g, b) colour through lut."""
+    return tuple(int(lut[c, rgb[c]]) for c in range(3))
@@ -0,0 +1,279 @@
+"""Pipelined acknowledgements for the commands sent to one Teensy board.
+
+The firmware replies to every command with a 6-byte response holding
+the command's length and byte sum (see calc_expected_response() in
+display1593.encoder). Commands are handled strictly in the order they
+arrive, so the responses come back in that same order too - there is
+no need to wait for one command's response before sending the next.
+
+AckPipeline uses this to keep up to `window` commands per board "in
+flight" at once: each response that arrives is matched to the oldest
+outstanding command (FIFO), and send() only blocks when the window is
+already full. That way the time the firmware spends receiving and
+processing one command overlaps with the host encoding (and the link
+transmitting) the next, rather than every command paying for a full
+round trip.
+
+For fast animations, where a frame that occasionally goes wrong doesn't
+matter, sampled verification (verify_every=N) goes further: send()
+doesn't wait for a free slot at all, and only every Nth command - and
+every SN, which latches a frame - is kept to check its response.
+Responses to the others are only counted off as they arrive, and their
+wire buffers are released as soon as they have been written. Instead
+of a warning per invalid response, the error rate over each
+ERROR_RATE_WINDOW commands checked is logged - or, if it is over
+max_error_rate, raised as an AckErrorRateExceeded by the board's next
+submit() or sync().
+
+send() and drain() are called by the thread writing to the board, and
+handle_response() by the thread reading from it (see
+display1593.board_worker), so the outstanding commands are guarded by
+a threading.Condition.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from display1593.framing import write_command
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACK_WINDOW = 4
+DEFAULT_ACK_TIMEOUT = 1.0
+# With sampled verification: most commands in flight (send() blocks
+# beyond this, e.g. if the board stops responding), and number of
+# commands checked per error rate reported
+MAX_UNVERIFIED_IN_FLIGHT = 1024
+ERROR_RATE_WINDOW = 100
+
+
+class AckErrorRateExceeded(Exception):
+    """Raised when too many of the responses checked with sampled
+    verification were invalid."""
+
+
+class _Unverified:
+    """Stands in for a command sent without keeping it to check its
+    response (see sampled verification, above)."""
+
+    __slots__ = ("kind", "written_at")
+    expected_response = None
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.written_at = 0.0
+
+    def release(self):
+        pass
+
+
+class AckPipeline:
+    """Send commands to one board, keeping up to `window` of them
+    unacknowledged at a time.
+
+    ser: an open serial.Serial connection to the board.
+    window: maximum number of commands sent but not yet acknowledged.
+        With window=1, every command waits for the previous one's
+        response before it is sent.
+    timeout: seconds to wait for a response before giving up on the
+        oldest outstanding command (logged as a warning, as before).
+    stats, board: if given, a CommandStats to record the commands'
+        timings and errors in (see display1593.stats), under the board
+        name `board`.
+    verify_every: if given, use sampled verification (see above),
+        checking the response of every verify_every-th command and of
+        every SN. window is then ignored.
+    max_error_rate: with sampled verification, the fraction of the
+        responses checked that may be invalid before an
+        AckErrorRateExceeded is raised (None to only log the rate).
+    """
+
+    def __init__(
+        self,
+        ser,
+        window=DEFAULT_ACK_WINDOW,
+        timeout=DEFAULT_ACK_TIMEOUT,
+        stats=None,
+        board=None,
+        verify_every=None,
+        max_error_rate=None,
+    ):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        if verify_every is not None and verify_every < 1:
+            raise ValueError("verify_every must be at least 1")
+        self.ser = ser
+        self.window = window
+        self.timeout = timeout
+        self.stats = stats
+        self.board = board
+        self.verify_every = verify_every
+        self.max_error_rate = max_error_rate
+        # Commands in flight, oldest first
+        self._pending = deque()
+        self._cond = threading.Condition()
+        # Sampled verification: commands sent, responses checked and
+        # invalid in the current error rate window, and the error to
+        # raise (see take_error())
+        self._n_sent = 0
+        self._n_checked = 0
+        self._n_invalid = 0
+        self._error = None
+
+    def __len__(self):
+        """Number of commands sent but not yet acknowledged."""
+        return len(self._pending)
+
+    def send(self, cmd, before_write=None):
+        """Send cmd (a WireCommand - see display1593.encoder), first
+        waiting for a free slot in the window. cmd is released once it
+        has been acknowledged (or, if its response won't be checked,
+        once it has been written).
+
+        before_write, if given, is called once there is room for cmd,
+        just before it is written (e.g. SyncedShow.wait).
+        """
+        # Read these now: once cmd is acknowledged it may be reused
+        kind, length, encode_time = cmd.kind, cmd.length, cmd.encode_time
+        verified = self.verify_every is None or (
+            kind == "SN" or self._n_sent % self.verify_every == 0
+        )
+        self._n_sent += 1
+        with self._cond:
+            if self.verify_every is None:
+                self._wait_for(lambda: len(self._pending) < self.window)
+            else:
+                self._wait_for(
+                    lambda: len(self._pending) < MAX_UNVERIFIED_IN_FLIGHT
+                )
+            # Registered before writing, so that however quickly the
+            # response comes back there is a command to match it to
+            start = time.perf_counter()
+            entry = cmd if verified else _Unverified(kind)
+            entry.written_at = start
+            self._pending.append(entry)
+        if before_write is not None:
+            before_write()
+            # (Time spent waiting isn't write time)
+            start = time.perf_counter()
+        write_command(self.ser, cmd)
+        end = time.perf_counter()
+        with self._cond:
+            # (If cmd has already been acknowledged and reused, this is
+            # overwritten again before it is next sent.)
+            entry.written_at = end
+        if not verified:
+            cmd.release()
+        if self.stats is not None:
+            self.stats.record_write(
+                self.board, kind, length, encode_time, end - start
+            )
+
+    def drain(self):
+        """Block until every outstanding command has been acknowledged
+        (or timed out)."""
+        with self._cond:
+            self._wait_for(lambda: len(self._pending) == 0)
+
+    def abandon(self):
+        """Forget every outstanding command, e.g. after the connection
+        to the board was lost and their responses won't come."""
+        with self._cond:
+            abandoned = list(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+        if abandoned:
+            logger.warning("Abandoned %d commands", len(abandoned))
+        for cmd in abandoned:
+            cmd.release()
+
+    def handle_response(self, response):
+        """Match a response read from the board to the oldest
+        outstanding command."""
+        received_at = time.perf_counter()
+        if np.array_equal(response[:2], [0, 0]):
+            logger.debug("Debug msg: %s", bytes(response[2:]).decode())
+            if self.stats is not None:
+                self.stats.record_debug_message(self.board)
+            return
+        with self._cond:
+            if not self._pending:
+                logger.warning("Unexpected resp %s", response)
+                if self.stats is not None:
+                    self.stats.record_unexpected(self.board)
+                return
+            cmd = self._pending.popleft()
+            ack_time = received_at - cmd.written_at
+            self._cond.notify_all()
+        if cmd.expected_response is None:
+            # Not checked
+            if self.stats is not None:
+                self.stats.record_ack(self.board, cmd.kind, ack_time, None)
+            return
+        valid = np.array_equal(response, cmd.expected_response)
+        if valid:
+            logger.debug("Resp rec'd")
+        elif self.verify_every is None:
+            logger.warning(
+                "Resp invalid, expected %s, got %s",
+                cmd.expected_response,
+                response,
+            )
+        else:
+            logger.debug(
+                "Resp invalid, expected %s, got %s",
+                cmd.expected_response,
+                response,
+            )
+        if self.stats is not None:
+            self.stats.record_ack(self.board, cmd.kind, ack_time, valid)
+        cmd.release()
+        if self.verify_every is not None:
+            self._count_checked(valid)
+
+    def _count_checked(self, valid):
+        # Sampled verification: report the error rate once per
+        # ERROR_RATE_WINDOW responses checked
+        self._n_checked += 1
+        self._n_invalid += not valid
+        if self._n_checked < ERROR_RATE_WINDOW:
+            return
+        rate = self._n_invalid / self._n_checked
+        self._n_checked = self._n_invalid = 0
+        if self.max_error_rate is not None and rate > self.max_error_rate:
+            logger.error("%s: error rate %.1f%%", self.board, 100 * rate)
+            self._error = AckErrorRateExceeded(
+                f"{rate:.1%} of the responses checked from {self.board} "
+                f"were invalid (max {self.max_error_rate:.1%})"
+            )
+        elif rate > 0:
+            logger.warning("%s: error rate %.1f%%", self.board, 100 * rate)
+
+    def take_error(self):
+        """Return (and forget) the AckErrorRateExceeded to raise, if
+        any."""
+        error, self._error = self._error, None
+        return error
+
+    def _wait_for(self, predicate):
+        # Must be called holding self._cond. If no response at all
+        # arrives for `timeout` seconds, give up on the oldest command.
+        timeout_time = time.monotonic() + self.timeout
+        n_pending = len(self._pending)
+        while not predicate():
+            remaining = timeout_time - time.monotonic()
+            if remaining <= 0:
+                logger.warning("Timeout")
+                cmd = self._pending.popleft()
+                if self.stats is not None:
+                    self.stats.record_timeout(self.board, cmd.kind)
+                cmd.release()
+            else:
+                self._cond.wait(remaining)
+            if len(self._pending) < n_pending:
+                timeout_time = time.monotonic() + self.timeout
+                n_pending = len(self._pending)
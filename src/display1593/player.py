@@ -0,0 +1,233 @@
+"""Play a sequence of frames on the display at a fixed frame rate.
+
+FramePlayer replaces the pacing loops the animation scripts used to
+have (send a frame, sleep until the next time step, show it). Each
+frame's show time is computed from the frame number and the start time
+(start + k / fps) rather than by adding up time steps, so timing errors
+don't accumulate, and frames whose time has already passed - because
+encoding or transmission overran - are skipped rather than played late
+and pushing every later frame back:
+
+    player = FramePlayer(dis, cycle(frames), fps=16)
+    try:
+        player.play()
+    except KeyboardInterrupt:
+        pass
+    print(player.stats())
+
+A frame is dropped when the player gets to it after the next frame's
+show time: by then showing it would only delay the next one. A frame
+that is late by less than that is still sent, and shown straight away.
+
+The frame rate a display can sustain depends on how many bytes each
+frame takes on the links and how long the boards take to acknowledge
+them, which varies with the content. Rather than guess, a FramePlayer
+can be given a RateGovernor instead of a fixed fps:
+
+    player = FramePlayer(dis, frames, governor=RateGovernor(max_fps=16))
+
+Each frame is then shown as soon after the previous one as the
+governor's period allows, and the player waits for it to be
+acknowledged (display.sync()) before moving on, timing how long the
+boards took. The governor keeps the period just above the (smoothed)
+time frames take, up to max_fps, so the animation runs at the highest
+rate the display keeps up with - slowing down when the frames get
+bigger rather than queueing a growing backlog, and no frames are
+dropped.
+
+Because of the sync(), each frame is sent, acknowledged and shown
+before the next one is sent, and that serialized time is what the
+governor measures. Double buffering (sending the next frame while the
+current one is on display) would defeat both, so it can't be combined
+with a governor.
+"""
+
+import logging
+import math
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Number of frames whose timings are kept in FramePlayer.history
+MAX_HISTORY = 1000
+
+
+class RateGovernor:
+    """Picks the frame rate for a FramePlayer from how long the frames
+    actually take to send and be acknowledged.
+
+    max_fps: the highest frame rate to play at, or None for as fast as
+        the display goes.
+    headroom: fraction by which the period is kept longer than the
+        frames take, so that small variations don't make it fall
+        behind.
+    rise, fall: smoothing factors for the frame time: how quickly it
+        follows frames that take longer (slowing down straight away)
+        and shorter (speeding up gradually) than before.
+    """
+
+    def __init__(self, max_fps=None, headroom=0.1, rise=0.5, fall=0.05):
+        if max_fps is not None and max_fps <= 0:
+            raise ValueError("max_fps must be positive")
+        self.max_fps = max_fps
+        self.headroom = headroom
+        self.rise = rise
+        self.fall = fall
+        # Smoothed seconds per frame (None until the first is recorded)
+        self.frame_time = None
+
+    def record(self, frame_time):
+        """Record how long (seconds) a frame took to send and be
+        acknowledged, not counting any time spent waiting to show it."""
+        if self.frame_time is None:
+            self.frame_time = frame_time
+            return
+        factor = self.rise if frame_time > self.frame_time else self.fall
+        self.frame_time += factor * (frame_time - self.frame_time)
+
+    @property
+    def period(self):
+        """Seconds from one frame's show time to the next."""
+        period = 0.0
+        if self.frame_time is not None:
+            period = self.frame_time * (1 + self.headroom)
+        if self.max_fps is not None:
+            period = max(period, 1 / self.max_fps)
+        return period
+
+    @property
+    def fps(self):
+        """The frame rate the governor is currently aiming for."""
+        period = self.period
+        return 1 / period if period > 0 else math.inf
+
+
+class FramePlayer:
+    """Show frames from `source` on a Display1593 at `fps` frames per
+    second.
+
+    display: a connected Display1593.
+    source: an iterable of frames, each an (n_leds, 3) array of colours
+        (e.g. itertools.cycle(frames) to loop forever).
+    fps: frames per second.
+    governor: a RateGovernor to choose the frame rate instead of fps
+        (see above).
+    send: the method used to send each frame to the display, e.g.
+        display.set_all_leds. Defaults to display.set_frame, which only
+        sends what changed.
+    double_buffered: if True (and send isn't given), frames are sent
+        with display.stage_frame(), which streams each one to the boards
+        as soon as the previous one has been latched, so that only the
+        SN commands are left to send at each frame's show time. Not
+        with a governor (see above).
+
+    After play(), `history` holds (scheduled, actual, wait) for the last
+    MAX_HISTORY frames shown: the times (seconds since the start) they
+    were due and actually shown, and how long the player waited before
+    showing each one. stats() summarizes them.
+    """
+
+    def __init__(
+        self,
+        display,
+        source,
+        fps=None,
+        send=None,
+        double_buffered=False,
+        governor=None,
+    ):
+        if (fps is None) == (governor is None):
+            raise ValueError("give either fps or a governor")
+        if fps is not None and fps <= 0:
+            raise ValueError("fps must be positive")
+        if double_buffered and governor is not None:
+            raise ValueError("a governor can't be double buffered")
+        self.display = display
+        self.source = source
+        self.governor = governor
+        self.period = None if fps is None else 1 / fps
+        if send is None:
+            send = (
+                display.stage_frame if double_buffered else display.set_frame
+            )
+        self.send = send
+        self.history = deque(maxlen=MAX_HISTORY)
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self._start_time = None
+        self._end_time = None
+        # Sum and sum of squares of the lateness of every frame shown,
+        # and the largest, for stats()
+        self._lateness_sum = 0.0
+        self._lateness_sum_sq = 0.0
+        self._lateness_max = 0.0
+
+    def play(self, n_frames=None):
+        """Play frames until the source runs out, or n_frames frames
+        (shown or dropped) have been played."""
+        self._start_time = time.monotonic()
+        self._end_time = None
+        show_time = self._start_time
+        try:
+            for k, frame in enumerate(self.source):
+                if n_frames is not None and k >= n_frames:
+                    break
+                if self.governor is None:
+                    show_time = self._start_time + k * self.period
+                    if time.monotonic() > show_time + self.period:
+                        self.frames_dropped += 1
+                        logger.debug("Dropped frame %d.", k)
+                        continue
+                send_time = time.monotonic()
+                self.send(frame)
+                wait_time = max(0.0, show_time - time.monotonic())
+                self.display.show_at(show_time)
+                self._record(show_time, time.monotonic(), wait_time)
+                if self.governor is not None:
+                    self.display.sync()
+                    now = time.monotonic()
+                    self.governor.record(now - send_time - wait_time)
+                    # Never in the past, so no backlog builds up
+                    show_time = max(show_time + self.governor.period, now)
+        finally:
+            self._end_time = time.monotonic()
+
+    def _record(self, show_time, shown_at, wait_time):
+        lateness = shown_at - show_time
+        self.frames_shown += 1
+        self._lateness_sum += lateness
+        self._lateness_sum_sq += lateness**2
+        self._lateness_max = max(self._lateness_max, lateness)
+        self.history.append(
+            (
+                show_time - self._start_time,
+                shown_at - self._start_time,
+                wait_time,
+            )
+        )
+
+    def stats(self):
+        """Frame counts, the frame rate achieved, and how late (in
+        seconds) the frames were shown: mean and max lateness, and its
+        standard deviation ("jitter"). With a governor, also the
+        frame rate it is aiming for ("target_fps")."""
+        if self._start_time is None:
+            elapsed = 0.0
+        else:
+            elapsed = self._end_time - self._start_time
+        n = self.frames_shown
+        mean = self._lateness_sum / n if n else 0.0
+        variance = self._lateness_sum_sq / n - mean**2 if n else 0.0
+        stats = {
+            "frames_shown": n,
+            "frames_dropped": self.frames_dropped,
+            "elapsed": elapsed,
+            "fps": n / elapsed if elapsed > 0 else 0.0,
+            "lateness_mean": mean,
+            "lateness_max": self._lateness_max,
+            "jitter": math.sqrt(max(variance, 0.0)),
+        }
+        if self.governor is not None:
+            stats["target_fps"] = self.governor.fps
+        return stats
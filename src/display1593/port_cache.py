@@ -0,0 +1,83 @@
+"""Remembers which board is on which USB serial port between runs.
+
+The boards don't always come up on the same ports (TEENSY1 is usually,
+but not always, on /dev/ttyACM1), so Display1593.connect() normally
+sends a hello message on every port to find out which board answers.
+Each Teensy has a fixed USB serial number, though, so once a board's
+name has been seen on a port, the serial number reported for that port
+(by serial.tools.list_ports) identifies the board on any later run,
+whichever port it turns up on. The cache file maps serial numbers to
+board names. When it identifies the board on every port, connect()
+opens the ports knowing which board to expect on each, and only sends
+one hello on each (all at once) to check: if any board doesn't answer
+with its cached name (the cache is out of date, or a serial number
+was reused), it falls back on finding the boards as usual, and
+updates the cache.
+
+Ports with no USB serial number (e.g. the emulator's pseudo-terminals)
+are never cached.
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# In the user's cache directory rather than /tmp, where any other user
+# could plant a cache
+DEFAULT_PORT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "display1593",
+    "ports.json",
+)
+
+
+def usb_serial_numbers(ports):
+    """Return a dict of each port's USB serial number, or None if it
+    doesn't have one."""
+    from serial.tools import list_ports
+
+    by_device = {
+        os.path.realpath(info.device): info.serial_number
+        for info in list_ports.comports()
+    }
+    return {port: by_device.get(os.path.realpath(port)) for port in ports}
+
+
+def load_port_cache(path):
+    """Return the cached {serial number: board name} dict, or an empty
+    one if there is no (readable) cache at path."""
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        logger.warning("Ignoring port cache %s: %s", path, err)
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return cache
+
+
+def save_port_cache(path, serial_numbers, board_names):
+    """Cache the board names seen on ports, given dicts of each port's
+    USB serial number and board name."""
+    cache = load_port_cache(path)
+    new_entries = {
+        serial_numbers[port]: name
+        for port, name in board_names.items()
+        if serial_numbers.get(port) is not None
+    }
+    if all(cache.get(sn) == name for sn, name in new_entries.items()):
+        return
+    cache.update(new_entries)
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as err:
+        logger.warning("Could not save port cache %s: %s", path, err)
@@ -0,0 +1,170 @@
+"""A framebuffer in shared memory, for rendering in other processes.
+
+Rendering a frame can take longer than sending one (converting images,
+running a simulation), and doing both in one process means each waits
+for the other. With a SharedFramebuffer, the process driving the
+display owns a (n_leds, 3) uint8 frame in a memory-mapped file under
+/dev/shm, and renderer processes write their frames straight into it -
+no pickling or copying through pipes. The driver sends whatever the
+newest frame is at its own fixed rate, e.g. with a FramePlayer:
+
+    # Driver process
+    with Display1593() as dis, SharedFramebuffer(create=True) as shared:
+        FramePlayer(dis, shared.frames(), fps=30).play()
+
+    # Renderer process
+    with SharedFramebuffer() as shared:
+        while True:
+            with shared.writing() as frame:
+                render(frame)  # writes into the shared frame in place
+
+The file holds two frames. Readers copy the current ("front") one,
+while the writer renders into the other ("back") one, and then swaps
+them over by flipping the front index in the file's header. Only the
+flip and the readers' copies (4.8 KB) are done under a lock, an
+fcntl.flock() on the file - exclusive for the flip, shared for a copy -
+so a reader never waits for a frame to be rendered, and never sees one
+half-written. Unlike plain loads and stores to the mapped memory, the
+lock also orders the memory accesses between processes on every
+platform, ARM (the Raspberry Pi) included. There can be only one writer
+at a time.
+
+The file is only readable and writable by its owner (mode=0o600) by
+default; renderers running as other users need e.g. mode=0o660 and a
+shared group.
+"""
+
+import contextlib
+import fcntl
+import logging
+import mmap
+import os
+
+import numpy as np
+
+from display1593.data.ledArray_data_1593 import num_leds
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "/dev/shm/display1593.frame"
+# The number of frames written, and the index (0 or 1) of the front
+# frame, as uint32s
+HEADER_BYTES = 8
+
+
+class SharedFramebuffer:
+    """A frame of led colours in shared memory, double buffered, with a
+    count of the frames written.
+
+    path: the file to map (in /dev/shm, so kept in memory).
+    n_leds: number of leds in the frame.
+    create: create the file (and remove it on close()), as the driver
+        process does. Otherwise it must already exist.
+    mode: permissions of the file created.
+
+    `frame` is the front (n_leds, 3) uint8 frame itself - but use
+    read_into() to get a copy that can't change while it's used.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_PATH,
+        n_leds=sum(num_leds),
+        create=False,
+        mode=0o600,
+    ):
+        self.path = path
+        self.n_leds = n_leds
+        self.created = create
+        size = HEADER_BYTES + 2 * 3 * n_leds
+        if create:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, mode)
+        else:
+            fd = os.open(path, os.O_RDWR)
+        try:
+            if create:
+                # A file left behind (e.g. by a crash) keeps its mode
+                os.fchmod(fd, mode)
+                os.ftruncate(fd, size)
+            elif os.fstat(fd).st_size != size:
+                raise ValueError(
+                    f"{path} does not hold a frame of {n_leds} leds"
+                )
+            self._mmap = mmap.mmap(fd, size)
+        except BaseException:
+            os.close(fd)
+            raise
+        # Kept open for the lock
+        self._fd = fd
+        self._header = np.frombuffer(self._mmap, np.uint32, 2, 0)
+        self._frames = np.frombuffer(
+            self._mmap, np.uint8, 2 * 3 * n_leds, HEADER_BYTES
+        ).reshape(2, n_leds, 3)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        fcntl.flock(self._fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def frame(self):
+        return self._frames[self._header[1]]
+
+    @property
+    def sequence(self):
+        """The number of frames written."""
+        with self._locked(fcntl.LOCK_SH):
+            return int(self._header[0])
+
+    @contextlib.contextmanager
+    def writing(self):
+        """Context manager for writing a frame in place: yields the back
+        frame, holding a copy of the front one, and makes it the front
+        frame when the block exits (unless it raises)."""
+        with self._locked(fcntl.LOCK_SH):
+            front = int(self._header[1])
+            back = self._frames[1 - front]
+            back[:] = self._frames[front]
+        yield back
+        with self._locked(fcntl.LOCK_EX):
+            self._header[1] = 1 - front
+            self._header[0] += 1
+
+    def write(self, rgb_array):
+        """Copy rgb_array, an (n_leds, 3) array, into the frame."""
+        with self.writing() as frame:
+            frame[:] = rgb_array
+
+    def read_into(self, out):
+        """Copy the newest complete frame into out (an (n_leds, 3) uint8
+        array), returning its number (see `sequence`)."""
+        with self._locked(fcntl.LOCK_SH):
+            out[:] = self._frames[self._header[1]]
+            return int(self._header[0])
+
+    def frames(self):
+        """Yield the newest frame, indefinitely (e.g. as a FramePlayer
+        source). Each is copied into the same array, so use it before
+        asking for the next."""
+        out = np.empty((self.n_leds, 3), dtype=np.uint8)
+        while True:
+            self.read_into(out)
+            yield out
+
+    def close(self):
+        # The arrays must go before the mmap can be closed
+        del self._frames, self._header
+        self._mmap.close()
+        os.close(self._fd)
+        if self.created:
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
@@ -0,0 +1,202 @@
+"""Timing and error counters for the commands sent to the boards.
+
+Every command the driver sends goes through three stages, each timed
+separately so that a slow frame can be traced to the host, the link or
+the firmware:
+
+- encode: building the command in a wire buffer (display1593.encoder)
+- write: writing it to the serial port (mostly time the OS spends
+  pushing it onto the link, once the port's buffer is full)
+- ack: from the end of the write until its response arrives (link
+  transmission still to go, plus the firmware's processing time)
+
+CommandStats accumulates these per board and per command type ("LA",
+"LN", "SN", ...), along with a histogram of command sizes and counts of
+timeouts and invalid responses (which are also logged as warnings, see
+display1593.pipeline), and of responses not checked at all (with
+sampled verification). Display1593.stats() returns a snapshot.
+
+It also times the skew of each show_now(): how far apart the SN
+commands to the different boards started being written, i.e. how long
+one half of the display may show a different frame from the other
+(as far as the host can tell; the links add their own latency).
+Display1593.show_skew() returns a snapshot.
+"""
+
+import threading
+from collections import defaultdict
+
+
+class _Timing:
+    """Count, total and maximum of a series of durations (seconds)."""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": mean,
+            "max": self.max,
+        }
+
+
+class _CommandTypeStats:
+    __slots__ = (
+        "count",
+        "bytes",
+        "bytes_histogram",
+        "encode_time",
+        "write_time",
+        "ack_time",
+        "timeouts",
+        "invalid",
+        "unverified",
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.bytes_histogram = defaultdict(int)
+        self.encode_time = _Timing()
+        self.write_time = _Timing()
+        self.ack_time = _Timing()
+        self.timeouts = 0
+        self.invalid = 0
+        self.unverified = 0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "bytes_histogram": dict(sorted(self.bytes_histogram.items())),
+            "encode_time": self.encode_time.snapshot(),
+            "write_time": self.write_time.snapshot(),
+            "ack_time": self.ack_time.snapshot(),
+            "timeouts": self.timeouts,
+            "invalid": self.invalid,
+            "unverified": self.unverified,
+        }
+
+
+def size_bucket(n_bytes):
+    """Histogram bucket for a command of n_bytes: the smallest power of
+    two that is at least n_bytes."""
+    return 1 << max(n_bytes - 1, 0).bit_length()
+
+
+class CommandStats:
+    """Thread-safe per-board, per-command-type counters.
+
+    Updated from the boards' worker threads (see
+    display1593.board_worker) as each command is written and
+    acknowledged.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = defaultdict(
+                lambda: defaultdict(_CommandTypeStats)
+            )
+            self._debug_messages = defaultdict(int)
+            self._unexpected = defaultdict(int)
+            self._show_skew = _Timing()
+            self._last_show_skew = None
+
+    def record_write(self, board, kind, n_bytes, encode_time, write_time):
+        with self._lock:
+            stats = self._stats[board][kind]
+            stats.count += 1
+            stats.bytes += n_bytes
+            stats.bytes_histogram[size_bucket(n_bytes)] += 1
+            stats.encode_time.add(encode_time)
+            stats.write_time.add(write_time)
+
+    def record_ack(self, board, kind, ack_time, valid=True):
+        """Record a response: valid is whether it was the one expected,
+        or None if it wasn't checked."""
+        with self._lock:
+            stats = self._stats[board][kind]
+            stats.ack_time.add(ack_time)
+            if valid is None:
+                stats.unverified += 1
+            elif not valid:
+                stats.invalid += 1
+
+    def record_timeout(self, board, kind):
+        with self._lock:
+            self._stats[board][kind].timeouts += 1
+
+    def record_show_skew(self, seconds):
+        with self._lock:
+            self._show_skew.add(seconds)
+            self._last_show_skew = seconds
+
+    def show_skew(self):
+        """Count, total, mean and max of the show skews recorded (in
+        seconds), and the "last" one (None if there hasn't been one)."""
+        with self._lock:
+            snapshot = self._show_skew.snapshot()
+            snapshot["last"] = self._last_show_skew
+            return snapshot
+
+    def record_debug_message(self, board):
+        with self._lock:
+            self._debug_messages[board] += 1
+
+    def record_unexpected(self, board):
+        with self._lock:
+            self._unexpected[board] += 1
+
+    def snapshot(self):
+        """A copy of the counters, as nested dicts:
+
+            {board_name: {
+                "commands": {kind: {"count", "bytes", "bytes_histogram",
+                                    "encode_time", "write_time",
+                                    "ack_time", "timeouts", "invalid",
+                                    "unverified"}},
+                "debug_messages": n,
+                "unexpected_responses": n,
+            }}
+
+        where each *_time is a dict of "count", and "total", "mean" and
+        "max" seconds,
+        and bytes_histogram maps a power-of-two size bucket to the
+        number of commands of at most that many bytes.
+        """
+        with self._lock:
+            boards = (
+                set(self._stats)
+                | set(self._debug_messages)
+                | set(self._unexpected)
+            )
+            return {
+                board: {
+                    "commands": {
+                        kind: stats.snapshot()
+                        for kind, stats in sorted(
+                            self._stats[board].items()
+                        )
+                    },
+                    "debug_messages": self._debug_messages[board],
+                    "unexpected_responses": self._unexpected[board],
+                }
+                for board in sorted(boards)
+            }
@@ -0,0 +1,95 @@
+"""Waiting for a deadline more precisely than time.sleep() does.
+
+time.sleep() only promises not to wake up early: on a loaded Raspberry
+Pi it can oversleep by a millisecond or more, and by a different amount
+every time, which shows up as uneven frame times in FramePlayer's
+history. DeadlineTimer.sleep_until() instead sleeps until shortly
+before the deadline, then spins (with time.sleep(0), which lets the
+boards' writer threads run) for the rest of the way.
+
+The spin margin adapts to how much the coarse sleeps have been
+oversleeping recently, so that the timer spins for no longer than it
+needs to: with an idle system it soon drops to MIN_SPIN_MARGIN, and on
+a busy one it grows (up to MAX_SPIN_MARGIN) to cover the wake-up
+latency. How late each wake-up actually was is kept in stats().
+
+Display1593.show_at() (and so FramePlayer) waits with a DeadlineTimer.
+"""
+
+import logging
+import math
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Limits of the time (seconds) spent spinning before each deadline
+MIN_SPIN_MARGIN = 0.0002
+MAX_SPIN_MARGIN = 0.005
+# Margin kept over the largest recent oversleep
+SPIN_MARGIN_SAFETY = 0.0002
+# Number of recent coarse sleeps the margin is based on
+OVERSLEEP_HISTORY = 50
+
+
+class DeadlineTimer:
+    """Sleeps until time.monotonic() deadlines, with a short spin at the
+    end.
+
+    spin_margin: seconds before the deadline to stop sleeping and start
+        spinning, to begin with.
+    adaptive: adjust spin_margin to the oversleeps seen (see above).
+    """
+
+    def __init__(self, spin_margin=0.001, adaptive=True):
+        self.spin_margin = spin_margin
+        self.adaptive = adaptive
+        self._oversleeps = deque(maxlen=OVERSLEEP_HISTORY)
+        self.reset_stats()
+
+    def sleep_until(self, deadline):
+        """Return at deadline (a time.monotonic() value), or straight
+        away if it has passed, returning how late (seconds) that was."""
+        now = time.monotonic()
+        coarse = deadline - self.spin_margin - now
+        if coarse > 0:
+            time.sleep(coarse)
+            if self.adaptive:
+                self._adapt(time.monotonic() - (now + coarse))
+        while time.monotonic() < deadline:
+            time.sleep(0)
+        error = time.monotonic() - deadline
+        self._record(error)
+        return error
+
+    def _adapt(self, oversleep):
+        self._oversleeps.append(oversleep)
+        margin = max(self._oversleeps) + SPIN_MARGIN_SAFETY
+        self.spin_margin = min(max(margin, MIN_SPIN_MARGIN), MAX_SPIN_MARGIN)
+
+    def _record(self, error):
+        self._count += 1
+        self._error_sum += error
+        self._error_sum_sq += error**2
+        self._error_max = max(self._error_max, error)
+
+    def reset_stats(self):
+        self._count = 0
+        self._error_sum = 0.0
+        self._error_sum_sq = 0.0
+        self._error_max = 0.0
+
+    def stats(self):
+        """Number of waits, and how late (in seconds) they woke up: mean
+        and max lateness, its standard deviation ("jitter"), and the
+        current spin margin."""
+        n = self._count
+        mean = self._error_sum / n if n else 0.0
+        variance = self._error_sum_sq / n - mean**2 if n else 0.0
+        return {
+            "count": n,
+            "error_mean": mean,
+            "error_max": self._error_max,
+            "jitter": math.sqrt(max(variance, 0.0)),
+            "spin_margin": self.spin_margin,
+        }
@@ -1,9 +1,10 @@
-import time
 import os
 
 import numpy as np
 from itertools import cycle
 from display1593 import Display1593
+from display1593.lut import make_lut
+from display1593.player import FramePlayer, RateGovernor
 from PIL import Image
 
 
@@ -11,56 +12,38 @@ dimness = 6
 
 FILENAMES = ["fire1.png", "fire2.png", "fire3.png"]
 IMAGE_DIR = "images"
-TIME_STEP = 0.0625  # seconds
+TIME_STEP = 0.0625  # seconds, at the fastest
 
 
 def main(dis, filenames):
 
     dis.clear_all()
+    # Square and dim the images as they are sent
+    dis.set_output_lut(make_lut(gamma=2, brightness=1 / dimness))
     n_images = len(filenames)
 
     img_data = []
     for filename in filenames:
         img = Image.open(os.path.join(IMAGE_DIR, filename))
         data = dis.prepare_image(np.array(img)[:, :, :3])
-        z = dis.convert_image(data) ** 2 / (256 * dimness)
-        img_data.append(z.astype("uint8"))
+        img_data.append(dis.convert_image(data).astype("uint8"))
 
     print("Starting...")
-    img_cycle = cycle(img_data)
-
-    # Prepare to log timing
-    start_time = time.monotonic()
-    scheduled_times = []
-    actual_times = []
-    wait_times = []
-
-    next_time = time.monotonic()
+    player = FramePlayer(
+        dis,
+        cycle(img_data),
+        send=dis.set_all_leds,
+        governor=RateGovernor(max_fps=1 / TIME_STEP),
+    )
     try:
-        while True:
-            z = next(img_cycle)
-            dis.set_all_leds(z)
-
-            next_time += TIME_STEP
-            scheduled_times.append(next_time)
-
-            # Synchronize display to clock
-            wait_time = max(0, next_time - time.monotonic())
-            wait_times.append(wait_time)
-            time.sleep(wait_time)
-            dis.show_now()
-
-            actual_times.append(time.monotonic())
-
+        player.play()
     except KeyboardInterrupt:
         print("Stopped.")
 
-    # Convert to elapsed time since start
-    scheduled_times = np.array(scheduled_times) - start_time
-    actual_times = np.array(actual_times) - start_time
-
-    for sch, act, wait in zip(scheduled_times, actual_times, wait_times):
+    for sch, act, wait in player.history:
         print(f"{sch:6.3f} {act:6.3f} {wait * 1000:6.2f} ms")
+    print(player.stats())
+    print(dis.timer.stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,17 @@
+import pytest
+
+from display1593.display1593 import Display1593
+from display1593.emulator import start_emulators
+
+
+@pytest.fixture
+def emulators():
+    with start_emulators() as emulators:
+        yield emulators
+
+
+@pytest.fixture
+def display(emulators, tmp_path):
+    ports = [emulator.port for emulator in emulators]
+    with Display1593(ports=ports, lock_path=str(tmp_path / "lock")) as dis:
+        yield dis
@@ -0,0 +1,21 @@
+import numpy as np
+
+
+def board_leds(emulators, attr="leds"):
+    # emulators are in (swapped) port order - put them back in board order
+    by_name = {e.name: getattr(e, attr) for e in emulators}
+    return np.concatenate([by_name["TEENSY1"], by_name["TEENSY2"]])
+
+
+class RecordSentMixin:
+    """Replaces Display1593._send so that tests can check which
+    commands would be sent, without connecting to the boards."""
+
+    def _record(self, board, cmd):
+        self.sent.append((board, bytes(cmd.data[:2]), cmd.length))
+        cmd.release()
+
+    def _record_data(self, board, cmd):
+        # The whole command, for tests of the colours sent
+        self.sent.append((board, bytes(cmd.data)))
+        cmd.release()
@@ -0,0 +1,166 @@
+import asyncio
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from display1593.async_display import AsyncDisplay1593
+from display1593.emulator import start_emulators
+from helpers import board_leds
+
+
+def _run(test, tmp_path, display_kwargs=None, **kwargs):
+    # Runs test(dis, emulators) with an AsyncDisplay1593 (given
+    # display_kwargs) connected to emulated boards
+    with start_emulators(**kwargs) as emulators:
+        ports = [emulator.port for emulator in emulators]
+
+        async def main():
+            async with AsyncDisplay1593(
+                ports=ports,
+                lock_path=str(tmp_path / "lock"),
+                **(display_kwargs or {}),
+            ) as dis:
+                await test(dis, emulators)
+
+        asyncio.run(main())
+
+
+def test_commands_are_acknowledged(tmp_path, caplog):
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(1593, 3), dtype=np.uint8)
+
+    async def test(dis, emulators):
+        ack = await dis.set_all_leds(frame)
+        assert await ack is True
+        await dis.set_led(1500, (1, 2, 3))
+        await dis.set_leds([5, 900], np.array([[4, 5, 6], [7, 8, 9]]))
+        await dis.set_leds_one_colour([10, 797, 798], (9, 9, 9))
+        frame[[1500, 5, 900, 10, 797, 798]] = [
+            (1, 2, 3),
+            (4, 5, 6),
+            (7, 8, 9),
+            (9, 9, 9),
+            (9, 9, 9),
+            (9, 9, 9),
+        ]
+        assert await (await dis.show_now()) is True
+        np.testing.assert_array_equal(board_leds(emulators, "shown"), frame)
+
+    with caplog.at_level("WARNING"):
+        _run(test, tmp_path)
+    assert caplog.records == []
+
+
+def test_frames_can_be_computed_while_sending(tmp_path):
+    # With the link emulated at a realistic speed, each set_frame()
+    # returns before its command has been transmitted
+    frames = [np.full((1593, 3), i, dtype=np.uint8) for i in range(5)]
+
+    async def test(dis, emulators):
+        acks = []
+        for frame in frames:
+            acks.append(await dis.set_frame(frame))
+            acks.append(await dis.show_now())
+        assert not acks[0].done()
+        assert all(await asyncio.gather(*acks))
+        np.testing.assert_array_equal(
+            board_leds(emulators, "shown"), frames[-1]
+        )
+        assert dis.stats()["TEENSY1"]["commands"]["SN"]["count"] == 5
+
+    _run(test, tmp_path, baud_rate=576000)
+
+
+def test_stage_frame_is_sent_after_the_show(tmp_path):
+    first = np.full((1593, 3), 1, dtype=np.uint8)
+    second = np.full((1593, 3), 2, dtype=np.uint8)
+
+    async def test(dis, emulators):
+        await dis.set_all_leds(first)
+        await dis.show_now()
+        ack = await dis.stage_frame(second)
+        assert await ack is True
+        np.testing.assert_array_equal(board_leds(emulators, "shown"), first)
+        np.testing.assert_array_equal(board_leds(emulators), second)
+        await dis.stage_frame(second)
+        await dis.sync()
+
+    _run(test, tmp_path)
+
+
+def test_calibrated_one_colour_updates(tmp_path):
+    async def test(dis, emulators):
+        assert await (await dis.set_all_leds_one_colour((100, 50, 2)))
+        assert await (await dis.set_leds_one_colour([0, 1000], (10, 4, 1)))
+        await dis.sync()
+        expected = np.full((1593, 3), (50, 25, 1), dtype=np.uint8)
+        expected[[0, 1000]] = (5, 2, 1)
+        np.testing.assert_array_equal(board_leds(emulators), expected)
+
+    _run(test, tmp_path, display_kwargs={"calibration": 0.5})
+
+
+def test_buffered_show_now_flushes(tmp_path):
+    async def test(dis, emulators):
+        await dis.set_all_leds_one_colour((1, 2, 3))
+        await dis.set_led(700, (4, 5, 6))
+        assert not board_leds(emulators).any()
+        assert await (await dis.show_now()) is True
+        expected = np.full((1593, 3), (1, 2, 3), dtype=np.uint8)
+        expected[700] = (4, 5, 6)
+        np.testing.assert_array_equal(
+            board_leds(emulators, "shown"), expected
+        )
+
+    _run(test, tmp_path, display_kwargs={"buffered": True})
+
+
+def test_show_image(tmp_path):
+    filename = tmp_path / "image.png"
+    Image.new("RGB", (300, 200), (255, 128, 32)).save(filename)
+
+    async def test(dis, emulators):
+        assert await (await dis.show_image(filename, dimness=8)) is True
+        await dis.sync()
+        # v**2 // (256 * 8) for each channel
+        expected = np.full((1593, 3), (31, 8, 0), dtype=np.uint8)
+        np.testing.assert_array_equal(board_leds(emulators), expected)
+
+    _run(test, tmp_path)
+
+
+def test_led_groups(tmp_path):
+    async def test(dis, emulators):
+        group = dis.compile_group([3, 1000, 1500])
+        assert await (await group.set_leds_one_colour((7, 8, 9))) is True
+        ack = await group.set_leds(np.full((3, 3), 40, dtype=np.uint8))
+        assert await ack is True
+        await dis.set_calibration(0.5)
+        assert await (await group.set_leds_one_colour((10, 4, 2))) is True
+        expected = np.zeros((1593, 3), dtype=np.uint8)
+        expected[[3, 1000, 1500]] = (5, 2, 1)
+        np.testing.assert_array_equal(board_leds(emulators), expected)
+
+    _run(test, tmp_path)
+
+
+def test_missing_response_times_out(tmp_path, caplog, monkeypatch):
+    async def test(dis, emulators):
+        dis._boards[0].timeout = 0.1
+        silent = next(e for e in emulators if e.name == "TEENSY1")
+        monkeypatch.setattr(silent, "_write_message", lambda payload: None)
+        ack = await dis.show_now()
+        assert await ack is False
+        commands = dis.stats()["TEENSY1"]["commands"]
+        assert commands["SN"]["timeouts"] == 1
+
+    with caplog.at_level("WARNING"):
+        _run(test, tmp_path)
+    assert [r.message for r in caplog.records] == ["Timeout"]
+
+
+def test_requires_async_with():
+    with pytest.raises(TypeError):
+        with AsyncDisplay1593(ports=[]):
+            pass
@@ -0,0 +1,39 @@
+import threading
+import time
+
+from display1593.board_worker import SyncedShow
+from display1593.stats import CommandStats
+
+
+def test_synced_show_releases_writers_together():
+    stats = CommandStats()
+    synced = SyncedShow(2, timeout=5, stats=stats)
+    released = []
+
+    def writer(delay):
+        time.sleep(delay)
+        synced.wait()
+        released.append(time.perf_counter())
+
+    threads = [
+        threading.Thread(target=writer, args=(delay,)) for delay in (0, 0.1)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert abs(released[0] - released[1]) < 0.05
+    skew = stats.show_skew()
+    assert skew["count"] == 1
+    assert skew["last"] < 0.05
+
+
+def test_synced_show_times_out(caplog):
+    stats = CommandStats()
+    synced = SyncedShow(2, timeout=0.05, stats=stats)
+    synced.wait()
+    assert "not synchronized" in caplog.text
+    assert stats.show_skew()["count"] == 0
+    # The late writer goes straight through, and the skew is recorded
+    synced.wait()
+    assert stats.show_skew()["count"] == 1
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from display1593.calibration import GAIN_ONE, apply_gains, fixed_point_gains
+
+
+def test_fixed_point_gains_broadcast():
+    gains = fixed_point_gains((1.0, 0.5, 2.0), 4)
+    assert gains.dtype == np.uint16
+    assert gains.shape == (4, 3)
+    np.testing.assert_array_equal(gains[3], (GAIN_ONE, 128, 512))
+    with pytest.raises(ValueError):
+        fixed_point_gains(-1.0, 4)
+    with pytest.raises(ValueError):
+        fixed_point_gains(np.ones((5, 3)), 4)
+
+
+def test_fixed_point_gains_are_taken_as_is():
+    gains = np.full((2, 3), 300, dtype=np.uint16)
+    np.testing.assert_array_equal(fixed_point_gains(gains, 2), gains)
+
+
+def test_apply_gains_rounds_and_clips():
+    rgb = np.array([[100, 100, 255], [3, 0, 200]], dtype=np.uint8)
+    gains = fixed_point_gains([[1.0, 0.5, 2.0], [0.5, 1.0, 1.1]], 2)
+    out = np.empty_like(rgb)
+    product = np.empty(rgb.shape, dtype=np.uint32)
+    apply_gains(rgb, gains, out, product)
+    np.testing.assert_array_equal(out, [[100, 50, 255], [2, 0, 220]])
@@ -0,0 +1,106 @@
+import os
+import socket
+import stat
+import threading
+
+import numpy as np
+import pytest
+
+from display1593.daemon import DisplayClient, DisplayDaemon
+from display1593.display1593 import Display1593
+from display1593.lock import DisplayLockTimeout
+from helpers import board_leds
+
+
+@pytest.fixture
+def daemon(emulators, tmp_path):
+    ports = [emulator.port for emulator in emulators]
+    path = str(tmp_path / "display.sock")
+    with Display1593(ports=ports, lock_path=str(tmp_path / "lock")) as dis:
+        with DisplayDaemon(dis, path) as daemon:
+            thread = threading.Thread(target=daemon.serve_forever)
+            thread.start()
+            try:
+                yield daemon
+            finally:
+                daemon.shutdown()
+                thread.join()
+
+
+@pytest.fixture
+def socket_path(daemon):
+    return daemon.socket_path
+
+
+def test_client_commands_reach_the_boards(emulators, socket_path, caplog):
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(1593, 3), dtype=np.uint8)
+    with caplog.at_level("WARNING"):
+        with DisplayClient(socket_path) as dis:
+            dis.set_all_leds(frame)
+            dis.set_led(1500, (1, 2, 3))
+            frame[1500] = (1, 2, 3)
+            dis.show_now()
+            dis.sync()
+            np.testing.assert_array_equal(
+                board_leds(emulators, "shown"), frame
+            )
+            stats = dis.stats()
+            assert stats["TEENSY2"]["commands"]["L1"]["count"] == 1
+    assert caplog.records == []
+
+
+def test_buffered_client(emulators, socket_path):
+    with DisplayClient(socket_path, buffered=True) as dis:
+        dis.set_leds_one_colour([0, 1000], (5, 5, 5))
+        dis.show_now()
+        dis.sync()
+    shown = board_leds(emulators, "shown")
+    assert np.all(shown[[0, 1000]] == 5)
+    assert np.count_nonzero(shown) == 6
+
+
+def test_show_is_synced_by_the_daemon(daemon):
+    daemon.display.reset_stats()
+    with DisplayClient(daemon.socket_path) as dis:
+        for _ in range(3):
+            dis.show_now()
+        dis.sync()
+    assert daemon.display.show_skew()["count"] == 3
+
+
+def test_socket_is_private(socket_path):
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+
+def test_stale_socket_is_replaced_but_not_other_files(tmp_path):
+    display = Display1593(ports=())
+    path = tmp_path / "display.sock"
+    with socket.socket(socket.AF_UNIX) as stale:
+        stale.bind(str(path))
+    DisplayDaemon(display, str(path)).server_close()
+    assert not path.exists()
+    path.write_text("not a socket")
+    with pytest.raises(FileExistsError):
+        DisplayDaemon(display, str(path))
+    assert path.read_text() == "not a socket"
+
+
+def test_daemon_display_cant_reconnect(tmp_path):
+    display = Display1593(ports=(), reconnect_timeout=1)
+    with pytest.raises(ValueError):
+        DisplayDaemon(display, str(tmp_path / "display.sock"))
+
+
+def test_second_client_waits(socket_path):
+    with DisplayClient(socket_path):
+        with pytest.raises(DisplayLockTimeout):
+            DisplayClient(socket_path).connect(lock_timeout=0.2)
+    # Served once the first client has gone
+    with DisplayClient(socket_path) as dis:
+        dis.sync()
+
+
+def test_board_mismatch(socket_path):
+    with pytest.raises(ValueError):
+        DisplayClient(socket_path, number_of_leds={"TEENSY1": 1}).connect()
@@ -1,9 +1,14 @@
+import os
+import tempfile
 import unittest
 
 import numpy as np
+from PIL import Image
 
 from display1593.data.ledArray_data_1593 import num_cells
 from display1593.display1593 import Display1593
+from display1593.lut import make_lut
+from helpers import RecordSentMixin
 
 
 class NearestNeighboursAttributeTests(unittest.TestCase):
@@ -26,5 +31,247 @@ class NearestNeighboursAttributeTests(unittest.TestCase):
         self.assertEqual(self.display.nearest_neighbours.dtype, np.uint16)
 
 
+class SetFrameTests(RecordSentMixin, unittest.TestCase):
+    def setUp(self):
+        self.display = Display1593()
+        self.sent = []
+        self.display._send = self._record
+        self.frame = np.zeros((num_cells, 3), dtype=np.uint8)
+        self.frame[::7] = (10, 20, 30)
+
+    def test_first_frame_sends_whole_boards(self):
+        self.frame[:, 0] = np.arange(num_cells) % 256
+        self.display.set_frame(self.frame)
+        self.assertEqual(
+            self.sent, [(0, b"LA", 2 + 3 * 798), (1, b"LA", 2 + 3 * 795)]
+        )
+
+    def test_first_frame_with_few_colours_sends_one_cn_per_colour(self):
+        self.display.set_frame(self.frame)
+        # Off then (10, 20, 30), on each board
+        self.assertEqual(
+            self.sent,
+            [
+                (0, b"CN", 7 + 2 * 684),
+                (0, b"CN", 7 + 2 * 114),
+                (1, b"CN", 7 + 2 * 681),
+                (1, b"CN", 7 + 2 * 114),
+            ],
+        )
+
+    def test_unchanged_frame_sends_nothing(self):
+        self.display.set_frame(self.frame)
+        self.sent.clear()
+        self.display.set_frame(self.frame.copy())
+        self.assertEqual(self.sent, [])
+
+    def test_few_changes_sends_changed_leds_only(self):
+        self.display.set_frame(self.frame)
+        self.sent.clear()
+        self.frame[[900, 901, 1500]] = (1, 2, 3)
+        self.frame[1501] = (4, 5, 6)
+        self.frame[1502] = (7, 8, 9)
+        self.display.set_frame(self.frame)
+        self.assertEqual(self.sent, [(1, b"LN", 4 + 5 * 5)])
+
+    def test_few_changed_colours_sends_one_cn_per_colour(self):
+        self.display.set_frame(self.frame)
+        self.sent.clear()
+        self.frame[[900, 901, 1500]] = (1, 2, 3)
+        self.frame[[903, 910]] = (0, 0, 0)
+        self.display.set_frame(self.frame)
+        self.assertEqual(
+            self.sent, [(1, b"CN", 7 + 2 * 2), (1, b"CN", 7 + 2 * 3)]
+        )
+
+    def test_black_board_sends_clear(self):
+        self.display.set_frame(self.frame)
+        self.sent.clear()
+        self.frame[798:] = 0
+        self.display.set_frame(self.frame)
+        self.assertEqual(self.sent, [(1, b"LC", 2)])
+
+    def test_uniform_board_sends_one_colour(self):
+        self.display.set_frame(self.frame)
+        self.sent.clear()
+        self.frame[:798] = (5, 5, 5)
+        self.display.set_frame(self.frame)
+        self.assertEqual(self.sent, [(0, b"CA", 5)])
+
+    def test_tracks_leds_set_by_other_commands(self):
+        self.display.set_frame(self.frame)
+        self.display.set_leds([3], np.array([[1, 2, 3]], dtype=np.uint8))
+        self.sent.clear()
+        self.display.set_frame(self.frame)
+        self.assertEqual(self.sent, [(0, b"LN", 4 + 5)])
+
+
+class ThreeBoardTests(RecordSentMixin, unittest.TestCase):
+    def setUp(self):
+        self.display = Display1593(
+            ports=["/dev/a", "/dev/b", "/dev/c"],
+            number_of_leds={"A": 600, "B": 600, "C": 393},
+        )
+        self.sent = []
+        self.display._send = self._record
+
+    def test_set_led_on_each_board(self):
+        for i in (0, 599, 600, 1200, 1592):
+            self.display.set_led(i, (1, 2, 3))
+        self.assertEqual(
+            [board for board, _, _ in self.sent], [0, 0, 1, 2, 2]
+        )
+        with self.assertRaises(ValueError):
+            self.display.set_led(num_cells, (1, 2, 3))
+
+    def test_set_leds_sends_only_to_boards_with_leds(self):
+        leds = [1500, 3, 1201, 4]
+        rgb_array = np.arange(12, dtype=np.uint8).reshape(4, 3)
+        self.display.set_leds(leds, rgb_array)
+        self.assertEqual(
+            self.sent, [(0, b"LN", 4 + 5 * 2), (2, b"LN", 4 + 5 * 2)]
+        )
+        np.testing.assert_array_equal(
+            self.display._board_state[leds], rgb_array
+        )
+
+    def test_set_frame_sends_changes_per_board(self):
+        frame = np.zeros((num_cells, 3), dtype=np.uint8)
+        frame[:, 0] = np.arange(num_cells) % 256
+        self.display.set_frame(frame)
+        self.sent.clear()
+        frame[[650, 1300]] = (1, 2, 3)
+        frame[1301] = (4, 5, 6)
+        self.display.set_frame(frame)
+        self.assertEqual(
+            self.sent, [(1, b"LN", 4 + 5), (2, b"LN", 4 + 5 * 2)]
+        )
+
+
+class BufferedModeTests(RecordSentMixin, unittest.TestCase):
+    def setUp(self):
+        self.display = Display1593(buffered=True)
+        self.sent = []
+        self.display._send = self._record
+        self.display.clear_all()
+        self.display.flush()
+        self.sent.clear()
+
+    def test_writes_are_not_sent_until_flush(self):
+        self.display.set_led(5, (1, 2, 3))
+        self.display.set_leds(
+            [6, 900], np.array([[1, 1, 1], [2, 2, 2]], dtype=np.uint8)
+        )
+        self.assertEqual(self.sent, [])
+        np.testing.assert_array_equal(self.display.framebuffer[900], 2)
+        self.display.flush()
+        self.assertEqual(
+            self.sent, [(0, b"LN", 4 + 5 * 2), (1, b"LN", 4 + 5)]
+        )
+
+    def test_show_now_flushes_before_showing(self):
+        self.display.set_leds_one_colour([10, 11], (4, 4, 4))
+        self.display.show_now()
+        self.assertEqual(
+            self.sent,
+            [(0, b"CN", 7 + 2 * 2), (0, b"SN", 2), (1, b"SN", 2)],
+        )
+
+    def test_rewriting_same_colour_sends_nothing(self):
+        self.display.set_led(5, (0, 0, 0))
+        self.display.flush()
+        self.assertEqual(self.sent, [])
+
+    def test_invalid_led_id_raises(self):
+        with self.assertRaises(ValueError):
+            self.display.set_led(num_cells, (1, 1, 1))
+
+
+class OutputLutTests(RecordSentMixin, unittest.TestCase):
+    def setUp(self):
+        self.lut = make_lut(brightness=0.5)
+        self.display = Display1593(output_lut=self.lut)
+        self.sent = []
+        self.display._send = self._record_data
+        self.frame = np.full((num_cells, 3), 200, dtype=np.uint8)
+
+    def test_colours_are_mapped_before_encoding(self):
+        self.display.set_all_leds(self.frame)
+        self.display.set_led(3, (200, 0, 2))
+        self.assertEqual(self.sent[0][1][2:5], bytes((100, 100, 100)))
+        self.assertEqual(self.sent[-1][1][4:], bytes((100, 0, 1)))
+        # The host-side state keeps the colours before the mapping
+        np.testing.assert_array_equal(self.display._board_state[0], 200)
+
+    def test_set_frame_compares_unmapped_colours(self):
+        self.display.set_frame(self.frame)
+        self.sent.clear()
+        self.frame[900] = (201, 200, 200)
+        self.display.set_frame(self.frame)
+        # 201 and 200 both map to 100, but the led did change (and the
+        # board's mapped colours are all the same)
+        self.assertEqual(self.sent, [(1, bytes((67, 65, 100, 100, 100)))])
+
+    def test_changing_lut_resends_current_colours(self):
+        self.display.set_all_leds(self.frame)
+        self.sent.clear()
+        self.display.set_output_lut(None)
+        self.assertEqual([board for board, _ in self.sent], [0, 1])
+        self.assertEqual(self.sent[0][1][2:5], bytes((200, 200, 200)))
+
+    def test_show_image_dimness_combines_with_lut(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "image.png")
+            Image.new("RGB", (64, 64), (200, 200, 200)).save(filename)
+            self.display.show_image(filename, dimness=None)
+            self.display.show_image(filename, dimness=8)
+        # 200 through the lut alone, then 200**2 // 2048 = 19 through it
+        self.assertEqual(self.sent[0][1][2:5], bytes(self.lut[:, 200]))
+        self.assertEqual(self.sent[2][1][2:5], bytes(self.lut[:, 19]))
+
+    def test_lut_must_map_zero_to_zero(self):
+        with self.assertRaises(ValueError):
+            self.display.set_output_lut(np.full(256, 1, dtype=np.uint8))
+
+
+class CalibrationTests(RecordSentMixin, unittest.TestCase):
+    def setUp(self):
+        gains = np.ones((num_cells, 3))
+        gains[1] = (0.5, 1.0, 2.0)
+        self.display = Display1593(calibration=gains)
+        self.sent = []
+        self.display._send = self._record_data
+
+    def test_gains_are_applied_per_led(self):
+        frame = np.full((num_cells, 3), 100, dtype=np.uint8)
+        self.display.set_all_leds(frame)
+        self.display.set_led(1, (10, 10, 10))
+        self.display.set_leds([1, 2], np.full((2, 3), 20, dtype=np.uint8))
+        self.assertEqual(
+            self.sent[0][1][2:11],
+            bytes((100, 100, 100, 50, 100, 200, 100, 100, 100)),
+        )
+        self.assertEqual(self.sent[2][1][4:], bytes((5, 10, 20)))
+        self.assertEqual(
+            self.sent[3][1][4:], bytes((0, 1, 10, 20, 40, 0, 2, 20, 20, 20))
+        )
+
+    def test_one_colour_commands_become_per_led(self):
+        self.display.set_leds_one_colour([0, 1], (100, 100, 100))
+        self.display.set_all_leds_one_colour((100, 100, 100))
+        self.assertEqual(
+            [cmd[:2] for _, cmd in self.sent], [b"LN", b"LA", b"LA"]
+        )
+        self.assertEqual(
+            self.sent[1][1][2:8], bytes((100, 100, 100, 50, 100, 200))
+        )
+
+    def test_removing_calibration_resends_colours(self):
+        self.display.set_all_leds_one_colour((100, 100, 100))
+        self.sent.clear()
+        self.display.set_calibration(None)
+        self.assertEqual(self.sent[0][1][5:8], bytes((100, 100, 100)))
+
+
 if __name__ == "__main__":
     unittest.main()
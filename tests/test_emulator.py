@@ -0,0 +1,340 @@
+import json
+import time
+
+import numpy as np
+import pytest
+import serial
+from serial_comm import connect_to_arduino, send_data_to_arduino
+
+from display1593.display1593 import Display1593
+from display1593.emulator import TeensyEmulator, start_emulators
+from helpers import board_leds
+
+
+def _random_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=(1593, 3), dtype=np.uint8)
+
+
+def test_connect_identifies_swapped_boards(emulators, display):
+    assert [ser.port for ser in display._connections] == [
+        emulators[1].port,
+        emulators[0].port,
+    ]
+
+
+def test_set_all_leds_and_show_now(emulators, display, caplog):
+    frame = _random_frame()
+    with caplog.at_level("WARNING"):
+        display.set_all_leds(frame)
+        display.show_now()
+        display.sync()
+    np.testing.assert_array_equal(board_leds(emulators, "shown"), frame)
+    assert caplog.records == []
+
+
+def test_all_commands_update_emulated_leds(emulators, display, caplog):
+    with caplog.at_level("WARNING"):
+        display.clear_all()
+        display.set_led(1500, (1, 2, 3))
+        display.set_leds(
+            [5, 900], np.array([[4, 5, 6], [7, 8, 9]], dtype=np.uint8)
+        )
+        display.set_leds_one_colour([10, 797, 798], (9, 9, 9))
+        frame = _random_frame()
+        frame[:798] = (3, 3, 3)
+        display.set_frame(frame)
+        frame[[0, 1000]] = (0, 1, 0)
+        display.set_frame(frame)
+        display.sync()
+    np.testing.assert_array_equal(board_leds(emulators), frame)
+    np.testing.assert_array_equal(display._board_state, frame)
+    assert caplog.records == []
+
+
+def test_low_palette_frames_update_emulated_leds(emulators, display):
+    palette = np.array([[0, 0, 0], [255, 0, 0], [0, 0, 255]], np.uint8)
+    rng = np.random.default_rng(1)
+    frame = palette[rng.integers(3, size=1593)]
+    display.set_frame(frame)
+    frame[rng.integers(1593, size=50)] = palette[1]
+    display.set_frame(frame)
+    display.sync()
+    np.testing.assert_array_equal(board_leds(emulators), frame)
+    for board in ["TEENSY1", "TEENSY2"]:
+        commands = display.stats()[board]["commands"]
+        assert sorted(commands) == ["CN"]
+
+
+def test_three_boards(tmp_path):
+    number_of_leds = {"A": 600, "B": 600, "C": 393}
+    with start_emulators(
+        board_names=number_of_leds, leds_per_board=number_of_leds.values()
+    ) as emulators:
+        ports = [emulator.port for emulator in emulators]
+        with Display1593(
+            ports=ports,
+            number_of_leds=number_of_leds,
+            lock_path=str(tmp_path / "lock"),
+        ) as dis:
+            frame = _random_frame()
+            dis.set_frame(frame)
+            frame[[5, 700, 1500]] = (1, 2, 3)
+            dis.set_leds([5, 700, 1500], frame[[5, 700, 1500]])
+            dis.set_led(1592, (4, 5, 6))
+            frame[1592] = (4, 5, 6)
+            dis.show_now()
+            dis.sync()
+    by_name = {e.name: e.shown for e in emulators}
+    shown = np.concatenate([by_name[name] for name in number_of_leds])
+    np.testing.assert_array_equal(shown, frame)
+
+
+def test_set_all_leds_one_colour(emulators, display):
+    display.set_all_leds_one_colour((1, 2, 3))
+    display.sync()
+    assert np.all(board_leds(emulators) == (1, 2, 3))
+
+
+def test_link_speed_is_emulated(tmp_path):
+    baud_rate = 576000
+    with start_emulators(baud_rate=baud_rate) as emulators:
+        ports = [emulator.port for emulator in emulators]
+        with Display1593(ports=ports, lock_path=str(tmp_path / "l")) as dis:
+            start = time.monotonic()
+            dis.set_all_leds(_random_frame())
+            dis.sync()
+            elapsed = time.monotonic() - start
+    # Each board's LA command (and its 2-byte header) is sent in
+    # parallel, at baud_rate bits per second
+    assert elapsed >= (2 + 2 + 3 * 798) * 10 / baud_rate
+
+
+def test_stats_count_commands_per_board(display):
+    display.reset_stats()
+    display.set_all_leds(_random_frame())
+    display.show_now()
+    display.sync()
+    stats = display.stats()
+    assert sorted(stats) == ["TEENSY1", "TEENSY2"]
+    for board, n_leds in [("TEENSY1", 798), ("TEENSY2", 795)]:
+        commands = stats[board]["commands"]
+        assert sorted(commands) == ["LA", "SN"]
+        la = commands["LA"]
+        assert la["count"] == 1
+        assert la["bytes"] == 2 + 3 * n_leds
+        assert la["ack_time"]["count"] == 1
+        assert la["timeouts"] == la["invalid"] == 0
+        assert stats[board]["unexpected_responses"] == 0
+
+
+def test_stage_frame_is_sent_after_the_show(emulators, display):
+    first, second = _random_frame(1), _random_frame(2)
+    display.set_all_leds(first)
+    display.show_now()
+    display.stage_frame(second)
+    display.sync()
+    np.testing.assert_array_equal(board_leds(emulators, "shown"), first)
+    np.testing.assert_array_equal(board_leds(emulators), second)
+    display.show_now()
+    display.sync()
+    np.testing.assert_array_equal(board_leds(emulators, "shown"), second)
+
+
+def test_large_updates_are_split_into_chunks(emulators, tmp_path):
+    ports = [emulator.port for emulator in emulators]
+    frame = _random_frame()
+    leds = np.arange(0, 1592, 2)
+    with Display1593(
+        ports=ports, lock_path=str(tmp_path / "lock"), max_command_bytes=204
+    ) as dis:
+        dis.clear_all()
+        dis.set_leds(leds, frame[leds])
+        dis.set_leds_one_colour(leds + 1, (1, 2, 3))
+        dis.sync()
+    expected = np.zeros((1593, 3), dtype=np.uint8)
+    expected[leds] = frame[leds]
+    expected[leds + 1] = (1, 2, 3)
+    np.testing.assert_array_equal(board_leds(emulators), expected)
+    # TEENSY1 has 399 of the leds: 40 per LN command, 98 per CN
+    by_name = {e.name: e for e in emulators}
+    assert by_name["TEENSY1"].commands["LN"] == 10
+    assert by_name["TEENSY1"].commands["CN"] == 5
+
+
+def test_port_cache_checks_cached_boards(emulators, tmp_path, monkeypatch):
+    import display1593.display1593 as display_module
+
+    serial_numbers = {e.port: f"SN-{e.name}" for e in emulators}
+    monkeypatch.setattr(
+        display_module,
+        "usb_serial_numbers",
+        lambda ports: {port: serial_numbers[port] for port in ports},
+    )
+    ports = [emulator.port for emulator in emulators]
+    kwargs = dict(
+        ports=ports,
+        lock_path=str(tmp_path / "lock"),
+        port_cache_path=str(tmp_path / "ports.json"),
+    )
+    with Display1593(**kwargs):
+        pass
+    assert json.loads((tmp_path / "ports.json").read_text()) == {
+        "SN-TEENSY1": "TEENSY1",
+        "SN-TEENSY2": "TEENSY2",
+    }
+
+    hellos = []
+
+    def record_hello(ser, **kwargs):
+        hellos.append(ser.port)
+        return connect_to_arduino(ser, **kwargs)
+
+    monkeypatch.setattr(display_module, "connect_to_arduino", record_hello)
+    frame = _random_frame()
+    with Display1593(**kwargs) as dis:
+        assert [ser.port for ser in dis._connections] == ports[::-1]
+        dis.set_all_leds(frame)
+        dis.sync()
+    np.testing.assert_array_equal(board_leds(emulators), frame)
+    # One hello per port, to check the cached names
+    assert sorted(hellos) == sorted(ports)
+
+    # A cache naming the wrong boards is caught by the check, and fixed
+    (tmp_path / "ports.json").write_text(
+        json.dumps({"SN-TEENSY1": "TEENSY2", "SN-TEENSY2": "TEENSY1"})
+    )
+    hellos.clear()
+    with Display1593(**kwargs) as dis:
+        assert [ser.port for ser in dis._connections] == ports[::-1]
+    assert len(hellos) == 4
+    assert json.loads((tmp_path / "ports.json").read_text()) == {
+        "SN-TEENSY1": "TEENSY1",
+        "SN-TEENSY2": "TEENSY2",
+    }
+
+    # Goes straight to the handshake if the cache doesn't cover every
+    # port
+    serial_numbers[ports[0]] = "SN-NEW"
+    hellos.clear()
+    with Display1593(**kwargs):
+        pass
+    assert sorted(hellos) == sorted(ports)
+    assert "SN-NEW" in json.loads((tmp_path / "ports.json").read_text())
+
+    # Falls back on the handshake, closing the cached ports, if the
+    # check fails with an error
+    checked = []
+
+    def failing_check(ser, **kwargs):
+        if len(checked) < 2:
+            checked.append(ser)
+            raise serial.SerialException("port went away")
+        return connect_to_arduino(ser, **kwargs)
+
+    monkeypatch.setattr(display_module, "connect_to_arduino", failing_check)
+    with Display1593(**kwargs) as dis:
+        assert [ser.port for ser in dis._connections] == ports[::-1]
+    assert not any(ser.is_open for ser in checked)
+
+
+def test_reconnects_and_replays_state_after_a_fault(emulators, tmp_path):
+    ports = [emulator.port for emulator in emulators]
+    with Display1593(
+        ports=ports, lock_path=str(tmp_path / "lock"), reconnect_timeout=1
+    ) as display:
+        shown, sent = _random_frame(1), _random_frame(2)
+        display.set_all_leds(shown)
+        display.show_now()
+        display.set_all_leds(sent)
+        display.sync()
+        # The first board resets and its connection breaks
+        worker = display._workers[0]
+        by_name = {e.name: e for e in emulators}
+        by_name["TEENSY1"].leds[:] = 0
+        by_name["TEENSY1"].shown[:] = 0
+        worker.ser.close()
+        display.set_led(1, (1, 2, 3))
+        display.sync()
+        assert worker.reconnections == 1
+        assert display._connections[0] is worker.ser
+        sent[1] = (1, 2, 3)
+        np.testing.assert_array_equal(board_leds(emulators, "shown"), shown)
+        np.testing.assert_array_equal(board_leds(emulators), sent)
+
+
+def test_fault_is_raised_by_default(display):
+    display._workers[0].ser.close()
+    display.set_led(1, (1, 2, 3))
+    with pytest.raises(OSError):
+        display.sync()
+
+
+def test_gives_up_on_a_board_that_cant_be_reconnected(emulators, tmp_path):
+    ports = [emulator.port for emulator in emulators]
+    display = Display1593(
+        ports=ports, lock_path=str(tmp_path / "lock"), reconnect_timeout=0.1
+    )
+    display.connect()
+
+    def cant_reconnect(board, old_ser):
+        raise serial.SerialException("unplugged")
+
+    display._reconnect = cant_reconnect
+    try:
+        display._workers[0].ser.close()
+        display.set_led(1, (1, 2, 3))
+        with pytest.raises(OSError):
+            display.sync()
+        # The worker keeps raising the error, rather than hanging
+        with pytest.raises(OSError):
+            display.set_led(2, (1, 2, 3))
+        with pytest.raises(OSError):
+            display.sync()
+    finally:
+        with pytest.raises(OSError):
+            display.disconnect()
+
+
+def test_sampled_verification(emulators, tmp_path):
+    ports = [emulator.port for emulator in emulators]
+    frames = [_random_frame(seed) for seed in range(5)]
+    with Display1593(
+        ports=ports, lock_path=str(tmp_path / "lock"), verify_every=4
+    ) as dis:
+        for frame in frames:
+            dis.set_all_leds(frame)
+            dis.show_now()
+        dis.sync()
+        stats = dis.stats()
+    np.testing.assert_array_equal(board_leds(emulators, "shown"), frames[-1])
+    for board in ("TEENSY1", "TEENSY2"):
+        commands = stats[board]["commands"]
+        # Commands 0, 4 and 8 (LA) and every SN are checked
+        assert commands["LA"]["unverified"] == 2
+        assert commands["SN"]["unverified"] == 0
+        assert commands["LA"]["invalid"] == commands["SN"]["invalid"] == 0
+
+
+def test_show_skew_is_recorded(emulators, display):
+    display.reset_stats()
+    for seed in range(3):
+        display.set_all_leds(_random_frame(seed))
+        display.show_now()
+    display.sync()
+    skew = display.show_skew()
+    assert skew["count"] == 3
+    assert 0 <= skew["max"] < display.ack_timeout
+
+
+def test_check_response(tmp_path):
+    dis = Display1593(ports=(), lock_path=str(tmp_path / "lock"))
+    cmd = np.array(list(b"SN"), dtype=np.uint8)
+    with TeensyEmulator("TEENSY1", 10) as emulator:
+        ser = serial.Serial(emulator.port)
+        try:
+            send_data_to_arduino(ser, cmd)
+            assert dis.check_response(ser, cmd)
+            assert not dis.check_response(ser, cmd, timeout_after=0.05)
+        finally:
+            ser.close()
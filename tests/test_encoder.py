@@ -0,0 +1,175 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from display1593.encoder import CommandEncoder
+
+LEDS_PER_BOARD = [798, 795]
+
+
+def _expected_response(cmd):
+    n, total = len(cmd), int(np.sum(cmd, dtype=np.int64))
+    return np.array(
+        [n >> 8, n & 0xFF] + [(total >> s) & 0xFF for s in (24, 16, 8, 0)],
+        dtype=np.uint8,
+    )
+
+
+def _idx(led):
+    return [led // 256, led % 256]
+
+
+@pytest.fixture
+def encoder():
+    return CommandEncoder(LEDS_PER_BOARD, n_buffers=2)
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(1593, 3), dtype=np.uint8)
+
+
+def _check(cmd, expected):
+    expected = np.array(expected, dtype=np.uint8)
+    np.testing.assert_array_equal(cmd.data, expected)
+    np.testing.assert_array_equal(
+        cmd.expected_response, _expected_response(expected)
+    )
+
+
+def test_la_takes_the_boards_leds_from_the_frame(encoder, frame):
+    _check(encoder.la(1, frame), [76, 65, *frame[798:].flatten()])
+
+
+def test_ln_includes_only_the_boards_leds(encoder, frame):
+    leds = np.array([5, 900, 3, 1592], dtype=np.int32)
+    [cmd] = encoder.ln(1, leds, frame[:4])
+    _check(
+        cmd,
+        [76, 78, 0, 2, *_idx(102), *frame[1], *_idx(794), *frame[3]],
+    )
+
+
+def test_ln_changed_includes_only_changed_leds(encoder, frame):
+    changed = np.zeros(1593, dtype=bool)
+    changed[[1, 300, 1000]] = True
+    [cmd] = encoder.ln_changed(0, changed, frame)
+    _check(
+        cmd,
+        [76, 78, 0, 2, *_idx(1), *frame[1], *_idx(300), *frame[300]],
+    )
+
+
+def test_cn_sets_one_colour(encoder):
+    leds = np.array([5, 900, 3], dtype=np.int32)
+    [cmd] = encoder.cn(0, leds, (1, 2, 250))
+    _check(cmd, [67, 78, 0, 2, 1, 2, 250, *_idx(5), *_idx(3)])
+
+
+def test_no_commands_for_leds_on_other_boards(encoder, frame):
+    leds = np.array([5, 900], dtype=np.int32)
+    assert list(encoder.ln(0, leds[1:], frame[:1])) == []
+    assert list(encoder.cn(1, leds[:1], (1, 2, 3))) == []
+
+
+def test_read_only_inputs_are_accepted(encoder, frame):
+    frame = np.frombuffer(frame.tobytes(), np.uint8).reshape(frame.shape)
+    leds = np.frombuffer(np.array([5, 900], np.int32).tobytes(), np.int32)
+    changed = np.zeros(1593, dtype=bool)
+    changed[5] = True
+    changed.flags.writeable = False
+    _check(encoder.la(0, frame), [76, 65, *frame[:798].flatten()])
+    [cmd] = encoder.ln(0, leds, frame[:2])
+    _check(cmd, [76, 78, 0, 1, *_idx(5), *frame[0]])
+    [cmd] = encoder.ln_changed(0, changed, frame)
+    _check(cmd, [76, 78, 0, 1, *_idx(5), *frame[5]])
+    [cmd] = encoder.cn(1, leds, (1, 2, 3))
+    _check(cmd, [67, 78, 0, 1, 1, 2, 3, *_idx(102)])
+    _check(encoder.raw(0, np.frombuffer(b"SN", np.uint8)), list(b"SN"))
+
+
+def test_large_updates_are_split(frame):
+    encoder = CommandEncoder(LEDS_PER_BOARD, 2, max_command_bytes=4 + 5 * 3)
+    leds = np.arange(0, 1593, 100, dtype=np.int32)  # 8 on each board
+    cmds = list(encoder.ln(0, leds, frame[leds]))
+    assert [cmd.length for cmd in cmds] == [4 + 5 * 3] * 2 + [4 + 5 * 2]
+    _check(
+        cmds[2],
+        [76, 78, 0, 2, *_idx(600), *frame[600], *_idx(700), *frame[700]],
+    )
+
+    changed = np.zeros(1593, dtype=bool)
+    changed[leds] = True
+    cmds = list(encoder.ln_changed(1, changed, frame))
+    assert [cmd.length for cmd in cmds] == [4 + 5 * 3] * 2 + [4 + 5 * 2]
+    _check(
+        cmds[0],
+        [76, 78, 0, 3]
+        + [*_idx(2), *frame[800], *_idx(102), *frame[900]]
+        + [*_idx(202), *frame[1000]],
+    )
+
+    cmds = list(encoder.cn(1, leds, (1, 2, 3)))
+    # (19 - 7) // 2 = 6 leds per command
+    assert [cmd.length for cmd in cmds] == [7 + 2 * 6, 7 + 2 * 2]
+
+
+def test_raw_copies_command(encoder):
+    cmd = np.array(list(b"SN"), dtype=np.uint8)
+    _check(encoder.raw(0, cmd), cmd)
+
+
+def test_released_buffers_are_reused(encoder, frame):
+    cmd = encoder.la(0, frame)
+    buf = cmd.buf
+    cmd.release()
+    assert encoder.la(0, frame).buf is buf
+
+
+def test_no_steady_state_allocations_per_frame(encoder, frame):
+    leds = np.arange(0, 1593, 3, dtype=np.int32)
+    rgb_array = frame[leds]
+    changed = np.zeros(1593, dtype=bool)
+    changed[::5] = True
+
+    def encode_frame():
+        for board in range(len(LEDS_PER_BOARD)):
+            encoder.la(board, frame).release()
+            for cmd in encoder.ln(board, leds, rgb_array):
+                cmd.release()
+            for cmd in encoder.ln_changed(board, changed, frame):
+                cmd.release()
+            for cmd in encoder.cn(board, leds, (1, 2, 3)):
+                cmd.release()
+
+    # Warm up (numba compilation, caches)
+    for _ in range(10):
+        encode_frame()
+
+    tracemalloc.start()
+    try:
+        encode_frame()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(100):
+            encode_frame()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Nothing retained per frame, and nothing transient anywhere near
+    # the size of a frame (the old encoding path allocated several
+    # frame-sized temporary arrays per board)
+    assert after - before == 0
+    assert peak - before < 1024
+
+
+def test_partition_splits_leds_by_board():
+    encoder = CommandEncoder([3, 0, 4, 2], n_buffers=1)
+    leds = np.array([8, 0, 3, 2, 7, 4], dtype=np.int32)
+    parts = [(b, rows.tolist()) for b, rows in encoder.partition(leds)]
+    assert parts == [(0, [1, 3]), (2, [2, 5]), (3, [0, 4])]
+    boards = [encoder.board_of(led) for led in (0, 2, 3, 6, 7, 8)]
+    assert boards == [0, 0, 2, 2, 3, 3]
@@ -0,0 +1,83 @@
+import numpy as np
+import serial
+from serial_comm import connect_to_arduino, send_data_to_arduino
+
+from display1593.emulator import TeensyEmulator
+from display1593.encoder import CommandEncoder
+from display1593.framing import (
+    ResponseParser,
+    encode_message,
+    write_command,
+    write_message,
+)
+
+
+class FakeSerial:
+    """A port that records what is written to it."""
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _payload(*values):
+    return np.array(values, dtype=np.uint8)
+
+
+def test_message_is_what_serial_comm_sends():
+    long_payload = np.arange(300).astype(np.uint8)
+    for payload in [_payload(76, 67), _payload(), long_payload]:
+        ser = FakeSerial()
+        send_data_to_arduino(ser, payload)
+        assert encode_message(payload) == b"".join(ser.written)
+
+
+def test_send_is_a_single_write():
+    ser = FakeSerial()
+    write_message(ser, _payload(76, 67))
+    assert ser.written == [encode_message(_payload(76, 67))]
+    cmd = CommandEncoder([10], 1).raw(0, _payload(83, 78))
+    ser = FakeSerial()
+    write_command(ser, cmd)
+    assert ser.written == [encode_message(_payload(83, 78))]
+
+
+def test_parser_handles_messages_split_anywhere():
+    payloads = [_payload(*b"TEENSY1"), _payload(*range(6)), _payload(9)]
+    stream = b"".join(encode_message(p) for p in payloads)
+    for split in range(len(stream) + 1):
+        parser = ResponseParser()
+        messages = parser.feed(stream[:split]) + parser.feed(stream[split:])
+        assert [m.tolist() for m in messages] == [p.tolist() for p in payloads]
+        assert len(parser) == 0
+
+
+def test_parser_keeps_partial_message():
+    message = encode_message(_payload(1, 2, 3))
+    parser = ResponseParser()
+    assert parser.feed(message[:-1]) == []
+    assert len(parser) == len(message) - 1
+    [payload] = parser.feed(message[-1:] + message[:1])
+    assert payload.tolist() == [1, 2, 3]
+    assert len(parser) == 1
+
+
+def test_hello_and_response_with_emulator():
+    with TeensyEmulator("TEENSY1", 10) as emulator:
+        ser = serial.Serial(emulator.port, timeout=2)
+        try:
+            assert connect_to_arduino(ser) == (0, "TEENSY1")
+            write_message(ser, _payload(83, 78))
+            parser = ResponseParser()
+            messages = []
+            while not messages:
+                messages = parser.feed(ser.read(ser.in_waiting or 1))
+        finally:
+            ser.close()
+    assert messages[0].tolist() == [0, 2, 0, 0, 0, ord("S") + ord("N")]
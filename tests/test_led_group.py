@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from display1593.display1593 import Display1593
+
+
+def _recording(display):
+    # Replace display._send to record the commands (and the responses
+    # expected) instead of sending them
+    display.sent = []
+
+    def record(board, cmd):
+        display.sent.append(
+            (board, cmd.data.tobytes(), cmd.expected_response.tobytes())
+        )
+        cmd.release()
+
+    display._send = record
+    return display
+
+
+@pytest.fixture
+def display():
+    return _recording(Display1593())
+
+
+LEDS = [5, 900, 3, 1500, 797, 798]
+
+
+def _sent_by(display, method, *args):
+    display.sent.clear()
+    method(*args)
+    return list(display.sent)
+
+
+def test_group_sends_the_same_commands(display):
+    group = display.compile_group(LEDS)
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        rgb = rng.integers(0, 256, (len(LEDS), 3), dtype=np.uint8)
+        assert _sent_by(display, group.set_leds, rgb) == _sent_by(
+            display, display.set_leds, LEDS, rgb
+        )
+        colour = tuple(rng.integers(0, 256, 3))
+        assert _sent_by(
+            display, group.set_leds_one_colour, colour
+        ) == _sent_by(display, display.set_leds_one_colour, LEDS, colour)
+
+
+def test_group_updates_board_state(display):
+    group = display.compile_group(LEDS)
+    group.set_leds_one_colour((1, 2, 3))
+    np.testing.assert_array_equal(display._board_state[LEDS], [(1, 2, 3)] * 6)
+
+
+def test_group_is_chunked_like_set_leds():
+    display = _recording(Display1593(max_command_bytes=4 + 5 * 100))
+    group = display.compile_group(np.arange(0, 1593, 3))
+    rgb = np.full((len(group), 3), 7, dtype=np.uint8)
+    from_group = _sent_by(display, group.set_leds, rgb)
+    assert len(from_group) > 2
+    assert from_group == _sent_by(display, display.set_leds, group.leds, rgb)
+
+
+def test_group_in_buffered_mode_writes_framebuffer():
+    display = Display1593(buffered=True)
+    group = display.compile_group(LEDS)
+    group.set_leds_one_colour((4, 5, 6))
+    np.testing.assert_array_equal(display.framebuffer[LEDS], [[4, 5, 6]] * 6)
+    assert display._dirty[LEDS].all()
+
+
+def test_invalid_led_id_raises(display):
+    with pytest.raises(ValueError):
+        display.compile_group([1593])
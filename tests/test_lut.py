@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from display1593.lut import apply_lut, check_lut, make_lut
+
+
+def test_make_lut_gamma_and_brightness():
+    lut = make_lut(gamma=2, brightness=(1, 0.5, 0))
+    assert lut.shape == (3, 256)
+    assert lut.dtype == np.uint8
+    np.testing.assert_array_equal(lut[:, 255], (255, 128, 0))
+    np.testing.assert_array_equal(lut[:, 0], 0)
+    assert lut[0, 128] == round(255 * (128 / 255) ** 2)
+
+
+def test_identity_lut():
+    np.testing.assert_array_equal(make_lut()[1], np.arange(256))
+
+
+def test_check_lut_broadcasts_single_channel_table():
+    lut = check_lut(np.arange(256, dtype=np.uint8))
+    assert lut.shape == (3, 256)
+    with pytest.raises(ValueError):
+        check_lut(np.arange(256))
+
+
+def test_apply_lut_into_channel_major_buffer():
+    lut = make_lut(brightness=(1, 0.5, 0.25))
+    rgb = np.array([[200, 200, 200], [10, 20, 40]], dtype=np.uint8)
+    out = np.zeros((3, 2), dtype=np.uint8).T
+    apply_lut(lut, rgb, out)
+    np.testing.assert_array_equal(out, [[200, 100, 50], [10, 10, 10]])
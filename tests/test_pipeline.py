@@ -0,0 +1,159 @@
+import threading
+
+import numpy as np
+import pytest
+
+import display1593.pipeline as pipeline_module
+from display1593.encoder import CommandEncoder, calc_expected_response
+from display1593.pipeline import AckErrorRateExceeded, AckPipeline
+from display1593.stats import CommandStats
+
+
+class FakeBoard:
+    """Stands in for a serial connection to one board: records the
+    commands written to it."""
+
+    def __init__(self):
+        self.received = []
+
+
+@pytest.fixture
+def board(monkeypatch):
+    monkeypatch.setattr(
+        pipeline_module,
+        "write_command",
+        lambda ser, cmd: ser.received.append(cmd.data.copy()),
+    )
+    return FakeBoard()
+
+
+def _cmd(*values):
+    return np.array(values, dtype=np.uint8)
+
+
+def _send(pipeline, cmd):
+    pipeline.send(CommandEncoder([10], 1).raw(0, cmd))
+
+
+def test_sends_without_waiting_until_window_is_full(board):
+    pipeline = AckPipeline(board, window=3, timeout=5)
+    for i in range(3):
+        _send(pipeline, _cmd(83, 78, i))
+    assert len(board.received) == 3
+    assert len(pipeline) == 3
+
+
+def test_full_window_waits_for_oldest_ack(board, caplog):
+    pipeline = AckPipeline(board, window=2, timeout=5)
+    _send(pipeline, _cmd(1))
+    _send(pipeline, _cmd(2))
+    ack = threading.Timer(
+        0.1, pipeline.handle_response, [calc_expected_response(_cmd(1))]
+    )
+    ack.start()
+    with caplog.at_level("WARNING"):
+        _send(pipeline, _cmd(3))
+    ack.join()
+    assert len(board.received) == 3
+    assert len(pipeline) == 2
+    assert caplog.records == []
+
+
+def test_responses_matched_in_fifo_order(board, caplog):
+    pipeline = AckPipeline(board, window=4)
+    cmds = [_cmd(76, 65, i) for i in range(4)]
+    for cmd in cmds:
+        _send(pipeline, cmd)
+    with caplog.at_level("WARNING"):
+        for cmd in cmds:
+            pipeline.handle_response(calc_expected_response(cmd))
+        pipeline.drain()
+    assert len(pipeline) == 0
+    assert caplog.records == []
+
+
+def test_invalid_response_is_logged_and_consumed(board, caplog):
+    pipeline = AckPipeline(board, window=4)
+    _send(pipeline, _cmd(1, 2, 3))
+    with caplog.at_level("WARNING"):
+        pipeline.handle_response(_cmd(0, 3, 0, 0, 0, 7))
+    assert len(pipeline) == 0
+    assert "Resp invalid" in caplog.text
+
+
+def test_debug_message_does_not_acknowledge(board):
+    pipeline = AckPipeline(board, window=4)
+    _send(pipeline, _cmd(1, 2, 3))
+    pipeline.handle_response(np.array([0, 0, *b"hi"], dtype=np.uint8))
+    assert len(pipeline) == 1
+    pipeline.handle_response(calc_expected_response(_cmd(1, 2, 3)))
+    assert len(pipeline) == 0
+
+
+def test_timeout_gives_up_on_oldest_command(board, caplog):
+    pipeline = AckPipeline(board, window=1, timeout=0.05)
+    _send(pipeline, _cmd(1))
+    with caplog.at_level("WARNING"):
+        _send(pipeline, _cmd(2))
+    assert "Timeout" in caplog.text
+    assert len(pipeline) == 1
+
+
+def test_abandon_forgets_outstanding_commands(board):
+    pipeline = AckPipeline(board, window=2, timeout=5)
+    _send(pipeline, _cmd(1))
+    _send(pipeline, _cmd(2))
+    pipeline.abandon()
+    assert len(pipeline) == 0
+    pipeline.drain()
+
+
+def test_sampled_verification_checks_every_nth_command(board, caplog):
+    stats = CommandStats()
+    pipeline = AckPipeline(
+        board, window=1, timeout=5, stats=stats, board="B", verify_every=3
+    )
+    cmds = [_cmd(76, 65, i) for i in range(6)]
+    for cmd in cmds:
+        _send(pipeline, cmd)
+    # Sent without waiting for the responses
+    assert len(board.received) == len(pipeline) == 6
+    with caplog.at_level("WARNING"):
+        for _ in cmds:
+            pipeline.handle_response(_cmd(0, 3, 0, 0, 0, 7))
+    assert caplog.records == []
+    la = stats.snapshot()["B"]["commands"]["LA"]
+    assert la["invalid"] == 2
+    assert la["unverified"] == 4
+    assert pipeline.take_error() is None
+
+
+def test_sampled_verification_checks_every_sn(board):
+    stats = CommandStats()
+    pipeline = AckPipeline(board, stats=stats, board="B", verify_every=100)
+    for _ in range(3):
+        _send(pipeline, _cmd(83, 78))
+    for _ in range(3):
+        pipeline.handle_response(calc_expected_response(_cmd(83, 78)))
+    sn = stats.snapshot()["B"]["commands"]["SN"]
+    assert sn["unverified"] == sn["invalid"] == 0
+    assert sn["ack_time"]["count"] == 3
+
+
+def test_error_rate_over_max_is_raised(board, monkeypatch, caplog):
+    monkeypatch.setattr(pipeline_module, "ERROR_RATE_WINDOW", 4)
+    pipeline = AckPipeline(board, verify_every=1, max_error_rate=0.3)
+    for i in range(4):
+        _send(pipeline, _cmd(76, 65, i))
+    for i in range(4):
+        cmd = _cmd(76, 65, i if i < 3 else 99)
+        pipeline.handle_response(calc_expected_response(cmd))
+    # 1 in 4 invalid: logged only
+    assert "error rate 25.0%" in caplog.text
+    assert pipeline.take_error() is None
+    for i in range(4):
+        _send(pipeline, _cmd(76, 65, i))
+    for i in range(4):
+        pipeline.handle_response(_cmd(0, 3, 0, 0, 0, 7))
+    assert isinstance(pipeline.take_error(), AckErrorRateExceeded)
+    assert pipeline.take_error() is None
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+from display1593.player import FramePlayer, RateGovernor
+
+
+class FakeDisplay:
+    """Records the frames sent and when they were shown."""
+
+    def __init__(self, send_time=0.0):
+        self.send_time = send_time
+        self.sent = []
+        self.shown = []
+
+    def set_frame(self, frame):
+        time.sleep(self.send_time)
+        self.sent.append(frame)
+
+    def show_at(self, t):
+        delay = t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.shown.append((self.sent[-1], time.monotonic()))
+
+    def sync(self):
+        pass
+
+
+def test_frames_are_shown_at_fixed_rate():
+    dis = FakeDisplay()
+    player = FramePlayer(dis, range(10), fps=100)
+    player.play()
+    assert [frame for frame, _ in dis.shown] == list(range(10))
+    times = [t for _, t in dis.shown]
+    # No drift: frame k is shown close to start + k / fps
+    assert times[-1] - times[0] == pytest.approx(0.09, abs=0.02)
+    stats = player.stats()
+    assert stats["frames_shown"] == 10
+    assert stats["frames_dropped"] == 0
+    assert len(player.history) == 10
+
+
+def test_stale_frames_are_dropped():
+    # Each frame takes 2.5 periods to send, so the player keeps falling
+    # behind and has to skip frames to catch up
+    dis = FakeDisplay(send_time=0.025)
+    player = FramePlayer(dis, range(20), fps=100)
+    player.play()
+    stats = player.stats()
+    assert stats["frames_dropped"] > 0
+    assert stats["frames_shown"] + stats["frames_dropped"] == 20
+    assert stats["frames_shown"] == len(dis.shown)
+
+
+def test_n_frames():
+    dis = FakeDisplay()
+    player = FramePlayer(dis, iter(int, 1), fps=100)
+    player.play(n_frames=5)
+    stats = player.stats()
+    assert stats["frames_shown"] + stats["frames_dropped"] == 5
+
+
+def test_send_method():
+    dis = FakeDisplay()
+    player = FramePlayer(
+        dis, range(3), fps=100, send=lambda f: dis.sent.append(-f)
+    )
+    player.play()
+    assert [frame for frame, _ in dis.shown] == [0, -1, -2]
+
+
+def test_double_buffered_uses_stage_frame():
+    dis = FakeDisplay()
+    dis.stage_frame = dis.set_frame
+    player = FramePlayer(dis, range(3), fps=1000, double_buffered=True)
+    assert player.send == dis.stage_frame
+
+
+def test_governor_slows_down_to_what_the_display_sustains():
+    # Frames take 20 ms to send, so 100 fps can't be kept up: the
+    # governed player settles at the rate the frames allow instead of
+    # dropping them
+    dis = FakeDisplay(send_time=0.02)
+    governor = RateGovernor(max_fps=100, headroom=0.1)
+    player = FramePlayer(dis, range(10), governor=governor)
+    player.play()
+    stats = player.stats()
+    assert stats["frames_shown"] == 10
+    assert stats["frames_dropped"] == 0
+    assert governor.frame_time == pytest.approx(0.02, abs=0.01)
+    assert stats["target_fps"] == pytest.approx(1 / 0.022, rel=0.3)
+
+
+def test_governor_caps_frame_rate():
+    dis = FakeDisplay()
+    player = FramePlayer(dis, range(6), governor=RateGovernor(max_fps=50))
+    player.play()
+    times = [t for _, t in dis.shown]
+    assert times[-1] - times[0] == pytest.approx(0.1, abs=0.03)
+
+
+def test_governor_smoothing():
+    governor = RateGovernor(rise=0.5, fall=0.1)
+    assert governor.period == 0.0
+    governor.record(0.1)
+    governor.record(0.2)
+    assert governor.frame_time == pytest.approx(0.15)
+    governor.record(0.05)
+    assert governor.frame_time == pytest.approx(0.14)
+
+
+def test_fps_or_governor_is_required():
+    with pytest.raises(ValueError):
+        FramePlayer(FakeDisplay(), range(3))
+
+
+def test_governor_cant_be_double_buffered():
+    with pytest.raises(ValueError):
+        FramePlayer(
+            FakeDisplay(),
+            range(3),
+            double_buffered=True,
+            governor=RateGovernor(),
+        )
@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from display1593.shared_frame import SharedFramebuffer
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "display1593.frame")
+
+
+def _render(path, n_frames):
+    with SharedFramebuffer(path) as shared:
+        for i in range(1, n_frames + 1):
+            with shared.writing() as frame:
+                frame[:] = i % 256
+
+
+def test_frames_written_by_another_process(path):
+    with SharedFramebuffer(path, create=True) as shared:
+        process = multiprocessing.get_context("fork").Process(
+            target=_render, args=(path, 500)
+        )
+        process.start()
+        frames = shared.frames()
+        while process.is_alive():
+            frame = next(frames)
+            # Never a partly written frame
+            assert np.all(frame == frame[0, 0])
+        process.join()
+        assert shared.sequence == 500
+        assert np.all(next(frames) == 500 % 256)
+
+
+def test_read_into_returns_sequence(path):
+    with SharedFramebuffer(path, n_leds=4, create=True) as shared:
+        with SharedFramebuffer(path, n_leds=4) as renderer:
+            renderer.write(np.arange(12).reshape(4, 3))
+        out = np.zeros((4, 3), dtype=np.uint8)
+        assert shared.read_into(out) == 1
+        np.testing.assert_array_equal(out, np.arange(12).reshape(4, 3))
+
+
+def test_frame_is_published_when_written(path):
+    with SharedFramebuffer(path, n_leds=4, create=True) as shared:
+        shared.write(np.full((4, 3), 1))
+        out = np.zeros((4, 3), dtype=np.uint8)
+        with shared.writing() as frame:
+            # Starts as a copy of the current frame
+            assert np.all(frame == 1)
+            frame[0] = 2
+            # Readers still get the previous frame
+            assert shared.read_into(out) == 1
+            assert np.all(out == 1)
+        assert shared.read_into(out) == 2
+        assert out[0].tolist() == [2, 2, 2] and np.all(out[1:] == 1)
+        with pytest.raises(RuntimeError):
+            with shared.writing() as frame:
+                frame[:] = 3
+                raise RuntimeError
+        assert shared.read_into(out) == 2
+        assert not np.any(out == 3)
+        # (A view of the mapped file can't outlive it)
+        del frame
+
+
+def test_size_mismatch(path):
+    with SharedFramebuffer(path, n_leds=4, create=True):
+        with pytest.raises(ValueError):
+            SharedFramebuffer(path, n_leds=5)
+
+
+def test_owner_removes_file(path):
+    SharedFramebuffer(path, create=True).close()
+    with pytest.raises(FileNotFoundError):
+        SharedFramebuffer(path)
+
+
+def test_file_is_private(path):
+    with open(path, "w"):
+        pass
+    os.chmod(path, 0o666)
+    with SharedFramebuffer(path, create=True):
+        assert os.stat(path).st_mode & 0o777 == 0o600
+    with SharedFramebuffer(path, create=True, mode=0o660):
+        assert os.stat(path).st_mode & 0o777 == 0o660
@@ -0,0 +1,44 @@
+import time
+
+import numpy as np
+
+from display1593.timing import MAX_SPIN_MARGIN, MIN_SPIN_MARGIN, DeadlineTimer
+
+
+def test_wakes_at_deadline_not_before():
+    timer = DeadlineTimer()
+    errors = []
+    for _ in range(50):
+        deadline = time.monotonic() + 0.002
+        errors.append(timer.sleep_until(deadline))
+        assert time.monotonic() >= deadline
+    assert min(errors) >= 0
+    # Typically well under a millisecond late. Even the 90th percentile
+    # is up to the scheduler, on a loaded machine
+    assert np.median(errors) < 0.0005
+    stats = timer.stats()
+    assert stats["count"] == 50
+    assert 0 <= stats["error_mean"] <= stats["error_max"]
+
+
+def test_passed_deadline_returns_straight_away():
+    timer = DeadlineTimer()
+    error = timer.sleep_until(time.monotonic() - 1)
+    assert error >= 1
+
+
+def test_spin_margin_adapts_within_limits():
+    timer = DeadlineTimer(spin_margin=0.004)
+    for _ in range(3):
+        timer.sleep_until(time.monotonic() + 0.01)
+    assert MIN_SPIN_MARGIN <= timer.spin_margin <= MAX_SPIN_MARGIN
+    fixed = DeadlineTimer(spin_margin=0.004, adaptive=False)
+    fixed.sleep_until(time.monotonic() + 0.01)
+    assert fixed.spin_margin == 0.004
+
+
+def test_reset_stats():
+    timer = DeadlineTimer()
+    timer.sleep_until(time.monotonic())
+    timer.reset_stats()
+    assert timer.stats()["count"] == 0